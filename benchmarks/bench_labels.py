@@ -0,0 +1,42 @@
+"""
+زمن توليد الملصق الحراري (µs لكل ملصق) لكل صيغة + sha256 لعينة ثابتة للمقارنة بين الأجهزة.
+
+    python benchmarks/bench_labels.py [N]
+"""
+
+import hashlib
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main
+
+SAMPLE = ("RD-A-000123", "+966 50 123 4567", "ATTA Repair")
+
+
+def bench_label_renderers(n: int = 20000) -> dict:
+    report = {}
+    for fmt, render in main.LABEL_RENDERERS.items():
+        t0 = time.perf_counter()
+        for _ in range(n):
+            render(*SAMPLE)
+        us = (time.perf_counter() - t0) * 1e6 / n
+        out = render(*SAMPLE)
+        report[fmt] = {
+            "us_per_label": round(us, 2),
+            "bytes": len(out),
+            "sha256": hashlib.sha256(out).hexdigest(),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    print(
+        json.dumps(
+            bench_label_renderers(int(sys.argv[1]) if len(sys.argv) > 1 else 20000),
+            indent=2,
+        )
+    )
@@ -0,0 +1,401 @@
+# خادم المحل المحلي (LAN): يملك ملف repairdesk.db ويخدم أجهزة الكاشير عبر JSON
+# تشغيل:  python local_server.py  ثم ضبط "Shop server (LAN) URL…" في كل جهاز
+import datetime
+import logging
+import os
+import secrets
+import threading
+from functools import wraps
+
+from flask import Flask, jsonify, request
+
+import repairdesk_data as rd
+
+app = Flask(__name__)
+
+backend = rd.LocalBackend()
+# SQLite يسمح بكاتب واحد؛ نسلسل الكتابات هنا بدل ترك الأجهزة تتزاحم على القفل
+write_lock = threading.Lock()
+
+API_TOKEN = os.environ.get("REPAIRDESK_API_TOKEN") or rd.SETTINGS.get("api_token", "")
+# الرمز يُكتب هنا فقط (لا يُطبع): ملف يقرؤه حساب المحل وحده
+API_TOKEN_PATH = rd.DATA_DIR / "api_token.txt"
+
+# الحقول المسموحة لإنشاء سند (معاملات create_receipt)
+CREATE_FIELDS = {
+    "name",
+    "phone",
+    "dev_type",
+    "brand",
+    "model",
+    "serial",
+    "color",
+    "accessories",
+    "device_state",
+    "issue",
+    "work",
+    "est",
+    "device_id",
+}
+
+
+def _write_token_file(token: str):
+    fd = os.open(API_TOKEN_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token + "\n")
+    os.chmod(API_TOKEN_PATH, 0o600)  # الملف قد يكون موجوداً بصلاحيات أوسع
+
+
+def ensure_api_token() -> str:
+    """
+    لا خادم بلا رمز: نولّد رمزاً أول مرة ونحفظه في الإعدادات وفي API_TOKEN_PATH،
+    ويُنسخ منه إلى كل جهاز من "Shop server (LAN) URL…".
+    """
+    global API_TOKEN
+    if not API_TOKEN:
+        API_TOKEN = secrets.token_urlsafe(24)
+        rd.SETTINGS["api_token"] = API_TOKEN
+        rd.save_settings(rd.SETTINGS)
+    _write_token_file(API_TOKEN)
+    logging.info(f"API token written to {API_TOKEN_PATH}")
+    return API_TOKEN
+
+
+def require_token(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        supplied = request.headers.get("X-Api-Token", "")
+        if not API_TOKEN or not secrets.compare_digest(supplied, API_TOKEN):
+            return jsonify({"ok": False, "msg": "⛔ رمز الوصول غير صحيح"}), 401
+        return fn(*args, **kwargs)
+
+    return wrapper
+
+
+@app.route("/api/health")
+def health():
+    return jsonify({"status": "running"})
+
+
+@app.route("/api/login", methods=["POST"])
+@require_token
+def login():
+    data = request.json or {}
+    auth = backend.login(data.get("username", ""), data.get("password", ""))
+    if not auth:
+        return jsonify({"ok": False, "msg": "بيانات الدخول غير صحيحة"}), 404
+    user, branch = auth
+    return jsonify({"ok": True, "user": user, "branch": branch})
+
+
+@app.route("/api/branches/<int:branch_id>/dashboard")
+@require_token
+def dashboard(branch_id):
+    return jsonify(backend.dashboard_stats(branch_id))
+
+
+@app.route("/api/owner/dashboard")
+@require_token
+def owner_dashboard():
+    return jsonify(backend.owner_dashboard())
+
+
+@app.route("/api/branches")
+@require_token
+def branches():
+    return jsonify(backend.branches())
+
+
+@app.route("/api/customers")
+@require_token
+def customers():
+    return jsonify([list(r) for r in backend.customers()])
+
+
+@app.route("/api/devices/stats")
+@require_token
+def device_stats():
+    return jsonify([list(r) for r in backend.device_stats()])
+
+
+@app.route("/api/devices/history")
+@require_token
+def device_history():
+    return jsonify(backend.device_history(request.args.get("serial", "")))
+
+
+@app.route("/api/customers/history")
+@require_token
+def customer_history():
+    args = request.args
+    cid = args.get("id")
+    data = backend.customer_history(int(cid) if cid else None, args.get("phone", ""))
+    if not data:
+        return jsonify({"ok": False, "msg": "العميل غير موجود"}), 404
+    return jsonify(data)
+
+
+@app.route("/api/campaigns/candidates")
+@require_token
+def campaign_candidates():
+    args = request.args
+    return jsonify(
+        backend.campaign_candidates(
+            int(args.get("branch_id", 0)), int(args.get("min_days", 0))
+        )
+    )
+
+
+@app.route("/api/reports/revenue")
+@require_token
+def revenue():
+    args = request.args
+    try:
+        start = datetime.date.fromisoformat(args["start"])
+        end = datetime.date.fromisoformat(args["end"])
+    except (KeyError, ValueError):
+        return jsonify({"ok": False, "msg": "start/end بصيغة YYYY-MM-DD"}), 400
+    branch_id = args.get("branch_id")
+    rows = backend.revenue_report(start, end, int(branch_id) if branch_id else None)
+    return jsonify([list(r) for r in rows])
+
+
+@app.route("/api/receipts")
+@require_token
+def search():
+    args = request.args
+    rows = backend.search_receipts(
+        int(args.get("branch_id", 0)),
+        q=args.get("q", ""),
+        status=args.get("status", ""),
+        paid=args.get("paid", ""),
+        include_archive=args.get("include_archive") == "1",
+    )
+    return jsonify([list(r) for r in rows])
+
+
+@app.route("/api/receipts/<int:rid>")
+@require_token
+def detail(rid):
+    d = backend.receipt_detail(rid)
+    if not d:
+        return jsonify({"ok": False, "msg": "السند غير موجود"}), 404
+    d["log"] = [list(x) for x in d["log"]]
+    return jsonify(d)
+
+
+@app.route("/api/receipts/<int:rid>/version")
+@require_token
+def version(rid):
+    v = backend.receipt_version(rid)
+    return jsonify({"version": list(v) if v else None})
+
+
+@app.route("/api/receipts/by-phone-suffix")
+@require_token
+def by_phone_suffix():
+    args = request.args
+    rows = backend.receipts_by_phone_suffix(
+        int(args.get("branch_id", 0)), args.get("digits", "")
+    )
+    return jsonify([list(r) for r in rows])
+
+
+@app.route("/api/receipts/numbers")
+@require_token
+def receipt_numbers():
+    return jsonify([list(r) for r in backend.receipt_numbers()])
+
+
+@app.route("/api/palette/receipts")
+@require_token
+def palette_receipts():
+    res = backend.palette_rows(request.args.get("since", 0, type=int))
+    res["rows"] = [list(r) for r in res["rows"]]
+    return jsonify(res)
+
+
+@app.route("/api/receipts/by-no/<receipt_no>")
+@require_token
+def by_no(receipt_no):
+    rid = backend.receipt_id_by_no(receipt_no)
+    if not rid:
+        return jsonify({"ok": False, "msg": "السند غير موجود"}), 404
+    return jsonify({"id": rid})
+
+
+@app.route("/api/receipts", methods=["POST"])
+@require_token
+def create():
+    data = dict(request.json or {})
+    branch = data.pop("branch", None)
+    username = data.pop("username", "")
+    if not branch or not data.get("name") or not data.get("phone"):
+        return jsonify({"ok": False, "msg": "بيانات ناقصة"}), 400
+    unknown = sorted(set(data) - CREATE_FIELDS)
+    if unknown:
+        return jsonify({"ok": False, "msg": f"حقول غير معروفة: {unknown}"}), 400
+    try:
+        data["est"] = float(data.get("est") or 0)
+        if data.get("device_id") is not None:
+            data["device_id"] = int(data["device_id"])
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "msg": "قيم غير صالحة"}), 400
+    with write_lock:
+        res = backend.create_receipt(branch, username, **data)
+    return jsonify(res)
+
+
+@app.route("/api/receipts/<int:rid>/status", methods=["POST"])
+@require_token
+def status(rid):
+    data = request.json or {}
+    new_status = data.get("status", "")
+    if new_status not in rd.STATUS_ORDER:
+        return jsonify({"ok": False, "msg": "حالة غير معروفة"}), 400
+    with write_lock:
+        prev = backend.set_status(rid, new_status, data.get("username", ""))
+    return jsonify({"ok": True, "previous": prev})
+
+
+@app.route("/api/receipts/<int:rid>/payment", methods=["POST"])
+@require_token
+def payment(rid):
+    data = request.json or {}
+    try:
+        approved = float(data.get("approved") or 0)
+        paid = float(data.get("paid") or 0)
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "msg": "المبالغ يجب أن تكون أرقامًا"}), 400
+    with write_lock:
+        flag = backend.save_payment(rid, approved, paid, data.get("method", ""))
+    return jsonify({"ok": True, "paid_flag": flag})
+
+
+@app.route("/api/receipts/<int:rid>/unarchive", methods=["POST"])
+@require_token
+def unarchive(rid):
+    with write_lock:
+        ok = backend.unarchive(rid)
+    return jsonify({"ok": ok})
+
+
+# طابور واتساب: كل جهاز يسحب رسائله (host) ويرسلها من واتساب المثبت عليه
+@app.route("/api/wa/outbox", methods=["POST"])
+@require_token
+def wa_enqueue():
+    data = request.json or {}
+    if not data.get("phone") or not data.get("body") or not data.get("host"):
+        return jsonify({"ok": False, "msg": "بيانات ناقصة"}), 400
+    with write_lock:
+        oid = rd.wa_enqueue(
+            data["phone"],
+            data["body"],
+            int(data.get("receipt_id") or 0),
+            data.get("kind") or "WA",
+            data.get("username", ""),
+            data["host"],
+        )
+    return jsonify({"ok": True, "id": oid})
+
+
+@app.route("/api/wa/outbox/batch", methods=["POST"])
+@require_token
+def wa_enqueue_batch():
+    rows = (request.json or {}).get("rows") or []
+    if any(len(r) != 7 for r in rows):
+        return jsonify({"ok": False, "msg": "صفوف غير صالحة"}), 400
+    with write_lock:
+        n = backend.wa_enqueue_many([tuple(r) for r in rows])
+    return jsonify({"ok": True, "queued": n})
+
+
+@app.route("/api/wa/outbox/claim", methods=["POST"])
+@require_token
+def wa_claim():
+    with write_lock:
+        row = backend.wa_claim((request.json or {}).get("host", ""))
+    return jsonify(list(row) if row else None)
+
+
+@app.route("/api/wa/outbox/attempted", methods=["POST"])
+@require_token
+def wa_attempted():
+    try:
+        oid = int((request.json or {}).get("id"))
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "msg": "رقم غير صالح"}), 400
+    with write_lock:
+        backend.wa_mark_attempted(oid)
+    return jsonify({"ok": True})
+
+
+@app.route("/api/wa/outbox/finish", methods=["POST"])
+@require_token
+def wa_finish():
+    data = request.json or {}
+    row = data.get("row") or []
+    if len(row) != 7:
+        return jsonify({"ok": False, "msg": "صف غير صالح"}), 400
+    with write_lock:
+        backend.wa_finish(tuple(row), bool(data.get("ok")), data.get("error", ""))
+    return jsonify({"ok": True})
+
+
+@app.route("/api/wa/outbox/reset", methods=["POST"])
+@require_token
+def wa_reset():
+    with write_lock:
+        n = backend.wa_reset_sending((request.json or {}).get("host", ""))
+    return jsonify({"ok": True, "reset": n})
+
+
+@app.route("/api/wa/outbox/stats")
+@require_token
+def wa_stats():
+    return jsonify(backend.wa_stats(request.args.get("host", "")))
+
+
+@app.route("/api/wa/outbox/retry", methods=["POST"])
+@require_token
+def wa_retry():
+    with write_lock:
+        n = backend.wa_retry_failed((request.json or {}).get("host", ""))
+    return jsonify({"ok": True, "retried": n})
+
+
+@app.route("/api/campaigns/recipients", methods=["POST"])
+@require_token
+def campaign_recipients():
+    data = request.json or {}
+    kind = data.get("kind", "")
+    if kind not in rd.CAMPAIGN_KINDS:
+        return jsonify({"ok": False, "msg": "نوع حملة غير معروف"}), 400
+    return jsonify(
+        backend.campaign_recipients(
+            kind, data.get("candidates") or [], int(data.get("min_days") or 0)
+        )
+    )
+
+
+@app.route("/api/campaigns/progress")
+@require_token
+def campaign_progress():
+    return jsonify(backend.campaign_progress(request.args.get("campaign", "")))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        filename=rd.DATA_DIR / "local_server.log",
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    rd.db_init()
+    if not ensure_api_token():
+        raise SystemExit("⛔ لا يمكن تشغيل الخادم بلا رمز وصول")
+    print(f"API token saved to {API_TOKEN_PATH} (enter it on every terminal)")
+    app.run(
+        host=os.environ.get("REPAIRDESK_HOST", "0.0.0.0"),
+        port=int(os.environ.get("REPAIRDESK_PORT", "8765")),
+        threaded=True,
+    )
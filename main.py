@@ -10,11 +10,60 @@
 # - تفاصيل السند قابلة للتمرير (سكرول كامل)
 # -----------------------------------------------------------------------------
 
-import os, sys, sqlite3, random, string, datetime, json, csv, shutil, logging, re, subprocess, platform, urllib.parse as ul, webbrowser, threading, time
+import os, sys, sqlite3, datetime, json, csv, shutil, logging, re, subprocess, platform, urllib.parse as ul, webbrowser, threading, time, hashlib, argparse, functools
 from pathlib import Path
 
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, simpledialog, filedialog
+
+from repairdesk_data import (
+    archive_closed_receipts,
+    build_campaign_rows,
+    CLOSED_STATUSES,
+    CustomerDirectory,
+    DATA_DIR,
+    db_conn,
+    db_init,
+    DB_LOCK_STATS,
+    DB_PATH,
+    DeviceSuggestions,
+    fmt_dt,
+    get_backend,
+    maintenance_due,
+    MAINTENANCE_IDLE_SECONDS,
+    make_ready_text,
+    make_whatsapp_initial_text,
+    mark_maintenance_done,
+    needs_vacuum_conversion,
+    normalize_phone,
+    normalize_scan,
+    notify_ready,
+    OWNER_DASH_TTL_SECONDS,
+    parse_utc_iso,
+    QuickOpenIndex,
+    ReceiptNoMap,
+    RECEIPT_DETAIL_CACHE,
+    RECEIPT_DETAIL_FIELDS,
+    RECEIPT_WINDOWS_MAX,
+    RIYADH_UTC_OFFSET_HOURS,
+    run_db_maintenance,
+    save_settings,
+    SCAN_MAX_GAP_MS,
+    SCAN_MIN_CHARS,
+    SETTINGS,
+    set_wa_backend,
+    STATUS_ORDER,
+    SYNC_INTERVAL_MS,
+    sync_push,
+    to_riyadh,
+    WARRANTY_DAYS,
+    WA_HOST,
+    WA_SEND_INTERVAL_SECONDS,
+    _name_key,
+    _revenue_day_cache,
+    _wa_queue,
+    _wa_wake,
+)
 
 
 def flash_saved(status_bar, win, text="✅ تم حفظ بيانات التكلفة/الدفع", ms=1800):
@@ -52,11 +101,6 @@ except Exception:
     Image = None
     ImageTk = None
 
-try:
-    import bcrypt
-except Exception:
-    bcrypt = None
-
 # pywin32 for direct print + window automation
 try:
     import win32print, win32ui, win32gui, win32api, win32con
@@ -91,26 +135,56 @@ try:
 except Exception:
     REPORTLAB_OK = False
 
-try:
-    import arabic_reshaper
-    from bidi.algorithm import get_display
+# arabic_reshaper / python-bidi تُحمّل مرة واحدة عند أول استخدام فقط
+AR_SHAPE_CACHE_SIZE = 4096
+_AR_SHAPER = (
+    None  # None = not tried yet; False = libs missing; else (reshape, get_display)
+)
 
-    ARABIC_OK = True
-except Exception:
-    ARABIC_OK = False
+
+def _load_ar_shaper():
+    global _AR_SHAPER
+    if _AR_SHAPER is None:
+        try:
+            import arabic_reshaper
+            from bidi.algorithm import get_display
+
+            _AR_SHAPER = (arabic_reshaper.reshape, get_display)
+        except Exception:
+            _AR_SHAPER = False
+    return _AR_SHAPER
+
+
+@functools.lru_cache(maxsize=AR_SHAPE_CACHE_SIZE)
+def _shape_ar(t: str) -> str:
+    shaper = _load_ar_shaper()
+    if not shaper:
+        return t
+    reshape, get_display = shaper
+    try:
+        return get_display(reshape(t))
+    except Exception:
+        return t
 
 
 def ar_text(s):
-    """Return Arabic-shaped + bidi-corrected text if libs available, else as-is."""
+    """Return Arabic-shaped + bidi-corrected text if libs available, else as-is (memoized)."""
     if s is None:
         return ""
-    t = str(s)
-    if ARABIC_OK:
-        try:
-            return get_display(arabic_reshaper.reshape(t))
-        except Exception:
-            return t
-    return t
+    return _shape_ar(str(s))
+
+
+def ar_shape_cache_stats() -> dict:
+    """Hit/miss counters of the Arabic shaping cache (for tuning AR_SHAPE_CACHE_SIZE)."""
+    info = _shape_ar.cache_info()
+    calls = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "hit_rate": round(info.hits / calls, 3) if calls else 0.0,
+    }
 
 
 def register_ar_font():
@@ -135,6 +209,120 @@ def register_ar_font():
     return None
 
 
+# -------------------- PDF worker process --------------------
+# بناء ملفات PDF يتم في عملية منفصلة حتى لا تتجمد الواجهة في الأيام الكبيرة.
+_PDF_POOL = None
+_PDF_WORKER_FONT = None
+
+
+def _pdf_worker_init():
+    """Runs once per worker process: register the Arabic font a single time."""
+    global _PDF_WORKER_FONT
+    _PDF_WORKER_FONT = register_ar_font() or "Helvetica"
+
+
+def render_daily_paid_pdf(pdf_path: str, rows: list, meta: dict) -> str:
+    """
+    Build the daily paid-receipts PDF from plain row tuples
+    (no, amount, paid_local, method, customer, phone, device). Runs in the worker.
+    """
+    from reportlab.lib.styles import ParagraphStyle
+
+    font_name = _PDF_WORKER_FONT or register_ar_font() or "Helvetica"
+    currency = meta.get("currency", "SAR")
+
+    data = [
+        [
+            ar_text("رقم السند"),
+            ar_text("المبلغ"),
+            ar_text("طريقة الدفع"),
+            ar_text("وقت الدفع (الرياض)"),
+            ar_text("العميل"),
+            ar_text("الجهاز"),
+        ]
+    ]
+    total = 0.0
+    for no, amt, ts_local, method, cname, phone, devtxt in rows:
+        total += amt or 0.0
+        data.append(
+            [
+                ar_text(no),
+                ar_text(f"{(amt or 0):.2f}"),
+                ar_text(method or "-"),
+                ar_text(ts_local),
+                ar_text(f"{cname} ({phone})"),
+                ar_text(devtxt),
+            ]
+        )
+    data.append(
+        [ar_text("الإجمالي"), ar_text(f"{total:.2f} {currency}"), "", "", "", ""]
+    )
+
+    doc = SimpleDocTemplate(
+        pdf_path,
+        pagesize=A4,
+        rightMargin=30,
+        leftMargin=30,
+        topMargin=30,
+        bottomMargin=18,
+    )
+    title_style = ParagraphStyle(
+        name="Title",
+        alignment=1,  # وسط
+        fontName=font_name,
+        fontSize=15,
+        leading=22,
+        spaceAfter=10,
+        textColor=colors.HexColor("#222222"),
+    )
+    tbl = Table(data, repeatRows=1)
+    tbl.setStyle(
+        TableStyle(
+            [
+                ("FONT", (0, 0), (-1, -1), font_name, 10),
+                ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+                ("TEXTCOLOR", (0, 0), (-1, 0), colors.black),
+                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+                ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+                ("BACKGROUND", (0, -1), (-1, -1), colors.HexColor("#e8f5e9")),
+                ("TEXTCOLOR", (0, -1), (-1, -1), colors.HexColor("#2e7d32")),
+                ("FONTSIZE", (0, 0), (-1, -1), 10),
+                ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+                ("TOPPADDING", (0, 0), (-1, -1), 6),
+            ]
+        )
+    )
+    elements = [
+        Paragraph(
+            ar_text(f"📱 {meta.get('company', '')} — التقرير اليومي"), title_style
+        ),
+        Spacer(1, 10),
+        Paragraph(ar_text(f"تاريخ التقرير: {meta.get('day', '')}"), title_style),
+        Spacer(1, 12),
+        tbl,
+    ]
+    doc.build(elements)
+    logging.info(f"PDF {pdf_path}: Arabic shaping cache {ar_shape_cache_stats()}")
+    return pdf_path
+
+
+def get_pdf_pool():
+    """Lazily start the single PDF worker process (font is registered once, at start)."""
+    global _PDF_POOL
+    if _PDF_POOL is None:
+        from concurrent.futures import ProcessPoolExecutor
+
+        _PDF_POOL = ProcessPoolExecutor(max_workers=1, initializer=_pdf_worker_init)
+    return _PDF_POOL
+
+
+def shutdown_pdf_pool():
+    global _PDF_POOL
+    if _PDF_POOL is not None:
+        _PDF_POOL.shutdown(wait=False, cancel_futures=True)
+        _PDF_POOL = None
+
+
 # --- Windows HiDPI fix ---
 try:
     if platform.system() == "Windows":
@@ -150,8 +338,6 @@ except Exception:
 APP_NAME = "ATTA RepairDesk Pro"
 MADE_BY = "صنع بواسطة محمد عطا"
 
-DATA_DIR = Path.home() / "Documents" / "RepairDeskDesktop"
-DB_PATH = DATA_DIR / "repairdesk.db"
 QR_DIR = DATA_DIR / "qr"
 EXPORTS_DIR = DATA_DIR / "exports"
 BACKUP_DIR = DATA_DIR / "backups"
@@ -165,20 +351,6 @@ logging.basicConfig(
     format="%(asctime)s %(levelname)s %(message)s",
 )
 
-STATUS_ORDER = [
-    "جديد",
-    "قيد الفحص",
-    "بانتظار الموافقة",
-    "قيد الإصلاح",
-    "جاهز للاستلام",
-    "تم التسليم",
-    "ملغي",
-]
-
-# Warranty
-WARRANTY_DAYS = 30
-RIYADH_UTC_OFFSET_HOURS = 3
-
 # ------------------ Status Colors & UI helpers ------------------
 STATUS_STYLE = {
     "جديد": ("#9e9e9e", "white"),
@@ -228,6 +400,96 @@ def add_treeview_scrollbars(container: ttk.Frame, tree: ttk.Treeview):
     container.columnconfigure(0, weight=1)
 
 
+def attach_autocomplete(entry, suggest, on_pick, min_chars=2, max_rows=8):
+    """
+    قائمة اقتراحات منسدلة تحت حقل إدخال.
+    suggest(text) -> [(display, value)]; on_pick(value) is called for the chosen row.
+    """
+    popup = {"win": None, "lb": None, "values": []}
+    NAV_KEYS = {"Up", "Down", "Return", "Escape", "Tab", "KP_Enter"}
+
+    def hide(_=None):
+        if popup["win"] is not None:
+            popup["win"].destroy()
+            popup["win"] = popup["lb"] = None
+
+    def pick(_=None):
+        lb = popup["lb"]
+        if lb is None:
+            return
+        sel = lb.curselection()
+        if sel:
+            value = popup["values"][sel[0]]
+            hide()
+            on_pick(value)
+            entry.focus_set()
+            entry.icursor("end")
+        return "break"
+
+    def show(items):
+        if popup["win"] is None:
+            win = tk.Toplevel(entry)
+            win.wm_overrideredirect(True)
+            lb = tk.Listbox(
+                win, height=max_rows, activestyle="dotbox", exportselection=False
+            )
+            lb.pack(fill="both", expand=True)
+            lb.bind("<ButtonRelease-1>", pick)
+            lb.bind("<Return>", pick)
+            lb._scan_target = True
+            lb.bind("<Escape>", lambda _e: (hide(), entry.focus_set()))
+            popup["win"], popup["lb"] = win, lb
+        win, lb = popup["win"], popup["lb"]
+        lb.delete(0, "end")
+        for display, _v in items:
+            lb.insert("end", display)
+        popup["values"] = [v for _d, v in items]
+        lb.configure(height=min(max_rows, len(items)))
+        x = entry.winfo_rootx()
+        y = entry.winfo_rooty() + entry.winfo_height()
+        win.wm_geometry(
+            f"{max(entry.winfo_width(), 260)}x{lb.winfo_reqheight()}+{x}+{y}"
+        )
+        win.lift()
+
+    def on_key(event):
+        if event.keysym in NAV_KEYS:
+            return
+        text = entry.get().strip()
+        items = suggest(text) if len(text) >= min_chars else []
+        if items:
+            show(items[:max_rows])
+        else:
+            hide()
+
+    def on_down(_):
+        lb = popup["lb"]
+        if lb is None:
+            return
+        lb.focus_set()
+        lb.selection_clear(0, "end")
+        lb.selection_set(0)
+        lb.activate(0)
+        return "break"
+
+    entry.bind("<KeyRelease>", on_key, add="+")
+    entry.bind("<Down>", on_down, add="+")
+    entry.bind("<Escape>", hide, add="+")
+    # تأخير بسيط حتى يصل النقر على القائمة قبل إخفائها
+    entry.bind("<FocusOut>", lambda _e: entry.after(200, _hide_if_unfocused), add="+")
+    entry.bind("<Destroy>", hide, add="+")
+
+    def _hide_if_unfocused():
+        try:
+            focus = entry.focus_get()
+        except (KeyError, tk.TclError):
+            focus = None
+        if popup["lb"] is None or focus is not popup["lb"]:
+            hide()
+
+    return hide
+
+
 # ---------- Scrollable Frame Helper (عمودي) ----------
 def make_vscrollable(parent, bg=SURFACE_BG):
     container = tk.Frame(parent, bg=bg)
@@ -261,67 +523,6 @@ def make_vscrollable(parent, bg=SURFACE_BG):
     return container, inner
 
 
-# Warranty helpers
-def to_riyadh(dt_utc: datetime.datetime) -> datetime.datetime:
-    return dt_utc + datetime.timedelta(hours=RIYADH_UTC_OFFSET_HOURS)
-
-
-def fmt_dt(dt: datetime.datetime) -> str:
-    return dt.strftime("%Y-%m-%d %H:%M")
-
-
-def parse_utc_iso(iso_str: str) -> datetime.datetime:
-    try:
-        s = (iso_str or "").replace("Z", "+00:00")
-        return datetime.datetime.fromisoformat(s)
-    except Exception:
-        return datetime.datetime.now(datetime.UTC)
-
-
-SETTINGS_PATH = DATA_DIR / "config.json"
-DEFAULT_SETTINGS = {
-    "company": "ATTA Repair",
-    "currency": "SAR",
-    "use_shop_number_for_qr": False,
-    "shop_number": "9665XXXXXXXX",
-    "label_printer": "",
-    "whatsapp_auto_send": True,  # Auto send enabled by default
-    "whatsapp_auto_delay_ms": 1200,  # ↑ زودنا الافتراضي لضمان لصق النص
-    "wa_fill_via_clipboard": True,
-    "wa_press_enter": True,
-    "win_prefs": {},
-}
-
-
-# ------------------------- Settings -------------------------
-def load_settings():
-    if SETTINGS_PATH.exists():
-        try:
-            d = json.loads(SETTINGS_PATH.read_text(encoding="utf-8"))
-            d.setdefault("win_prefs", {})
-            d.setdefault("label_printer", "")
-            d.setdefault("whatsapp_auto_send", True)
-            d.setdefault("whatsapp_auto_delay_ms", 1200)
-            d.setdefault("wa_fill_via_clipboard", True)
-            d.setdefault("wa_press_enter", True)
-            return d
-        except Exception as e:
-            logging.error(f"Failed to read settings: {e}")
-    return DEFAULT_SETTINGS.copy()
-
-
-def save_settings(s):
-    try:
-        SETTINGS_PATH.write_text(
-            json.dumps(s, ensure_ascii=False, indent=2), encoding="utf-8"
-        )
-    except Exception as e:
-        logging.error(f"Failed to save settings: {e}")
-
-
-SETTINGS = load_settings()
-
-
 def get_win_pref(key, default_geometry=None, default_state="normal"):
     prefs = SETTINGS.get("win_prefs", {})
     w = prefs.get(key, {})
@@ -337,266 +538,74 @@ def set_win_pref(key, geometry, state):
     save_settings(SETTINGS)
 
 
-# ------------------------- DB -------------------------
-def db_conn():
-    con = sqlite3.connect(DB_PATH)
-    try:
-        con.execute("PRAGMA foreign_keys = ON")
-    except Exception:
-        pass
-    return con
-
-
-SCHEMA = """
-CREATE TABLE IF NOT EXISTS branches(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  name TEXT NOT NULL,
-  code TEXT NOT NULL
-);
-CREATE TABLE IF NOT EXISTS users(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  branch_id INTEGER NOT NULL,
-  username TEXT NOT NULL,
-  password TEXT NOT NULL,
-  role TEXT NOT NULL DEFAULT 'admin'
-);
-CREATE TABLE IF NOT EXISTS customers(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  name TEXT NOT NULL,
-  phone TEXT NOT NULL,
-  notes TEXT
-);
-CREATE TABLE IF NOT EXISTS devices(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  customer_id INTEGER NOT NULL,
-  type TEXT NOT NULL,
-  brand TEXT NOT NULL,
-  model TEXT NOT NULL,
-  serial_imei TEXT,
-  color TEXT,
-  accessories TEXT
-);
-CREATE TABLE IF NOT EXISTS receipts(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  branch_id INTEGER NOT NULL,
-  customer_id INTEGER NOT NULL,
-  device_id INTEGER NOT NULL,
-  receipt_no TEXT NOT NULL,
-  issue_desc TEXT NOT NULL,
-  work_request TEXT NOT NULL,
-  est_amount REAL NOT NULL DEFAULT 0,
-  approved_amount REAL,
-  device_state TEXT,
-  status TEXT NOT NULL DEFAULT 'جديد',
-  otp_code TEXT NOT NULL,
-  whatsapp_link TEXT,
-  qr_path TEXT,
-  signature_path TEXT,
-  created_utc TEXT NOT NULL,
-  delivered_utc TEXT
-);
-CREATE TABLE IF NOT EXISTS status_history(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  receipt_id INTEGER NOT NULL,
-  from_status TEXT,
-  to_status TEXT NOT NULL,
-  at_utc TEXT NOT NULL,
-  by_username TEXT
-);
-CREATE TABLE IF NOT EXISTS activity_log(
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  receipt_id INTEGER NOT NULL,
-  kind TEXT NOT NULL,
-  info TEXT,
-  at_utc TEXT NOT NULL,
-  by_username TEXT
-);
-"""
-
-
-def db_migrate():
-    """Ensure new payment columns exist on receipts table."""
-    con = db_conn()
-    cur = con.cursor()
-    cur.execute("PRAGMA table_info(receipts)")
-    cols = {row[1] for row in cur.fetchall()}
-    # approved_amount already in schema, but ensure it exists (older DBs)
-    if "approved_amount" not in cols:
-        try:
-            cur.execute("ALTER TABLE receipts ADD COLUMN approved_amount REAL")
-        except Exception:
-            pass
-    # paid fields
-    if "paid_flag" not in cols:
-        try:
-            cur.execute(
-                "ALTER TABLE receipts ADD COLUMN paid_flag INTEGER NOT NULL DEFAULT 0"
-            )
-        except Exception:
-            pass
-    if "paid_amount" not in cols:
-        try:
-            cur.execute(
-                "ALTER TABLE receipts ADD COLUMN paid_amount REAL NOT NULL DEFAULT 0"
-            )
-        except Exception:
-            pass
-    if "paid_utc" not in cols:
-        try:
-            cur.execute("ALTER TABLE receipts ADD COLUMN paid_utc TEXT")
-        except Exception:
-            pass
-    if "payment_method" not in cols:
-        try:
-            cur.execute("ALTER TABLE receipts ADD COLUMN payment_method TEXT")
-        except Exception:
-            pass
-    if "device_state" not in cols:
-        try:
-            cur.execute("ALTER TABLE receipts ADD COLUMN device_state TEXT")
-        except Exception:
-            pass
-    con.commit()
-    con.close()
-
+# QR تُنشأ عند العرض فقط، وتخزن بحسب بصمة المحتوى (نفس الرابط = نفس الملف)
+QR_DISK_CACHE_MAX_BYTES = 20 * 1024 * 1024
+QR_PHOTO_CACHE_SIZE = 64
+_qr_photo_cache = {}  # (sha, size) -> PhotoImage, insertion order = LRU order
 
-def db_init():
-    con = db_conn()
-    cur = con.cursor()
-    cur.executescript(SCHEMA)
-    con.commit()
-    # Run migrations to add new columns if missing
-    db_migrate()
-    cur.execute("SELECT COUNT(*) FROM branches")
-    n = cur.fetchone()[0]
-    if n == 0:
-        cur.execute(
-            "INSERT INTO branches(name,code) VALUES(?,?)", ("فرع البوليفارد", "A")
-        )
-        cur.execute("INSERT INTO branches(name,code) VALUES(?,?)", ("فرع السوق", "B"))
-        con.commit()
-        cur.execute("SELECT id FROM branches WHERE code='A'")
-        b1 = cur.fetchone()[0]
-        cur.execute("SELECT id FROM branches WHERE code='B'")
-        b2 = cur.fetchone()[0]
-
-        def seed_user(bid, username, pwd):
-            if bcrypt:
-                ph = bcrypt.hashpw(pwd.encode(), bcrypt.gensalt()).decode()
-            else:
-                ph = pwd
-            cur.execute(
-                "INSERT INTO users(branch_id,username,password,role) VALUES(?,?,?,?)",
-                (bid, username, ph, "admin"),
-            )
 
-        seed_user(b1, "A1", "123")
-        seed_user(b2, "A2", "123")
-    con.commit()
-    con.close()
+# ملفات الكاش فقط؛ ملفات QR القديمة (qr_path في السندات القديمة) لا تُحذف أبداً
+_QR_CACHE_NAME = re.compile(r"qr_[0-9a-f]{40}\.png")
 
 
-# ---------------------- Helpers -----------------------
-def random_otp(k=6):
-    return "".join(random.choice(string.digits) for _ in range(k))
+def qr_cache_path(data: str) -> Path:
+    return QR_DIR / f"qr_{hashlib.sha1(data.encode('utf-8')).hexdigest()}.png"
 
 
-def generate_receipt_no(branch_code: str) -> str:
-    con = db_conn()
-    cur = con.cursor()
-    cur.execute(
-        "SELECT receipt_no FROM receipts WHERE receipt_no LIKE ? ORDER BY id DESC LIMIT 1",
-        (f"{branch_code}%",),
-    )
-    row = cur.fetchone()
-    con.close()
-    seq = 1
-    if row and row[0]:
-        m = re.search(r"(\d+)$", row[0])
-        if m:
-            try:
-                seq = int(m.group(1)) + 1
-            except Exception:
-                seq = 1
-    return f"{branch_code}{seq:04d}"
-
-
-def normalize_phone(num: str) -> str:
-    digits = "".join(ch for ch in num if ch.isdigit())
-    if digits.startswith("00"):
-        digits = digits[2:]
-    return digits
-
-
-def make_whatsapp_initial_text(
-    receipt_no: str,
-    device: str,
-    issue: str,
-    otp: str,
-    tracking_hint: str,
-    device_state: str | None = None,
-) -> str:
-    """
-    توليد رسالة واتساب احترافية لفتح السند مع تنسيق وأيقونات.
-    """
-    state_line = f"\n💡 حالة الجهاز: *{device_state}*" if device_state else ""
-    return (
-        f"📱✨ *مرحبًا بك في متجر {SETTINGS.get('company', 'Memory Corner')}* ✨\n\n"
-        f"📄 *تم فتح سند صيانة جديد*\n"
-        f"🔢 رقم السند: *{receipt_no}*\n"
-        f"📱 الجهاز: *{device}*\n"
-        f"⚙️ العطل: *{issue}*"
-        f"{state_line}\n"
-        f"🔑 رمز الاستلام (OTP): *{otp}*\n\n"
-        f"📍 {tracking_hint}\n"
-        f"نشكر ثقتك بنا ❤️"
-    )
-
-
-def make_ready_text(receipt_no: str, device: str, otp: str, company: str) -> str:
-    return (
-        f"السلام عليكم\n"
-        f"تم الانتهاء من صيانة جهازك ({device}).\n"
-        f"رقم السند: {receipt_no}\n"
-        f"رمز الاستلام (OTP): {otp}\n"
-        f"يمكنك الاستلام خلال أوقات العمل. — {company}"
-    )
-
-
-def make_delivered_text(receipt_no: str, device: str, company: str) -> str:
-    return (
-        f"السلام عليكم\n"
-        f"تم تسليم جهازك ({device}) بنجاح.\n"
-        f"رقم السند: {receipt_no}\n"
-        f"شاكرين زيارتكم — {company}"
-    )
+def _prune_qr_cache(max_bytes: int = QR_DISK_CACHE_MAX_BYTES):
+    """Drop least-recently-used cache PNGs (by mtime) until they fit in max_bytes."""
+    try:
+        files = [
+            (p.stat(), p)
+            for p in QR_DIR.glob("qr_*.png")
+            if _QR_CACHE_NAME.fullmatch(p.name)
+        ]
+    except OSError:
+        return
+    total = sum(st.st_size for st, _ in files)
+    for st, p in sorted(files, key=lambda f: f[0].st_mtime):
+        if total <= max_bytes:
+            break
+        try:
+            p.unlink()
+            total -= st.st_size
+        except OSError:
+            pass
 
 
-def make_qr(data: str, filename: str) -> str:
-    if qrcode is None:
+def make_qr(data: str, filename: str = "") -> str:
+    """Path of the cached QR PNG for data (generated on first use). filename is ignored."""
+    if qrcode is None or not data:
         return ""
-    img = qrcode.make(data)
-    path = QR_DIR / filename
-    img.save(path)
+    path = qr_cache_path(data)
+    if path.exists():
+        try:
+            os.utime(path)  # يحدّث ترتيب LRU على القرص
+        except OSError:
+            pass
+        return str(path)
+    tmp = path.with_suffix(".tmp")
+    qrcode.make(data).save(tmp, format="PNG")
+    os.replace(tmp, path)
+    _prune_qr_cache()
     return str(path)
 
 
-def hash_password_if_possible(pw: str) -> str:
-    if bcrypt is None:
-        return pw
-    return bcrypt.hashpw(pw.encode(), bcrypt.gensalt()).decode()
-
-
-def password_matches(stored: str, supplied: str) -> bool:
-    try:
-        if stored and stored.startswith("$2"):
-            if bcrypt is None:
-                return False
-            return bcrypt.checkpw(supplied.encode(), stored.encode())
-        return stored == supplied
-    except Exception as e:
-        logging.error(f"Password check error: {e}")
-        return False
+def qr_photo(data: str, size: int = 200):
+    """PhotoImage جاهزة للعرض من ذاكرة LRU؛ تنشأ من ملف القرص عند الحاجة فقط."""
+    if ImageTk is None or not data:
+        return None
+    key = (hashlib.sha1(data.encode("utf-8")).hexdigest(), size)
+    ph = _qr_photo_cache.pop(key, None)
+    if ph is None:
+        path = make_qr(data)
+        if not path:
+            return None
+        ph = ImageTk.PhotoImage(Image.open(path).resize((size, size)))
+    _qr_photo_cache[key] = ph
+    while len(_qr_photo_cache) > QR_PHOTO_CACHE_SIZE:
+        _qr_photo_cache.pop(next(iter(_qr_photo_cache)))
+    return ph
 
 
 # ---------------------- WhatsApp Desktop (+ Auto-Send) ----------------------
@@ -695,67 +704,57 @@ def _press_keys_paste_then_enter():
         logging.error(f"paste+enter failed: {e}")
 
 
-def _schedule_auto_send(paste_text: str | None):
-    """جدوِل لصق/إرسال الرسالة بعد فتح واتساب."""
+def _auto_send_now(paste_text: str | None, on_paste=None) -> bool:
+    """
+    الصق/أرسل الرسالة بعد فتح واتساب (متزامن؛ يستدعى من عامل الإرسال فقط).
+    on_paste() يُستدعى قبل أول ضغطة مفاتيح مباشرة (بعدها قد تكون الرسالة خرجت).
+    Returns False when the WhatsApp window never came to the front.
+    """
     if platform.system() != "Windows":
-        return
+        return True
     if not SETTINGS.get("whatsapp_auto_send", True):
-        return
+        return True
 
     use_clipboard = bool(SETTINGS.get("wa_fill_via_clipboard", True))
     press_enter = bool(SETTINGS.get("wa_press_enter", True))
     delay_ms = int(SETTINGS.get("whatsapp_auto_delay_ms", 1200))
 
-    def worker():
-        if use_clipboard and paste_text and wcb:
-            _set_clipboard_text(paste_text)
+    if use_clipboard and paste_text and wcb:
+        _set_clipboard_text(paste_text)
 
-        time.sleep(max(0, delay_ms) / 1000.0)
+    time.sleep(max(0, delay_ms) / 1000.0)
 
-        for _ in range(12):
-            if _try_focus_whatsapp_window():
-                time.sleep(0.15)
-                if use_clipboard and paste_text and wcb:
-                    if press_enter:
-                        _press_keys_paste_then_enter()
-                    else:
-                        _press_keys_paste()
+    for _ in range(12):
+        if _try_focus_whatsapp_window():
+            time.sleep(0.15)
+            if on_paste:
+                on_paste()
+            if use_clipboard and paste_text and wcb:
+                if press_enter:
+                    _press_keys_paste_then_enter()
                 else:
-                    if press_enter:
-                        _press_enter()
-                return
-            time.sleep(0.35)
-
-        # محاولة أخيرة حتى لو ما قدر يركز النافذة
-        if use_clipboard and paste_text and wcb:
-            if press_enter:
-                _press_keys_paste_then_enter()
+                    _press_keys_paste()
             else:
-                _press_keys_paste()
-        else:
-            if press_enter:
-                _press_enter()
-
-    threading.Thread(target=worker, daemon=True).start()
+                if press_enter:
+                    _press_enter()
+            return True
+        time.sleep(0.35)
+    return False
 
 
-def open_whatsapp_desktop(phone_digits: str, message_text: str) -> bool:
-    """
-    يفتح WhatsApp Desktop مع نص مُعبّأ مسبقًا (قدر الإمكان) + يلصق النص تلقائيًا.
-    """
+def _wa_send_now(phone_digits: str, message_text: str, on_paste=None) -> bool:
+    """افتح WhatsApp Desktop بالنص والصقه (قناة التسليم الفعلية للطابور)."""
     digits = "".join(ch for ch in phone_digits if ch.isdigit())
     msg = message_text.replace("\r\n", "\n").strip()
     uri = f"whatsapp://send?phone={digits}&text={ul.quote(msg, safe='')}"
     try:
         if platform.system() == "Windows":
             os.startfile(uri)
-            _schedule_auto_send(msg)  # نمرّر النص للّصق
+            return _auto_send_now(msg, on_paste)  # نمرّر النص للّصق
         elif platform.system() == "Darwin":
             subprocess.Popen(["open", uri])
-            _schedule_auto_send(None)
         else:
             subprocess.Popen(["xdg-open", uri])
-            _schedule_auto_send(None)
         return True
     except Exception as e:
         logging.error(f"WhatsApp desktop open failed: {e}")
@@ -767,64 +766,282 @@ def open_whatsapp_desktop(phone_digits: str, message_text: str) -> bool:
         return False
 
 
-# ---------------------- Activity Log ---------------------------
-def log_activity(receipt_id: int, kind: str, info: str, by_username: str):
+def open_whatsapp_desktop(
+    phone_digits: str,
+    message_text: str,
+    *,
+    receipt_id: int = 0,
+    kind: str = "WA",
+    username: str = "",
+) -> bool:
+    """
+    أضف الرسالة إلى طابور الإرسال (wa_outbox)؛ عامل واحد يرسلها بالترتيب مع فاصل زمني.
+    """
     try:
-        con = db_conn()
-        cur = con.cursor()
-        cur.execute(
-            """
-            INSERT INTO activity_log(receipt_id, kind, info, at_utc, by_username)
-            VALUES(?,?,?,?,?)
-        """,
-            (
-                receipt_id,
-                kind,
-                info,
-                datetime.datetime.now(datetime.UTC).isoformat(),
-                by_username,
-            ),
+        _wa_queue().wa_enqueue(phone_digits, message_text, receipt_id, kind, username)
+    except Exception as e:
+        logging.error(f"WhatsApp enqueue failed: {e}")
+        return False
+    start_wa_worker()
+    return True
+
+
+# ---------------------- WhatsApp outbox worker ---------------------------
+_wa_worker_lock = threading.Lock()
+_wa_worker = None
+
+
+def _wa_worker_loop(send):
+    interval = float(SETTINGS.get("wa_send_interval_s", WA_SEND_INTERVAL_SECONDS))
+    while True:
+        queue = _wa_queue()
+        try:
+            row = queue.wa_claim(WA_HOST)
+        except Exception as e:
+            logging.error(f"wa_outbox claim failed: {e}")
+            row = None
+        if row is None:
+            _wa_wake.wait(timeout=15)
+            _wa_wake.clear()
+            continue
+        try:
+            ok = bool(send(row[2], row[3], lambda: queue.wa_mark_attempted(row[0])))
+            err = "" if ok else "WhatsApp window not found"
+        except Exception as e:
+            ok, err = False, str(e)
+        try:
+            queue.wa_finish(row, ok, err)
+        except Exception as e:
+            logging.error(f"wa_outbox update failed: {e}")
+        time.sleep(interval)  # تباعد بين الرسائل
+
+
+def start_wa_worker(send=None):
+    """Start the single outbox worker once per process (idempotent)."""
+    global _wa_worker
+    with _wa_worker_lock:
+        if _wa_worker is not None and _wa_worker.is_alive():
+            _wa_wake.set()
+            return
+        # "sending" بعد إغلاق مفاجئ ترجع للطابور؛ "attempted" تذهب للفاشلة (ربما أُرسلت)
+        _wa_queue().wa_reset_sending(WA_HOST)
+        _wa_worker = threading.Thread(
+            target=_wa_worker_loop,
+            args=(send or _wa_send_now,),
+            name="wa-outbox",
+            daemon=True,
         )
-        con.commit()
-        con.close()
+        _wa_worker.start()
+
+
+# ---------------------- Backup / Restore -----------------------
+# كل نسخة احتياطية يرافقها ملف manifest (JSON) بنفس الاسم: checksum + عدد الصفوف
+def backup_manifest_path(backup_path) -> Path:
+    return Path(backup_path).with_suffix(".json")
+
+
+def _sha256_file(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _db_snapshot_stats(con) -> dict:
+    """Row count per table + highest receipt id, used to describe a backup."""
+    cur = con.cursor()
+    cur.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    )
+    tables = {}
+    for (name,) in cur.fetchall():
+        cur.execute(f'SELECT COUNT(*) FROM "{name}"')
+        tables[name] = cur.fetchone()[0]
+    max_rid = None
+    if "receipts" in tables:
+        cur.execute("SELECT MAX(id) FROM receipts")
+        max_rid = cur.fetchone()[0]
+    return {"tables": tables, "max_receipt_id": max_rid}
+
+
+def verify_backup(backup_path, write_manifest: bool = False) -> dict:
+    """
+    افحص نسخة احتياطية: PRAGMA quick_check + sha256 + إحصائيات الجداول.
+    When a manifest already exists its checksum must match the file.
+    """
+    backup_path = Path(backup_path)
+    result = {
+        "file": str(backup_path),
+        "ok": False,
+        "quick_check": "",
+        "sha256": "",
+        "size_bytes": 0,
+        "check_ms": 0.0,
+        "tables": {},
+        "max_receipt_id": None,
+        "verified_utc": datetime.datetime.now(datetime.UTC).isoformat(),
+    }
+    if not backup_path.exists():
+        result["quick_check"] = "missing file"
+        return result
+    result["size_bytes"] = backup_path.stat().st_size
+
+    t0 = time.perf_counter()
+    try:
+        con = sqlite3.connect(f"file:{backup_path.as_posix()}?mode=ro", uri=True)
+        try:
+            rows = con.execute("PRAGMA quick_check").fetchall()
+            result["quick_check"] = "; ".join(str(r[0]) for r in rows)
+            result.update(_db_snapshot_stats(con))
+        finally:
+            con.close()
     except Exception as e:
-        logging.error(f"activity_log insert failed: {e}")
+        result["quick_check"] = f"error: {e}"
+    result["check_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    result["sha256"] = _sha256_file(backup_path)
 
+    ok = result["quick_check"] == "ok"
+    manifest_path = backup_manifest_path(backup_path)
+    if not write_manifest and manifest_path.exists():
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+            if manifest.get("sha256") != result["sha256"]:
+                result["quick_check"] += " (checksum mismatch)"
+                ok = False
+        except Exception as e:
+            logging.error(f"Failed to read backup manifest {manifest_path}: {e}")
+            ok = False
+    result["ok"] = ok
 
-# ============================ UI ===============================
-class App(tk.Tk):
+    if write_manifest:
+        manifest_path.write_text(
+            json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+    return result
 
-    def print_label_browser(self, receipt_no: str, phone: str):
-        """
-        افتح ورقة طباعة عبر المتصفح بحجم 40×22 مم تحتوي على رقم السند ورقم جوال العميل.
-        """
+
+def create_verified_backup() -> dict:
+    """Take a consistent copy via the SQLite backup API, then verify it and write its manifest."""
+    ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    dst = BACKUP_DIR / f"repairdesk_{ts}.db"
+    src = db_conn()
+    out = sqlite3.connect(dst)
+    try:
+        src.backup(out)
+    finally:
+        out.close()
+        src.close()
+    info = verify_backup(dst, write_manifest=True)
+    logging.info(
+        f"Backup {dst.name}: quick_check={info['quick_check']} "
+        f"check_ms={info['check_ms']} max_receipt_id={info['max_receipt_id']}"
+    )
+    return info
+
+
+def list_backups() -> list:
+    return sorted(BACKUP_DIR.glob("repairdesk_*.db"), reverse=True)
+
+
+def restore_backup(backup_path) -> dict:
+    """
+    استرجاع نسخة احتياطية: فحص ثم نسخ إلى ملف مؤقت ثم استبدال ذري لقاعدة البيانات.
+    The current DB is kept as pre_restore_<ts>.db. Raises ValueError if the backup fails verification.
+    """
+    t0 = time.perf_counter()
+    info = verify_backup(backup_path)
+    if not info["ok"]:
+        raise ValueError(f"النسخة الاحتياطية غير سليمة: {info['quick_check']}")
+
+    ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    safety = None
+    if DB_PATH.exists():
+        safety = BACKUP_DIR / f"pre_restore_{ts}.db"
+        src = db_conn()
+        out = sqlite3.connect(safety)
         try:
-            from pathlib import Path
-            import webbrowser, html
+            src.backup(out)
+        finally:
+            out.close()
+            src.close()
+
+    tmp = DB_PATH.with_name(DB_PATH.name + ".restore-tmp")
+    shutil.copyfile(backup_path, tmp)
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    if _sha256_file(tmp) != info["sha256"]:
+        tmp.unlink(missing_ok=True)
+        raise ValueError("فشل نسخ ملف الاسترجاع (checksum mismatch)")
+
+    # ملفات journal القديمة تخص القاعدة الحالية ولا يجب تطبيقها على النسخة المسترجعة
+    for suffix in ("-journal", "-wal", "-shm"):
+        DB_PATH.with_name(DB_PATH.name + suffix).unlink(missing_ok=True)
+    os.replace(tmp, DB_PATH)
+    RECEIPT_DETAIL_CACHE.invalidate()
+    _revenue_day_cache.clear()
+
+    restore_ms = round((time.perf_counter() - t0) * 1000, 1)
+    logging.info(
+        f"Restored {Path(backup_path).name} in {restore_ms} ms "
+        f"(quick_check {info['check_ms']} ms), safety copy: {safety}"
+    )
+    return {
+        "file": str(backup_path),
+        "restore_ms": restore_ms,
+        "check_ms": info["check_ms"],
+        "max_receipt_id": info["max_receipt_id"],
+        "safety_copy": str(safety) if safety else "",
+    }
+
+
+# ---------------------- Labels (40×22 mm) -----------------------
+LABEL_SHEET_CSS = """
+  @page { size: 40mm 22mm; margin: 0; }
+  html, body { margin: 0; padding: 0; }
+  .label { width: 40mm; height: 22mm; box-sizing: border-box; padding: 2mm; display: flex; flex-direction: column; justify-content: center; font-family: Tahoma, Arial, sans-serif; overflow: hidden; page-break-after: always; break-after: page; }
+  .label:last-child { page-break-after: auto; break-after: auto; }
+  .line1 { font-size: 14pt; font-weight: 700; line-height: 1.05; }
+  .line2 { font-size: 9pt; font-weight: 600; line-height: 1.05; }
+  .small { font-size: 8pt; opacity: .8; margin-top: 1mm; }
+"""
+
+
+@functools.lru_cache(maxsize=1024)
+def _label_fragment(receipt_no: str, digits: str, company: str) -> str:
+    """HTML لملصق واحد (مخزن مؤقتاً: إعادة طباعة نفس السند لا تعيد البناء)."""
+    import html
+
+    return (
+        '<div class="label">'
+        f'<div class="line1">سند: {html.escape(receipt_no)}</div>'
+        f'<div class="line2">{html.escape(digits)}</div>'
+        f'<div class="small">{html.escape(company)}</div>'
+        "</div>"
+    )
+
 
-            # نضمن أرقام فقط للجوال
-            digits = "".join(ch for ch in str(phone) if ch.isdigit())
-            html_text = f"""<!doctype html>
+def build_label_sheet_html(labels) -> str:
+    """
+    مستند واحد متعدد الصفحات لكل الملصقات (صفحة 40×22 مم لكل ملصق) ونافذة طباعة واحدة.
+    labels: iterable of (receipt_no, phone).
+    """
+    company = SETTINGS.get("company", "ركن الذاكرة")
+    body = "\n".join(
+        _label_fragment(
+            str(no), "".join(ch for ch in str(phone or "") if ch.isdigit()), company
+        )
+        for no, phone in labels
+    )
+    return f"""<!doctype html>
 <html lang="ar" dir="rtl">
 <head>
 <meta charset="utf-8">
-<title>Label {receipt_no}</title>
-<style>
-  @page {{ size: 40mm 22mm; margin: 0; }}
-  html, body {{ margin: 0; padding: 0; }}
-  body {{ width: 40mm; height: 22mm; display: flex; align-items: center; justify-content: center; }}
-  .label {{ width: 40mm; height: 22mm; box-sizing: border-box; padding: 2mm; display: flex; flex-direction: column; justify-content: center; font-family: Tahoma, Arial, sans-serif; }}
-  .line1 {{ font-size: 14pt; font-weight: 700; line-height: 1.05; }}
-  .line2 {{ font-size: 9pt; font-weight: 600; line-height: 1.05; }}
-  .small {{ font-size: 8pt; opacity: .8; margin-top: 1mm; }}
-</style>
+<title>Labels</title>
+<style>{LABEL_SHEET_CSS}</style>
 </head>
 <body>
-  <div class="label">
-    <div class="line1">سند: {html.escape(str(receipt_no))}</div>
-    <div class="line2">{html.escape(digits)}</div>
-    <div class="small">{html.escape(SETTINGS.get("company","ركن الذاكرة"))}</div>
-  </div>
+{body}
 <script>
   window.onload = function() {{
     setTimeout(function() {{ window.print(); }}, 50);
@@ -832,24 +1049,267 @@ class App(tk.Tk):
 </script>
 </body>
 </html>"""
-            # احفظ في exports
-            from pathlib import Path
-
-            exports_dir = Path(globals().get("EXPORTS_DIR"))
-            exports_dir.mkdir(parents=True, exist_ok=True)
-            out = exports_dir / f"label_{receipt_no}.html"
-            out.write_text(html_text, encoding="utf-8")
-            # افتح في المتصفح الافتراضي
-            webbrowser.open(out.as_uri())
-        except Exception as e:
+
+
+def write_label_sheet(labels) -> Path:
+    labels = list(labels)
+    EXPORTS_DIR.mkdir(parents=True, exist_ok=True)
+    if len(labels) == 1:
+        out = EXPORTS_DIR / f"label_{labels[0][0]}.html"
+    else:
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        out = EXPORTS_DIR / f"labels_{stamp}_{len(labels)}.html"
+    out.write_text(build_label_sheet_html(labels), encoding="utf-8")
+    return out
+
+
+# ---------------------- Thermal labels (ZPL / ESC-POS) -----------------------
+# بايتات خام تُرسل مباشرة للطابعة الحرارية بدون متصفح (203 dpi = 8 نقاط/مم).
+LABEL_DPMM = 8
+LABEL_W_DOTS = 40 * LABEL_DPMM  # 320
+LABEL_H_DOTS = 22 * LABEL_DPMM  # 176
+RAW_PRINT_PORT = 9100
+# خطوط الطابعة الداخلية بلا حروف عربية → يُرسم اسم المحل العربي كصورة 1-bit
+LABEL_FONT_CANDIDATES = (
+    r"C:\Windows\Fonts\tahoma.ttf",
+    r"C:\Windows\Fonts\arial.ttf",
+    r"C:\Windows\Fonts\segoeui.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+)
+LABEL_TEXT_W_DOTS = LABEL_W_DOTS - 24  # 296 = 37 بايت لكل سطر
+LABEL_TEXT_H_DOTS = 24
+
+
+def _zpl_field(text: str) -> str:
+    # ^FH_ : يسمح بتهريب ^ و ~ و _ كـ hex داخل الحقل
+    t = str(text).replace("_", "_5F").replace("^", "_5E").replace("~", "_7E")
+    return f"^FH_^FD{t}^FS"
+
+
+@functools.lru_cache(maxsize=16)
+def _label_text_bitmap(text: str):
+    """
+    النص كصورة 1-bit بعرض LABEL_TEXT_W_DOTS محاذاة يمين: (bytes_per_row, rows, data)
+    حيث البت 1 = أسود. None بدون Pillow أو خط أو تشكيل عربي (raqm / arabic_reshaper).
+    """
+    if Image is None:
+        return None
+    try:
+        from PIL import ImageDraw, ImageFont, features
+
+        raqm = features.check("raqm")
+        if not raqm and not _load_ar_shaper():
+            return None  # حروف منفصلة ومعكوسة أسوأ من البديل اللاتيني
+        path = next((p for p in LABEL_FONT_CANDIDATES if os.path.exists(p)), None)
+        if not path:
+            return None
+        layout = ImageFont.Layout.RAQM if raqm else ImageFont.Layout.BASIC
+        font = ImageFont.truetype(path, LABEL_TEXT_H_DOTS - 4, layout_engine=layout)
+        w, h = LABEL_TEXT_W_DOTS, LABEL_TEXT_H_DOTS
+        img = Image.new("1", (w, h), 1)
+        ImageDraw.Draw(img).text(
+            (w - 1, h // 2),
+            text if raqm else ar_text(text),
+            font=font,
+            fill=0,
+            anchor="rm",
+        )
+        # وضع "1" في Pillow: البت 1 = أبيض؛ الطابعات الحرارية: البت 1 = أسود
+        data = bytes(b ^ 0xFF for b in img.tobytes())
+        return (w + 7) // 8, h, data
+    except Exception as e:
+        logging.error(f"Label text bitmap failed: {e}")
+        return None
+
+
+def _label_company(company: str):
+    """
+    سطر اسم المحل على الملصق الحراري: ("text", ascii) أو ("bitmap", (bpr, rows, data))
+    أو None (يُحذف السطر بدل طباعة '?').
+    """
+    company = str(company or "").strip()
+    if company.isascii():
+        return ("text", company) if company else None
+    bitmap = _label_text_bitmap(company)
+    if bitmap:
+        return "bitmap", bitmap
+    latin = str(SETTINGS.get("company_latin") or "").strip()
+    return ("text", latin) if latin and latin.isascii() else None
+
+
+def render_label_zpl(
+    receipt_no: str, phone: str, company: str, qr: str = "", barcode: bool = True
+) -> bytes:
+    """ZPL II لملصق 40×22 مم: رقم السند، الجوال، اسم المحل، باركود/QR اختياري."""
+    digits = "".join(ch for ch in str(phone or "") if ch.isdigit())
+    parts = [
+        f"^XA^CI28^PW{LABEL_W_DOTS}^LL{LABEL_H_DOTS}^LH0,0",
+        f"^FO12,8^A0N,34,34{_zpl_field(receipt_no)}",
+        f"^FO12,46^A0N,26,26{_zpl_field(digits)}",
+    ]
+    line = _label_company(company)
+    if line and line[0] == "text":
+        parts.append(f"^FO12,76^A0N,20,20{_zpl_field(line[1])}")
+    elif line:
+        bpr, rows, data = line[1]
+        total = bpr * rows
+        parts.append(f"^FO12,76^GFA,{total},{total},{bpr},{data.hex().upper()}^FS")
+    if qr:
+        parts.append(f"^FO{LABEL_W_DOTS - 88},8^BQN,2,3{_zpl_field('MA,' + qr)}")
+    if barcode:
+        parts.append(f"^FO12,104^BY2^BCN,56,N,N,N{_zpl_field(receipt_no)}")
+    parts.append("^XZ")
+    return "\n".join(parts).encode("utf-8")
+
+
+def render_label_escpos(
+    receipt_no: str, phone: str, company: str, qr: str = "", barcode: bool = True
+) -> bytes:
+    """
+    ESC/POS لنفس الملصق. النص ASCII فقط (صفحات الترميز العربية تختلف من طابعة لأخرى)؛
+    اسم المحل العربي يُرسل صورة نقطية (GS v 0) أو الاسم اللاتيني من الإعدادات.
+    """
+    ESC, GS = b"\x1b", b"\x1d"
+
+    def txt(t):
+        return str(t).encode("ascii", "replace")
+
+    digits = "".join(ch for ch in str(phone or "") if ch.isdigit())
+    out = bytearray(ESC + b"@" + ESC + b"a\x01")  # init + center
+    out += GS + b"!\x11" + txt(receipt_no) + b"\n"  # double width/height
+    out += GS + b"!\x00" + txt(digits) + b"\n"
+    line = _label_company(company)
+    if line and line[0] == "text":
+        out += txt(line[1]) + b"\n"
+    elif line:
+        bpr, rows, data = line[1]
+        out += GS + b"v0\x00" + bytes([bpr % 256, bpr // 256, rows % 256, rows // 256])
+        out += data
+    if barcode:
+        data = b"{B" + txt(receipt_no)
+        out += GS + b"h\x38" + GS + b"w\x02" + GS + b"H\x00"
+        out += GS + b"kI" + bytes([len(data)]) + data
+    if qr:
+        data = qr.encode("utf-8")
+        n = len(data) + 3
+        out += GS + b"(k\x04\x001A2\x00"  # model 2
+        out += GS + b"(k\x03\x001C\x04"  # module size
+        out += GS + b"(k\x03\x001E0"  # error correction L
+        out += GS + b"(k" + bytes([n % 256, n // 256]) + b"1P0" + data
+        out += GS + b"(k\x03\x001Q0"  # print
+    out += b"\n" + GS + b"VB\x00"  # feed + partial cut
+    return bytes(out)
+
+
+LABEL_RENDERERS = {"zpl": render_label_zpl, "escpos": render_label_escpos}
+
+
+def render_label_batch(labels, fmt: str) -> bytes:
+    """
+    labels: iterable of (receipt_no, phone) → one raw job for the whole batch.
+    مع label_qr يحمل كل ملصق QR برقم السند (يقرؤه ماسح الكاميرا مثل الباركود).
+    """
+    render = LABEL_RENDERERS[fmt]
+    company = SETTINGS.get("company", "ركن الذاكرة")
+    with_qr = bool(SETTINGS.get("label_qr", False))
+    return b"".join(
+        render(str(no), phone, company, qr=str(no) if with_qr else "")
+        for no, phone in labels
+    )
+
+
+def get_available_printers() -> list:
+    if not PYWIN32_OK:
+        return []
+    try:
+        flags = win32print.PRINTER_ENUM_LOCAL | win32print.PRINTER_ENUM_CONNECTIONS
+        return [p[2] for p in win32print.EnumPrinters(flags)]
+    except Exception as e:
+        logging.error(f"EnumPrinters failed: {e}")
+        return []
+
+
+def send_raw_label(data: bytes, target: str = "") -> str:
+    """
+    أرسل بايتات خام إلى:
+      - "tcp://host[:port]" → مقبس الطابعة الشبكية (افتراضي 9100)
+      - "file:PATH"         → ملف (للاختبار أو مشاركة الطابعة)
+      - اسم طابعة / فارغ    → طابعة الملصقات المختارة (win32print RAW، أو lp -o raw على لينكس)
+    """
+    target = (target or SETTINGS.get("label_raw_target") or "").strip()
+    if target.startswith("tcp://"):
+        import socket
+
+        host, _, port = target[len("tcp://") :].partition(":")
+        with socket.create_connection(
+            (host, int(port or RAW_PRINT_PORT)), timeout=5
+        ) as sock:
+            sock.sendall(data)
+        return target
+    if target.startswith("file:"):
+        path = Path(target[len("file:") :]).expanduser()
+        path.write_bytes(data)
+        return str(path)
+
+    printer = target or SETTINGS.get("label_printer") or ""
+    if PYWIN32_OK:
+        printer = printer or win32print.GetDefaultPrinter()
+        h = win32print.OpenPrinter(printer)
+        try:
+            win32print.StartDocPrinter(h, 1, ("RepairDesk label", None, "RAW"))
             try:
-                from tkinter import messagebox
+                win32print.StartPagePrinter(h)
+                win32print.WritePrinter(h, data)
+                win32print.EndPagePrinter(h)
+            finally:
+                win32print.EndDocPrinter(h)
+        finally:
+            win32print.ClosePrinter(h)
+        return printer
+    cmd = ["lp", "-o", "raw"] + (["-d", printer] if printer else [])
+    subprocess.run(cmd, input=data, check=True, capture_output=True, timeout=15)
+    return printer or "(default)"
 
-                messagebox.showerror(
-                    "طباعة الملصق", f"تعذر فتح ورقة الطباعة عبر المتصفح:\\n{e}"
-                )
-            except Exception:
-                pass
+
+# ============================ UI ===============================
+class App(tk.Tk):
+
+    def print_label_browser(self, receipt_no: str, phone: str):
+        """
+        افتح ورقة طباعة عبر المتصفح بحجم 40×22 مم تحتوي على رقم السند ورقم جوال العميل.
+        """
+        self.print_labels_browser([(receipt_no, phone)])
+
+    def print_labels(self, labels):
+        """حسب الإعداد: بايتات ZPL/ESC-POS مباشرة للطابعة الحرارية، أو ورقة المتصفح."""
+        fmt = SETTINGS.get("label_format", "browser")
+        labels = [(no, phone) for no, phone in labels if no]
+        if fmt not in LABEL_RENDERERS:
+            self.print_labels_browser(labels)
+            return
+        if not labels:
+            return
+        try:
+            dest = send_raw_label(render_label_batch(labels, fmt))
+        except Exception as e:
+            logging.error(f"Raw label print failed: {e}")
+            messagebox.showerror("طباعة الملصق", f"تعذر إرسال الملصق للطابعة:\n{e}")
+            return
+        logging.info(f"Sent {len(labels)} {fmt} label(s) to {dest}")
+
+    def print_labels_browser(self, labels):
+        """عدة ملصقات في مستند واحد مقسم صفحات ← تبويب واحد ونافذة طباعة واحدة."""
+        labels = [(no, phone) for no, phone in labels if no]
+        if not labels:
+            return
+        try:
+            out = write_label_sheet(labels)
+            webbrowser.open(out.as_uri())
+        except Exception as e:
+            logging.error(f"Label sheet failed: {e}")
+            messagebox.showerror(
+                "طباعة الملصق", f"تعذر فتح ورقة الطباعة عبر المتصفح:\n{e}"
+            )
 
     def __init__(self):
         super().__init__()
@@ -896,6 +1356,7 @@ class App(tk.Tk):
 
         self.active_user = None
         self.active_branch = None
+        self.backend = get_backend()
         self.shop_mode_var = tk.BooleanVar(
             value=SETTINGS.get("use_shop_number_for_qr", False)
         )
@@ -910,6 +1371,35 @@ class App(tk.Tk):
         except Exception:
             pass
         self.init_styles()
+
+        # صيانة القاعدة وقت الخمول أو عند الإغلاق
+        self._last_input = time.monotonic()
+        self._maintenance_running = False
+        self.bind_all("<Any-KeyPress>", self._note_user_input, add="+")
+        self.bind_all("<Any-ButtonPress>", self._note_user_input, add="+")
+        # مسح باركود من أي شاشة (ماسح wedge)
+        self._scan_buf = []
+        self.receipt_nos = ReceiptNoMap()
+        self.bind_all("<Any-KeyPress>", self._scan_key, add="+")
+        # لوحة الأوامر: Ctrl+K (وبالتخطيط العربي ن)
+        self.quick_open = None
+        self._receipt_windows = {}  # rid -> Toplevel، الأقدم أولاً
+        for seq in ("<Control-k>", "<Control-K>", "<Control-Arabic_noon>"):
+            try:
+                self.bind_all(seq, self.show_palette)
+            except tk.TclError:
+                pass
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(60_000, self._maintenance_tick)
+        self._sync_running = False
+        self.after(SYNC_INTERVAL_MS, self._sync_tick)
+        # عامل طابور واتساب (يكمل الرسائل المعلقة من الجلسة السابقة)
+        try:
+            set_wa_backend(self.backend)
+            start_wa_worker()
+        except Exception as e:
+            logging.error(f"WhatsApp outbox worker failed to start: {e}")
+
         self.create_login()
 
     def init_styles(self):
@@ -976,12 +1466,21 @@ class App(tk.Tk):
         menubar = tk.Menu(self)
         m_file = tk.Menu(menubar, tearoff=0)
         m_file.add_command(label="📦 Backup DB", command=self.backup_db)
+        m_file.add_command(label="✅ Verify Backups", command=self.verify_backups)
+        m_file.add_command(label="♻️ Restore Backup…", command=self.restore_db)
+        m_file.add_command(
+            label="🗄️ Archive Closed Receipts", command=self.archive_old_receipts
+        )
         m_file.add_command(label="⬇️ Export Receipts (CSV)", command=self.export_csv)
         m_file.add_command(
             label="📂 Open Data Folder", command=lambda: self._open_path(str(DATA_DIR))
         )
         m_file.add_separator()
-        m_file.add_command(label="Exit", command=self.quit)
+        m_file.add_command(label="🧹 DB Maintenance", command=self.run_maintenance_now)
+        m_file.add_command(label="🔄 Sync to Head Office", command=self.sync_now)
+        m_file.add_command(label="📤 WhatsApp Outbox", command=self.show_wa_outbox)
+        m_file.add_separator()
+        m_file.add_command(label="Exit", command=self.on_close)
         menubar.add_cascade(label="File", menu=m_file)
 
         m_set = tk.Menu(menubar, tearoff=0)
@@ -993,6 +1492,9 @@ class App(tk.Tk):
         m_set.add_command(label="Set Shop Number", command=self.set_shop_number)
         m_set.add_command(label="Set Company Name", command=self.set_company)
         m_set.add_command(label="Set Currency", command=self.set_currency)
+        m_set.add_command(
+            label="Label output (ZPL / ESC-POS)…", command=self.set_label_output
+        )
         m_set.add_separator()
         m_set.add_checkbutton(
             label="Send WhatsApp automatically (Enter/Paste)",
@@ -1018,6 +1520,8 @@ class App(tk.Tk):
         m_set.add_command(
             label="Set WhatsApp auto-send delay (ms)", command=self.set_wa_delay
         )
+        m_set.add_separator()
+        m_set.add_command(label="Shop server (LAN) URL…", command=self.set_api_server)
         menubar.add_cascade(label="Settings", menu=m_set)
 
         m_help = tk.Menu(menubar, tearoff=0)
@@ -1050,6 +1554,68 @@ class App(tk.Tk):
             SETTINGS["whatsapp_auto_delay_ms"] = int(val)
             save_settings(SETTINGS)
 
+    def set_label_output(self):
+        fmt = simpledialog.askstring(
+            "Label output",
+            "صيغة الملصق: browser أو zpl أو escpos",
+            initialvalue=SETTINGS.get("label_format", "browser"),
+            parent=self,
+        )
+        if fmt is None:
+            return
+        fmt = fmt.strip().lower() or "browser"
+        if fmt != "browser" and fmt not in LABEL_RENDERERS:
+            messagebox.showerror("Label output", "صيغة غير معروفة.")
+            return
+        SETTINGS["label_format"] = fmt
+        if fmt != "browser":
+            target = simpledialog.askstring(
+                "Label output",
+                "الوجهة: فارغ = طابعة الملصقات المختارة\nأو tcp://192.168.1.50:9100 أو file:C:/labels.bin",
+                initialvalue=SETTINGS.get("label_raw_target", ""),
+                parent=self,
+            )
+            if target is not None:
+                SETTINGS["label_raw_target"] = target.strip()
+            if not str(SETTINGS.get("company", "")).isascii():
+                latin = simpledialog.askstring(
+                    "Label output",
+                    "اسم المحل بحروف لاتينية (يُطبع إن تعذر رسم الاسم العربي على الملصق):",
+                    initialvalue=SETTINGS.get("company_latin", ""),
+                    parent=self,
+                )
+                if latin is not None:
+                    SETTINGS["company_latin"] = latin.strip()
+            SETTINGS["label_qr"] = messagebox.askyesno(
+                "Label output", "إضافة QR برقم السند على الملصق؟", parent=self
+            )
+        save_settings(SETTINGS)
+
+    def set_api_server(self):
+        url = simpledialog.askstring(
+            "Shop server",
+            "عنوان خادم المحل (مثال: http://192.168.1.10:8765)\nاتركه فارغًا للعمل على ملف القاعدة المحلي:",
+            initialvalue=SETTINGS.get("api_url", ""),
+            parent=self,
+        )
+        if url is None:
+            return
+        SETTINGS["api_url"] = url.strip()
+        if SETTINGS["api_url"]:
+            token = simpledialog.askstring(
+                "Shop server",
+                "رمز الوصول (يظهر عند تشغيل خادم المحل أول مرة):",
+                initialvalue=SETTINGS.get("api_token", ""),
+                parent=self,
+            )
+            if token is not None:
+                SETTINGS["api_token"] = token.strip()
+        save_settings(SETTINGS)
+        self.backend = get_backend()
+        set_wa_backend(self.backend)
+        # المستخدم والفرع يتبعان مصدر البيانات → إعادة تسجيل الدخول
+        self.create_login()
+
     def _open_path(self, p):
         try:
             if platform.system() == "Windows":
@@ -1150,7 +1716,10 @@ class App(tk.Tk):
             f"{APP_NAME}\n{MADE_BY}\nData: {DATA_DIR}\nLog: {LOG_PATH}\n"
             f"Label printer: {SETTINGS.get('label_printer') or '(Default)'}\n"
             f"WA auto-send: {'ON' if SETTINGS.get('whatsapp_auto_send', True) else 'OFF'} "
-            f"({SETTINGS.get('whatsapp_auto_delay_ms', 1200)} ms)",
+            f"({SETTINGS.get('whatsapp_auto_delay_ms', 1200)} ms)\n"
+            f"DB writes: {DB_LOCK_STATS['transactions']} — lock waits: {DB_LOCK_STATS['lock_waits']} "
+            f"({DB_LOCK_STATS['lock_wait_ms']:.0f} ms), retries: {DB_LOCK_STATS['retries']}, "
+            f"failed: {DB_LOCK_STATS['failures']}",
         )
 
     # ---------- Login ----------
@@ -1250,31 +1819,18 @@ class App(tk.Tk):
             username = user_e.get().strip()
             password = pass_e.get().strip()
 
-            con = db_conn()
-            cur = con.cursor()
-            cur.execute(
-                "SELECT id,branch_id,username,password,role FROM users WHERE username=?",
-                (username,),
-            )
-            row = cur.fetchone()
-            con.close()
-            if not row or not password_matches(row[3], password):
+            try:
+                auth = self.backend.login(username, password)
+            except Exception as e:
+                messagebox.showerror("خطأ", f"تعذر الاتصال بالخادم:\n{e}")
+                return
+            if not auth:
                 messagebox.showerror("خطأ", "بيانات الدخول غير صحيحة")
                 return
 
             # حفظ بيانات المستخدم النشط
-            self.active_user = {
-                "id": row[0],
-                "branch_id": row[1],
-                "username": row[2],
-                "role": row[4],
-            }
-            con = db_conn()
-            cur = con.cursor()
-            cur.execute("SELECT id,name,code FROM branches WHERE id=?", (row[1],))
-            b = cur.fetchone()
-            con.close()
-            self.active_branch = {"id": b[0], "name": b[1], "code": b[2]}
+            self.active_user, self.active_branch = auth
+            self._load_intake_indexes()
 
             # إذا تم اختيار "تذكرني"
             if remember_checked.get():
@@ -1333,86 +1889,40 @@ class App(tk.Tk):
         ttk.Button(
             top, text="📊 تقرير اليوم (المدفوع)", command=self.show_daily_paid_report
         ).pack(side="left", padx=4)
+        ttk.Button(top, text="📈 تقرير الفترة", command=self.show_range_report).pack(
+            side="left", padx=4
+        )
+        ttk.Button(top, text="📣 حملات واتساب", command=self.show_campaigns).pack(
+            side="left", padx=4
+        )
         ttk.Button(top, text="📦 نسخة احتياطية", command=self.backup_db).pack(
             side="left", padx=4
         )
+        if self.active_user.get("role") in ("admin", "owner"):
+            ttk.Button(
+                top,
+                text="🏬 لوحة المالك (كل الفروع)",
+                command=self.show_owner_dashboard,
+            ).pack(side="left", padx=4)
         ttk.Button(top, text="🚪 خروج", command=self.create_login).pack(
             side="right", padx=4
         )
 
         # ====== الإحصائيات ======
-        con = db_conn()
-        cur = con.cursor()
-
-        # عدد كل حالة
-        counts = {s: 0 for s in STATUS_ORDER}
-        cur.execute(
-            "SELECT status, COUNT(*) FROM receipts WHERE branch_id=? GROUP BY status",
-            (self.active_branch["id"],),
-        )
-        for st, cnt in cur.fetchall():
-            counts[st] = cnt
-
-        # تحديد نطاق اليوم الحالي (حسب توقيت الرياض)
-        today_local = to_riyadh(datetime.datetime.now(datetime.UTC)).date()
-
-        start_utc = datetime.datetime(
-            today_local.year, today_local.month, today_local.day
-        ) - datetime.timedelta(hours=RIYADH_UTC_OFFSET_HOURS)
-        end_utc = start_utc + datetime.timedelta(days=1)
-
-        # ===== عدد السندات اليوم (بدون الملغاة) =====
-        cur.execute(
-            """
-            SELECT COUNT(*) FROM receipts
-            WHERE branch_id=? 
-              AND datetime(REPLACE(created_utc,'T',' ')) >= datetime(?)
-              AND datetime(REPLACE(created_utc,'T',' ')) < datetime(?)
-              AND status!='ملغي'
-        """,
-            (
-                self.active_branch["id"],
-                start_utc.isoformat().replace("T", " "),
-                end_utc.isoformat().replace("T", " "),
-            ),
-        )
-        receipts_today = cur.fetchone()[0] or 0
-
-        # ===== عدد المدفوعات اليوم =====
-        cur.execute(
-            """
-            SELECT COUNT(*) FROM receipts
-            WHERE branch_id=?
-              AND paid_flag=1
-              AND datetime(REPLACE(paid_utc,'T',' ')) >= datetime(?)
-              AND datetime(REPLACE(paid_utc,'T',' ')) < datetime(?)
-        """,
-            (
-                self.active_branch["id"],
-                start_utc.isoformat().replace("T", " "),
-                end_utc.isoformat().replace("T", " "),
-            ),
-        )
-        paid_today = cur.fetchone()[0] or 0
-
-        # ===== إجمالي المبالغ المدفوعة اليوم =====
-        cur.execute(
-            """
-            SELECT COALESCE(SUM(paid_amount),0) FROM receipts
-            WHERE branch_id=?
-              AND paid_flag=1
-              AND datetime(REPLACE(paid_utc,'T',' ')) >= datetime(?)
-              AND datetime(REPLACE(paid_utc,'T',' ')) < datetime(?)
-        """,
-            (
-                self.active_branch["id"],
-                start_utc.isoformat().replace("T", " "),
-                end_utc.isoformat().replace("T", " "),
-            ),
-        )
-        total_paid_today = cur.fetchone()[0] or 0.0
-
-        con.close()
+        try:
+            dash = self.backend.dashboard_stats(self.active_branch["id"])
+        except Exception as e:
+            logging.error(f"dashboard stats failed: {e}")
+            dash = {
+                "counts": {},
+                "receipts_today": 0,
+                "paid_today": 0,
+                "total_paid_today": 0.0,
+            }
+        counts = dash["counts"]
+        receipts_today = dash["receipts_today"]
+        paid_today = dash["paid_today"]
+        total_paid_today = dash["total_paid_today"]
 
         # ====== عرض بطاقات الإحصائيات ======
         stats = ttk.Frame(main)
@@ -1484,7 +1994,256 @@ class App(tk.Tk):
             font=("Tahoma", 12),
         ).pack()
 
+    # ---------- Owner dashboard ----------
+    def show_owner_dashboard(self):
+        win = tk.Toplevel(self)
+        win.title("لوحة المالك — كل الفروع")
+        win.configure(bg=SURFACE_BG)
+        win.geometry("1100x360")
+        self.header_bar(win, text_left="🏬 مقارنة الفروع — اليوم").pack(fill="x")
+
+        wrap = ttk.Frame(win, padding=10)
+        wrap.pack(fill="both", expand=True)
+        cols = ("branch",) + tuple(STATUS_ORDER) + ("today", "paid", "revenue")
+        headers = {
+            "branch": "الفرع",
+            "today": "سندات اليوم",
+            "paid": "مدفوعة اليوم",
+            "revenue": "إيراد اليوم",
+        }
+        tree = ttk.Treeview(wrap, columns=cols, show="headings", height=8)
+        for c in cols:
+            tree.heading(c, text=headers.get(c, c))
+            tree.column(c, width=160 if c == "branch" else 95, anchor="center")
+        add_treeview_scrollbars(wrap, tree)
+
+        footer_var = tk.StringVar(value="—")
+        ttk.Label(win, textvariable=footer_var, padding=8).pack(anchor="w")
+        cur_ccy = SETTINGS.get("currency", "SAR")
+
+        def row_values(b):
+            return (
+                f"{b['name']} ({b['code']})",
+                *(b["counts"].get(st, 0) for st in STATUS_ORDER),
+                b["receipts_today"],
+                b["paid_today"],
+                f"{b['total_paid_today']:.2f} {cur_ccy}",
+            )
+
+        def refresh():
+            if not win.winfo_exists():
+                return
+            try:
+                data = self.backend.owner_dashboard()
+            except Exception as e:
+                footer_var.set(f"تعذر التحديث: {e}")
+                data = None
+            if data:
+                # تحديث الصفوف المتغيرة فقط بدل إعادة بناء الجدول
+                seen = set()
+                total = 0.0
+                for b in data["branches"]:
+                    iid = str(b["id"])
+                    seen.add(iid)
+                    vals = row_values(b)
+                    total += b["total_paid_today"]
+                    if tree.exists(iid):
+                        if tuple(map(str, tree.item(iid, "values"))) != tuple(
+                            map(str, vals)
+                        ):
+                            tree.item(iid, values=vals)
+                    else:
+                        tree.insert("", "end", iid=iid, values=vals)
+                for iid in tree.get_children():
+                    if iid not in seen:
+                        tree.delete(iid)
+                footer_var.set(
+                    f"اليوم {data['day']} — إجمالي الإيراد لكل الفروع: {total:.2f} {cur_ccy} "
+                    f"— آخر تحديث {datetime.datetime.now().strftime('%H:%M:%S')}"
+                )
+            win.after(OWNER_DASH_TTL_SECONDS * 1000, refresh)
+
+        refresh()
+
     # ---------- New Receipt ----------
+    def _load_intake_indexes(self):
+        """Build the autocomplete indexes off the UI thread (100k عميل ≈ ثانية ونصف)."""
+        self.customers = None
+        self.device_suggestions = None
+        self.receipt_nos = ReceiptNoMap()
+        self.quick_open = None
+        backend = self.backend
+
+        def worker():
+            try:
+                receipt_nos = ReceiptNoMap(backend.receipt_numbers())
+                if backend is self.backend:
+                    self.receipt_nos = receipt_nos
+                quick_open = QuickOpenIndex(backend.palette_rows())
+                if backend is self.backend:
+                    self.quick_open = quick_open
+                devices = DeviceSuggestions(backend.device_stats())
+                if backend is self.backend:
+                    self.device_suggestions = devices
+                directory = CustomerDirectory(backend.customers())
+            except Exception as e:
+                logging.error(f"Intake index load failed: {e}")
+                return
+            if backend is self.backend:
+                self.customers = directory
+
+        threading.Thread(target=worker, name="customer-index", daemon=True).start()
+
+    def _refresh_quick_open(self):
+        """Merge receipts changed since the last load (background thread); returns it."""
+        qi, backend = self.quick_open, self.backend
+
+        def worker():
+            try:
+                snapshot = backend.palette_rows(qi.seq)
+            except Exception as e:
+                logging.error(f"Quick-open refresh failed: {e}")
+                return
+            qi.update(snapshot)
+            for rid, rno, cid, name, phone, *_ in snapshot["rows"]:
+                self.receipt_nos.add(rno, rid)
+                if self.customers is not None:
+                    self.customers.upsert(cid, name, phone)
+
+        t = threading.Thread(target=worker, name="quick-open", daemon=True)
+        t.start()
+        return t
+
+    def _palette_screens(self) -> list:
+        screens = [
+            ("🏠 الرئيسية", self.create_dashboard),
+            ("➕ سند جديد", self.create_new_receipt),
+            ("📄 جميع السندات", self.list_receipts),
+            ("📊 تقرير اليوم (المدفوع)", self.show_daily_paid_report),
+            ("📈 تقرير الفترة", self.show_range_report),
+            ("📣 حملات واتساب", self.show_campaigns),
+            ("📤 طابور واتساب", self.show_wa_outbox),
+            ("📦 نسخة احتياطية", self.backup_db),
+        ]
+        if self.active_user.get("role") in ("admin", "owner"):
+            screens.append(("🏬 لوحة المالك (كل الفروع)", self.show_owner_dashboard))
+        return screens
+
+    def show_palette(self, _evt=None):
+        """Ctrl+K: بحث واحد في الشاشات والسندات والعملاء من الفهارس في الذاكرة."""
+        if self.active_user is None:
+            return
+        old = getattr(self, "_palette_win", None)
+        if old is not None and old.winfo_exists():
+            old.lift()
+            old.focus_force()
+            return "break"
+
+        win = tk.Toplevel(self)
+        self._palette_win = win
+        win.title("بحث سريع")
+        win.transient(self)
+        win.configure(bg=SURFACE_BG)
+        win.geometry(f"640x360+{self.winfo_rootx() + 120}+{self.winfo_rooty() + 80}")
+        entry = ttk.Entry(win, font=("Tahoma", 13), justify="right")
+        entry.pack(fill="x", padx=10, pady=(10, 6), ipady=4)
+        entry._scan_target = True  # Enter يفتح أول نتيجة
+        lb = tk.Listbox(win, font=("Tahoma", 11), activestyle="none", height=12)
+        lb.pack(fill="both", expand=True, padx=10)
+        ttk.Label(
+            win,
+            text="Enter فتح — ↑↓ تنقل — Esc إغلاق",
+            foreground="#777",
+            padding=(10, 4),
+        ).pack(anchor="e")
+        results = []
+
+        def refresh():
+            text = entry.get().strip()
+            key = _name_key(text)
+            items = [
+                (label, cmd)
+                for label, cmd in self._palette_screens()
+                if not key or key in _name_key(label)
+            ]
+            qi = self.quick_open
+            if text and qi is not None:
+                for rid, rno, _cid, name, _ph, brand, model, status, _t in qi.search(
+                    text
+                ):
+                    items.append(
+                        (
+                            f"🧾 {rno} — {name} — {brand} {model} [{status}]",
+                            functools.partial(self.open_receipt, rid),
+                        )
+                    )
+            rid = self.receipt_nos.get(normalize_scan(text)) if text else None
+            if rid is not None and (qi is None or rid not in qi.receipts):
+                items.append(
+                    (
+                        f"🧾 {normalize_scan(text)} (مؤرشف)",
+                        functools.partial(self.open_receipt, rid),
+                    )
+                )
+            if text and self.customers is not None:
+                for cid, name, phone in self.customers.search(text, 5):
+                    items.append(
+                        (
+                            f"👤 {name} — {phone}",
+                            functools.partial(self.show_customer, cid),
+                        )
+                    )
+            results[:] = items
+            lb.delete(0, "end")
+            for label, _cmd in items:
+                lb.insert("end", label)
+            if items:
+                lb.selection_set(0)
+
+        def move(step):
+            sel = lb.curselection()
+            i = min(max((sel[0] if sel else -1) + step, 0), len(results) - 1)
+            if i >= 0:
+                lb.selection_clear(0, "end")
+                lb.selection_set(i)
+                lb.see(i)
+            return "break"
+
+        def choose(*_):
+            sel = lb.curselection()
+            i = sel[0] if sel else 0
+            if i < len(results):
+                cmd = results[i][1]
+                win.destroy()
+                cmd()
+
+        entry.bind(
+            "<KeyRelease>",
+            lambda e: e.keysym in ("Up", "Down", "Return") or refresh(),
+        )
+        entry.bind("<Down>", lambda _e: move(1))
+        entry.bind("<Up>", lambda _e: move(-1))
+        entry.bind("<Return>", choose)
+        lb.bind("<Double-1>", choose)
+        win.bind("<Escape>", lambda _e: win.destroy())
+        refresh()
+        entry.focus_force()
+
+        # دمج ما تغيّر منذ آخر تحميل ثم إعادة عرض النتائج
+        if self.quick_open is not None:
+            pending = self._refresh_quick_open()
+
+            def wait():
+                if not win.winfo_exists():
+                    return
+                if pending.is_alive():
+                    win.after(100, wait)
+                else:
+                    refresh()
+
+            win.after(100, wait)
+        return "break"
+
     def create_new_receipt(self):
         self.clear()
         self.build_menubar()
@@ -1587,6 +2346,26 @@ class App(tk.Tk):
 
         phone_e.bind("<KeyRelease>", validate_phone)
 
+        # إكمال تلقائي للعملاء السابقين (بالاسم أو بالجوال)
+        def suggest_customers(text):
+            directory = getattr(self, "customers", None)
+            if directory is None:
+                return []
+            return [
+                (f"{name} — {phone}", (name, phone))
+                for _cid, name, phone in directory.search(text)
+            ]
+
+        def pick_customer(value):
+            name, phone = value
+            name_e.config(foreground="black")
+            name_var.set(name)
+            phone_var.set(phone)
+            validate_phone()
+
+        attach_autocomplete(name_e, suggest_customers, pick_customer)
+        attach_autocomplete(phone_e, suggest_customers, pick_customer, min_chars=5)
+
         # ===== بيانات الجهاز =====
         sec2 = self.card(main)
         sec2.grid(row=1, column=0, columnspan=2, sticky="ew", pady=10)
@@ -1612,6 +2391,106 @@ class App(tk.Tk):
             dev_e[lbl] = e
         sec2.columnconfigure(1, weight=1)
 
+        # اقتراحات حسب الأكثر استخداماً (الموديل حسب الماركة المختارة)
+        def device_field_value(lbl):
+            v = dev_e[lbl].get().strip()
+            return "" if v == labels[lbl] else v
+
+        def attach_device_suggest(lbl, field):
+            entry = dev_e[lbl]
+
+            def suggest(text):
+                sugg = getattr(self, "device_suggestions", None)
+                if sugg is None:
+                    return []
+                brand = device_field_value("الماركة") if field == "model" else ""
+                return [(v, v) for v in sugg.suggest(field, text, brand)]
+
+            def pick(value):
+                entry.delete(0, "end")
+                entry.insert(0, value)
+                entry.config(foreground="black")
+
+            attach_autocomplete(entry, suggest, pick, min_chars=1)
+
+        for lbl, field in (
+            ("النوع", "type"),
+            ("الماركة", "brand"),
+            ("الموديل", "model"),
+            ("الملحقات", "accessories"),
+        ):
+            attach_device_suggest(lbl, field)
+
+        # سجل الجهاز بالـ Serial/IMEI: استلامات سابقة + الضمان + استخدام نفس سجل الجهاز
+        serial_info = tk.Label(
+            sec2, text="", bg="white", fg="#8e24aa", justify="right", anchor="w"
+        )
+        serial_info.grid(row=8, column=1, sticky="ew", padx=5)
+        reuse_var = tk.BooleanVar(value=False)
+        reuse_device = {"id": None, "serial": ""}
+        reuse_chk = ttk.Checkbutton(
+            sec2, text="استخدام بيانات الجهاز السابق", variable=reuse_var
+        )
+
+        def lookup_serial(_=None):
+            serial = device_field_value("Serial/IMEI")
+            if serial.upper() == reuse_device["serial"]:
+                return
+            reuse_device.update(id=None, serial=serial.upper())
+            reuse_var.set(False)
+            reuse_chk.grid_remove()
+            serial_info.config(text="")
+            if len(serial) < 4:
+                return
+            try:
+                history = self.backend.device_history(serial)
+            except Exception as e:
+                logging.error(f"Serial lookup failed: {e}")
+                return
+            if not history:
+                return
+            last = history[0]
+            open_ones = [h for h in history if h["status"] not in CLOSED_STATUSES]
+            lines = [
+                f"⚠️ هذا الجهاز استُلم {len(history)} مرة سابقاً — آخر سند {last['receipt_no']} "
+                f"({last['status']}) باسم {last['cust_name']}"
+            ]
+            if open_ones:
+                lines.append(
+                    "❗ يوجد سند مفتوح لنفس الجهاز: "
+                    + "، ".join(h["receipt_no"] for h in open_ones)
+                )
+            if last["warranty_end_utc"]:
+                end_txt = fmt_dt(to_riyadh(parse_utc_iso(last["warranty_end_utc"])))
+                lines.append(
+                    f"🛡️ الضمان ساري حتى {end_txt}"
+                    if last["in_warranty"]
+                    else f"🛡️ الضمان منتهٍ ({end_txt})"
+                )
+            serial_info.config(text="\n".join(lines))
+            reuse_device["id"] = last["device_id"]
+            reuse_chk.grid(row=9, column=1, sticky="w", padx=5)
+
+            def fill_from_history():
+                if not reuse_var.get():
+                    return
+                for lbl, key in (
+                    ("النوع", "type"),
+                    ("الماركة", "brand"),
+                    ("الموديل", "model"),
+                    ("اللون", "color"),
+                ):
+                    if last[key]:
+                        dev_e[lbl].delete(0, "end")
+                        dev_e[lbl].insert(0, last[key])
+                        dev_e[lbl].config(foreground="black")
+
+            reuse_chk.configure(command=fill_from_history)
+
+        dev_e["Serial/IMEI"].bind("<FocusOut>", lookup_serial, add="+")
+        dev_e["Serial/IMEI"].bind("<Return>", lookup_serial, add="+")
+        dev_e["Serial/IMEI"]._scan_target = True  # Enter يبحث في سجل الجهاز
+
         ttk.Label(sec2, text="حالة الجهاز:", style="Card.TLabel").grid(
             row=7, column=0, sticky="e", padx=5, pady=3
         )
@@ -1698,18 +2577,18 @@ class App(tk.Tk):
                 return
             phone = normalize_phone(phone_raw)
 
-            dev_type = dev_e["النوع"].get().strip()
-            brand = dev_e["الماركة"].get().strip()
-            model = dev_e["الموديل"].get().strip()
+            dev_type = device_field_value("النوع")
+            brand = device_field_value("الماركة")
+            model = device_field_value("الموديل")
             if not dev_type or not brand or not model:
                 messagebox.showerror(
                     "خطأ", "اكمل بيانات الجهاز (النوع/الماركة/الموديل)"
                 )
                 return
 
-            serial = dev_e["Serial/IMEI"].get().strip()
-            color = dev_e["اللون"].get().strip()
-            acc = dev_e["الملحقات"].get().strip()
+            serial = device_field_value("Serial/IMEI")
+            color = device_field_value("اللون")
+            acc = device_field_value("الملحقات")
             device_state = device_state_var.get().strip() or None
             issue = issue_t.get("1.0", "end").strip()
             work = work_t.get("1.0", "end").strip()
@@ -1719,92 +2598,48 @@ class App(tk.Tk):
                 messagebox.showerror("خطأ", "التكلفة التقديرية رقم")
                 return
 
-            con = db_conn()
-            cur = con.cursor()
-            cur.execute("SELECT id,name FROM customers WHERE phone=?", (phone,))
-            row = cur.fetchone()
-            if row:
-                cust_id = row[0]
-                if row[1] != name:
-                    cur.execute(
-                        "UPDATE customers SET name=? WHERE id=?", (name, cust_id)
-                    )
-            else:
-                cur.execute(
-                    "INSERT INTO customers(name,phone) VALUES(?,?)", (name, phone)
-                )
-                cust_id = cur.lastrowid
-
-            cur.execute(
-                "INSERT INTO devices(customer_id,type,brand,model,serial_imei,color,accessories) VALUES(?,?,?,?,?,?,?)",
-                (
-                    cust_id,
-                    dev_type,
-                    brand,
-                    model,
-                    serial or None,
-                    color or None,
-                    acc or None,
-                ),
-            )
-            dev_id = cur.lastrowid
-
-            rno = generate_receipt_no(self.active_branch["code"])
-            otp = random_otp()
-            tracking_hint = f"{SETTINGS.get('company','ATTA')} — أحضر رقم السند والرمز"
-            initial_text = make_whatsapp_initial_text(
-                rno, f"{brand} {model}", issue, otp, tracking_hint, device_state
-            )
-            wa = f"whatsapp://send?phone={phone}&text={ul.quote(initial_text,safe='')}"
-            qr_path = make_qr(wa, f"{rno}.png") if qrcode else ""
-            now = datetime.datetime.now(datetime.UTC).isoformat()
-
-            cur.execute(
-                """
-                INSERT INTO receipts(
-                    branch_id,customer_id,device_id,receipt_no,issue_desc,work_request,est_amount,approved_amount,device_state,status,
-                    otp_code,whatsapp_link,qr_path,signature_path,created_utc,paid_flag,paid_amount,paid_utc,payment_method
+            try:
+                res = self.backend.create_receipt(
+                    self.active_branch,
+                    self.active_user["username"],
+                    name=name,
+                    phone=phone,
+                    dev_type=dev_type,
+                    brand=brand,
+                    model=model,
+                    serial=serial,
+                    color=color,
+                    accessories=acc,
+                    device_state=device_state,
+                    issue=issue,
+                    work=work,
+                    est=est,
+                    device_id=(
+                        reuse_device["id"]
+                        if reuse_var.get() and reuse_device["serial"] == serial.upper()
+                        else None
+                    ),
                 )
-                VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            """,
-                (
-                    self.active_branch["id"],
-                    cust_id,
-                    dev_id,
-                    rno,
-                    issue,
-                    work,
-                    est,
-                    None,
-                    device_state,
-                    "جديد",
-                    otp,
-                    wa,
-                    qr_path,
-                    None,
-                    now,
-                    0,
-                    0.0,
-                    None,
-                    None,
-                ),
-            )
-            rid = cur.lastrowid
-            cur.execute(
-                "INSERT INTO status_history(receipt_id,from_status,to_status,at_utc,by_username) VALUES(?,?,?,?,?)",
-                (rid, None, "جديد", now, self.active_user["username"]),
-            )
-            con.commit()
-            con.close()
-            log_activity(
-                rid,
-                "CREATE",
-                f"Receipt created with no {rno}",
-                self.active_user["username"],
-            )
+            except Exception as e:
+                logging.exception("Receipt save failed")
+                messagebox.showerror("خطأ", f"تعذر حفظ السند:\n{e}")
+                return
+            rid, rno, otp = res["id"], res["receipt_no"], res["otp"]
+            self.receipt_nos.add(rno, rid)
+            if getattr(self, "customers", None) is not None:
+                self.customers.upsert(res["customer_id"], name, phone)
+            if getattr(self, "device_suggestions", None) is not None:
+                self.device_suggestions.add(dev_type, brand, model, acc)
+            initial_text = res["initial_text"]
 
             if wa_send_var.get():
-                open_whatsapp_desktop(phone, initial_text)
+                open_whatsapp_desktop(
+                    phone,
+                    initial_text,
+                    receipt_id=rid,
+                    kind="WA_OPEN",
+                    username=self.active_user["username"],
+                )
 
             messagebox.showinfo(
                 "تم", f"تم إنشاء السند: {rno}\nتم تجهيز رسالة واتساب ورمز OTP: {otp}"
@@ -1879,7 +2714,10 @@ class App(tk.Tk):
             toolbar, text="🔄 تحديث", style="Modern.TButton", command=lambda: refresh()
         ).pack(side="left", padx=5)
         ttk.Button(
-            toolbar, text="⬇️ تصدير CSV", style="Modern.TButton", command=self.export_csv
+            toolbar,
+            text="⬇️ تصدير CSV",
+            style="Modern.TButton",
+            command=lambda: self.export_csv(include_archive=archive_var.get()),
         ).pack(side="left", padx=5)
         ttk.Button(
             toolbar,
@@ -1887,6 +2725,12 @@ class App(tk.Tk):
             style="Modern.TButton",
             command=self.backup_db,
         ).pack(side="left", padx=5)
+        ttk.Button(
+            toolbar,
+            text="🏷️ ملصقات المحدد",
+            style="Modern.TButton",
+            command=lambda: print_selected_labels(),
+        ).pack(side="left", padx=5)
         ttk.Button(
             toolbar,
             text="⬅️ رجوع",
@@ -1912,11 +2756,46 @@ class App(tk.Tk):
         )
         paid_cmb.set("الكل")
         paid_cmb.pack(side="left", padx=5)
+        archive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            top,
+            text="🗄️ تضمين الأرشيف",
+            variable=archive_var,
+            command=lambda: refresh(),
+        ).pack(side="left", padx=5)
+        ttk.Label(top, text="آخر أرقام الجوال:", font=("Tahoma", 10)).pack(
+            side="left", padx=(15, 0)
+        )
+        suffix_e = ttk.Entry(top, width=8)
+        suffix_e.pack(side="left", padx=5, ipady=3)
+
+        def phone_suffix_search(_=None):
+            nonlocal all_rows_cache
+            # لاحقة خام: normalize_phone يحذف 00 البادئة ("0045" ← "45")
+            digits = "".join(ch for ch in suffix_e.get() if ch.isdigit())
+            if len(digits) < 3:
+                if not digits:
+                    refresh()
+                return
+            try:
+                rows = self.backend.receipts_by_phone_suffix(
+                    self.active_branch["id"], digits
+                )
+            except Exception as e:
+                messagebox.showerror("بحث", f"تعذر البحث بالجوال:\n{e}")
+                return
+            # السندات المفتوحة فقط لهذا العميل/العملاء
+            all_rows_cache = rows
+            current_page["num"] = 0
+            display_page()
+
+        suffix_e.bind("<KeyRelease>", phone_suffix_search)
         ttk.Label(top, text="مسح باركود:", font=("Tahoma", 10)).pack(
             side="left", padx=(15, 0)
         )
         bc_entry = ttk.Entry(top, width=20)
         bc_entry.pack(side="left", padx=5, ipady=3)
+        bc_entry._scan_target = True  # يعالج Enter بنفسه
 
         def _open_bc(*_):
             val = bc_entry.get().strip()
@@ -1944,6 +2823,7 @@ class App(tk.Tk):
             columns=("no", "created", "cust", "dev", "status", "est", "paid"),
             show="headings",
             height=22,
+            selectmode="extended",
         )
 
         widths = {
@@ -1974,16 +2854,33 @@ class App(tk.Tk):
         # قائمة منبثقة
         menu = tk.Menu(tree, tearoff=0)
         menu.add_command(label="📄 فتح السند", command=lambda: open_selected())
+        menu.add_command(label="🖨️ طباعة ملصق", command=lambda: print_selected_labels())
         menu.add_command(
-            label="🖨️ طباعة",
-            command=lambda: self.print_label_browser(tree.set(tree.focus(), "no")),
+            label="👤 ملف العميل", command=lambda: open_selected_customer()
         )
         menu.add_separator()
         menu.add_command(label="🔁 تحديث", command=lambda: refresh())
 
+        def open_selected_customer():
+            row = next((r for r in all_rows_cache if str(r[0]) == tree.focus()), None)
+            if row:
+                self.show_customer(phone=row[3])
+
+        def print_selected_labels():
+            # دفعة واحدة لكل الصفوف المحددة (Ctrl/Shift + نقر)
+            selected = set(tree.selection())
+            labels = [(r[1], r[3]) for r in all_rows_cache if str(r[0]) in selected]
+            if not labels:
+                messagebox.showinfo("الملصقات", "حدد سنداً واحداً أو أكثر من القائمة.")
+                return
+            self.print_labels(labels)
+
         def show_context_menu(event):
             try:
-                tree.selection_set(tree.identify_row(event.y))
+                row = tree.identify_row(event.y)
+                # لا نلغي التحديد المتعدد إذا كان النقر على صف محدد أصلاً
+                if row and row not in tree.selection():
+                    tree.selection_set(row)
                 menu.tk_popup(event.x_root, event.y_root)
             finally:
                 menu.grab_release()
@@ -2051,7 +2948,16 @@ class App(tk.Tk):
                     messagebox.showerror("فتح السند", f"تعذر فتح السند: {e}")
 
         tree.bind("<Return>", open_selected)
+        tree._scan_target = True  # Enter يفتح الصف المحدد؛ لا نفتح سنداً ثانياً
         tree.bind("<Double-1>", open_selected)
+        # تحميل تفاصيل الصف المحدد مسبقاً: الفتح بعدها من الذاكرة
+        tree.bind(
+            "<<TreeviewSelect>>",
+            lambda _e: tree.focus()
+            and RECEIPT_DETAIL_CACHE.prefetch(
+                int(tree.focus()), self.backend.receipt_detail
+            ),
+        )
 
         # إدخال الصفوف
         def insert_row(r):
@@ -2093,44 +2999,17 @@ class App(tk.Tk):
             st = status_cmb.get().strip()
             paid_filter = paid_cmb.get().strip()
 
-            con = db_conn()
-            cur = con.cursor()
-            cur.execute(
-                """
-                SELECT r.id,r.receipt_no,c.name,c.phone,d.brand,d.model,
-                       r.status,r.est_amount,r.created_utc,
-                       COALESCE(r.paid_flag,0) AS paid_flag
-                FROM receipts r
-                JOIN customers c ON r.customer_id=c.id
-                JOIN devices d   ON r.device_id=d.id
-                WHERE r.branch_id=?
-                ORDER BY r.id DESC
-                """,
-                (self.active_branch["id"],),
-            )
-            rows = cur.fetchall()
-            con.close()
-
-            result = []
-            for r in rows:
-                created_utc = (
-                    parse_utc_iso(r[8]) if r[8] else datetime.datetime.now(datetime.UTC)
+            try:
+                result = self.backend.search_receipts(
+                    self.active_branch["id"],
+                    q=q,
+                    status=st,
+                    paid="" if paid_filter == "الكل" else paid_filter,
+                    include_archive=archive_var.get(),
                 )
-                created_local = to_riyadh(created_utc)
-                created_str = fmt_dt(created_local)
-                blob = " ".join(
-                    map(str, [r[1], r[2], r[3], r[4], r[5], created_str])
-                ).lower()
-                if q and q not in blob:
-                    continue
-                if st and r[6] != st:
-                    continue
-                paid_flag = int(r[9] or 0)
-                if paid_filter == "مدفوع" and paid_flag != 1:
-                    continue
-                if paid_filter == "غير مدفوع" and paid_flag != 0:
-                    continue
-                result.append(r)
+            except Exception as e:
+                messagebox.showerror("بحث", f"تعذر تحميل السندات:\n{e}")
+                return
 
             all_rows_cache = result
             current_page["num"] = 0
@@ -2139,13 +3018,25 @@ class App(tk.Tk):
         refresh()
 
     # ---------- Export / Backup ----------
-    def export_csv(self):
-        con = db_conn()
+    def _server_only(self, title: str) -> bool:
+        """وضع الشبكة: عمليات ملف القاعدة (نسخ، استرجاع، أرشفة، صيانة، تصدير) تتم على جهاز الخادم."""
+        if not self.backend.remote:
+            return False
+        messagebox.showinfo(
+            title,
+            "هذا الجهاز يعمل عبر خادم المحل — نفّذ هذه العملية من جهاز الخادم.",
+        )
+        return True
+
+    def export_csv(self, include_archive: bool = False):
+        if self._server_only("تصدير"):
+            return
+        con = db_conn(archive=include_archive)
         cur = con.cursor()
         cur.execute(
-            """
+            f"""
             SELECT r.receipt_no,c.name,c.phone,d.brand,d.model,r.status,r.est_amount,r.created_utc,r.delivered_utc
-            FROM receipts r
+            FROM {"all_receipts" if include_archive else "receipts"} r
             JOIN customers c ON r.customer_id=c.id
             JOIN devices d   ON r.device_id=d.id
             WHERE r.branch_id=?
@@ -2178,35 +3069,306 @@ class App(tk.Tk):
         self._open_path(str(path))
 
     def backup_db(self):
+        if self._server_only("نسخة احتياطية"):
+            return
         if not DB_PATH.exists():
             messagebox.showwarning("تنبيه", "لا يوجد ملف قاعدة بيانات بعد")
             return
-        ts = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-        dst = BACKUP_DIR / f"repairdesk_{ts}.db"
-        shutil.copy2(DB_PATH, dst)
-        messagebox.showinfo("تم", f"تم إنشاء نسخة احتياطية: {dst}")
+        try:
+            info = create_verified_backup()
+        except Exception as e:
+            logging.exception("Backup failed")
+            messagebox.showerror("خطأ", f"تعذر إنشاء النسخة الاحتياطية:\n{e}")
+            return
+        if not info["ok"]:
+            messagebox.showerror(
+                "تحذير",
+                f"تم إنشاء النسخة لكن الفحص فشل:\n{info['file']}\n{info['quick_check']}",
+            )
+            return
+        messagebox.showinfo(
+            "تم",
+            f"تم إنشاء نسخة احتياطية: {info['file']}\n"
+            f"الفحص: {info['quick_check']} ({info['check_ms']} ms)\n"
+            f"آخر سند: #{info['max_receipt_id'] or '-'}",
+        )
 
-    # ---------- Receipt Detail ----------
-    def open_receipt_by_no(self, receipt_no: str):
-        receipt_no = receipt_no.strip()
-        con = db_conn()
-        cur = con.cursor()
-        cur.execute(
-            "SELECT id FROM receipts WHERE receipt_no = ? LIMIT 1", (receipt_no,)
+    # ---------- DB maintenance ----------
+    def _note_user_input(self, _evt=None):
+        self._last_input = time.monotonic()
+
+    def _scan_key(self, evt):
+        """
+        Wedge-scanner burst from any screen: printable keys < SCAN_MAX_GAP_MS apart then
+        Enter → open the receipt and take the scanned text back out of the focused field.
+        bind_all runs after the widget's own <Return>, so widgets that handle Enter
+        themselves are marked _scan_target and skipped here.
+        """
+        buf = self._scan_buf
+        if evt.keysym not in ("Return", "KP_Enter"):
+            if len(evt.char) == 1 and evt.char.isprintable():
+                if buf and evt.time - buf[-1][1] > SCAN_MAX_GAP_MS:
+                    buf.clear()
+                buf.append((evt.char, evt.time))
+            return
+        self._scan_buf = []
+        if (
+            len(buf) < SCAN_MIN_CHARS
+            or evt.time - buf[-1][1] > SCAN_MAX_GAP_MS
+            or self.active_user is None
+            or getattr(evt.widget, "_scan_target", False)
+        ):
+            return
+        raw = "".join(ch for ch, _t in buf)
+        receipt_no = normalize_scan(raw)
+        rid = self.receipt_nos.get(receipt_no)
+        if rid is None:
+            # سند من جهاز آخر أو مؤرشف بعد تحميل الخريطة
+            try:
+                rid = self.backend.receipt_id_by_no(receipt_no)
+            except Exception as e:
+                logging.error(f"Scan lookup failed: {e}")
+                return
+            if rid is None:
+                return
+            self.receipt_nos.add(receipt_no, rid)
+        w = evt.widget
+        try:
+            if isinstance(w, (tk.Entry, ttk.Entry)):
+                end = w.index("insert")
+                if w.get()[max(0, end - len(raw)) : end] == raw:
+                    w.delete(end - len(raw), end)
+            elif isinstance(w, tk.Text):
+                start = f"insert-{len(raw) + 1}c"
+                if w.get(start, "insert") == raw + "\n":
+                    w.delete(start, "insert")
+        except tk.TclError:
+            pass
+        self.after_idle(lambda: self.open_receipt(rid))
+
+    def _maintenance_tick(self):
+        try:
+            idle = time.monotonic() - self._last_input
+            if (
+                not self._maintenance_running
+                and not self.backend.remote
+                and idle >= MAINTENANCE_IDLE_SECONDS
+                and maintenance_due()
+            ):
+                self._maintenance_running = True
+
+                def worker():
+                    try:
+                        # محدودة الوقت: بدون VACUUM كامل، والإعدادات تُكتب في خيط الواجهة
+                        report = run_db_maintenance(convert=False, record=False)
+                        self.after(0, lambda: mark_maintenance_done(report["at_utc"]))
+                    except Exception:
+                        logging.exception("Idle DB maintenance failed")
+                    finally:
+                        self._maintenance_running = False
+
+                threading.Thread(target=worker, daemon=True).start()
+        finally:
+            self.after(60_000, self._maintenance_tick)
+
+    # ---------- Head-office sync ----------
+    def _sync_tick(self):
+        try:
+            if (
+                SETTINGS.get("sync_url")
+                and not self.backend.remote
+                and not self._sync_running
+            ):
+                self._sync_running = True
+
+                def worker():
+                    try:
+                        sync_push()
+                    except Exception as e:
+                        logging.error(f"Background sync failed: {e}")
+                    finally:
+                        self._sync_running = False
+
+                threading.Thread(target=worker, daemon=True).start()
+        finally:
+            self.after(SYNC_INTERVAL_MS, self._sync_tick)
+
+    def show_wa_outbox(self):
+        try:
+            st = self.backend.wa_stats(WA_HOST)
+        except Exception as e:
+            messagebox.showerror("طابور واتساب", f"تعذر قراءة الطابور:\n{e}")
+            return
+        text = (
+            f"بانتظار الإرسال: {st.get('pending', 0) + st.get('sending', 0) + st.get('attempted', 0)}\n"
+            f"تم الإرسال: {st.get('sent', 0)}\n"
+            f"فشل: {st.get('failed', 0)}"
+        )
+        if st.get("failed") and messagebox.askyesno(
+            "طابور واتساب", text + "\n\nإعادة محاولة الرسائل الفاشلة؟"
+        ):
+            n = self.backend.wa_retry_failed(WA_HOST)
+            start_wa_worker()
+            messagebox.showinfo("طابور واتساب", f"أعيدت {n} رسالة إلى الطابور.")
+        elif not st.get("failed"):
+            messagebox.showinfo("طابور واتساب", text)
+
+    def sync_now(self):
+        if not SETTINGS.get("sync_url"):
+            url = simpledialog.askstring(
+                "المزامنة",
+                "عنوان المكتب الرئيسي (مثال: http://hq.example:8800):",
+                parent=self,
+            )
+            if not url:
+                return
+            SETTINGS["sync_url"] = url.strip()
+            save_settings(SETTINGS)
+        if self._sync_running:
+            messagebox.showinfo("المزامنة", "المزامنة تعمل حاليًا في الخلفية.")
+            return
+        try:
+            rep = sync_push()
+        except Exception as e:
+            logging.error(f"Sync failed: {e}")
+            messagebox.showerror("المزامنة", f"تعذرت المزامنة:\n{e}")
+            return
+        messagebox.showinfo(
+            "المزامنة",
+            f"تم إرسال {rep['entries']} تغيير في {rep['batches']} دفعة "
+            f"({rep['sent_bytes'] // 1024} KB مضغوطة من {rep['raw_bytes'] // 1024} KB) "
+            f"خلال {rep['elapsed_ms']} ms",
+        )
+
+    def run_maintenance_now(self):
+        if self._server_only("الصيانة"):
+            return
+        convert = False
+        if needs_vacuum_conversion() and self.active_user is not None:
+            if self.active_user.get("role") in ("admin", "owner"):
+                convert = messagebox.askyesno(
+                    "الصيانة",
+                    "القاعدة تحتاج تحويلاً لمرة واحدة (VACUUM كامل) يقفلها حتى ينتهي.\n"
+                    "نفّذه الآن؟ (يفضّل والمحل مغلق)",
+                )
+        try:
+            report = run_db_maintenance(vacuum_pages=None, convert=convert)
+        except Exception as e:
+            logging.exception("DB maintenance failed")
+            messagebox.showerror("الصيانة", f"تعذرت صيانة القاعدة:\n{e}")
+            return
+        lines = []
+        for name, r in report.items():
+            if name == "at_utc":
+                continue
+            lines.append(
+                f"{name}: {r['before']['size_bytes'] // 1024} KB → {r['after']['size_bytes'] // 1024} KB, "
+                f"free pages {r['before']['freelist_count']} → {r['after']['freelist_count']} "
+                f"({r['elapsed_ms']} ms)"
+            )
+        messagebox.showinfo("الصيانة", "\n".join(lines) or "لا توجد قاعدة بيانات")
+
+    def on_close(self):
+        if (
+            maintenance_due()
+            and not self._maintenance_running
+            and not self.backend.remote
+        ):
+            try:
+                # عند الإغلاق: optimize + استرجاع مساحة محدود حتى لا يتأخر الخروج
+                run_db_maintenance(vacuum_pages=500, convert=False)
+            except Exception:
+                logging.exception("DB maintenance on close failed")
+        shutdown_pdf_pool()
+        self.destroy()
+
+    def archive_old_receipts(self):
+        if self._server_only("الأرشفة"):
+            return
+        days = simpledialog.askinteger(
+            "الأرشفة",
+            "أرشفة السندات المسلّمة/الملغاة الأقدم من (يوم):",
+            initialvalue=int(SETTINGS.get("archive_after_days", 180)),
+            minvalue=1,
+            parent=self,
+        )
+        if not days:
+            return
+        SETTINGS["archive_after_days"] = int(days)
+        save_settings(SETTINGS)
+        try:
+            moved = archive_closed_receipts(days)
+        except Exception as e:
+            logging.exception("Archive failed")
+            messagebox.showerror("الأرشفة", f"تعذرت الأرشفة:\n{e}")
+            return
+        messagebox.showinfo(
+            "الأرشفة",
+            f"تم نقل {moved.get('receipts', 0)} سند إلى الأرشيف "
+            f"({moved.get('status_history', 0)} حالة، {moved.get('activity_log', 0)} نشاط).",
+        )
+
+    def verify_backups(self):
+        if self._server_only("النسخ الاحتياطية"):
+            return
+        backups = list_backups()
+        if not backups:
+            messagebox.showinfo("النسخ الاحتياطية", "لا توجد نسخ احتياطية بعد.")
+            return
+        lines = []
+        for b in backups:
+            info = verify_backup(b)
+            mark = "✅" if info["ok"] else "❌"
+            lines.append(
+                f"{mark} {b.name} — {info['check_ms']} ms — آخر سند #{info['max_receipt_id'] or '-'}"
+            )
+        messagebox.showinfo("فحص النسخ الاحتياطية", "\n".join(lines))
+
+    def restore_db(self):
+        if self._server_only("الاسترجاع"):
+            return
+        path = filedialog.askopenfilename(
+            parent=self,
+            title="اختر نسخة احتياطية للاسترجاع",
+            initialdir=str(BACKUP_DIR),
+            filetypes=[("SQLite DB", "*.db")],
+        )
+        if not path:
+            return
+        if not messagebox.askyesno(
+            "استرجاع",
+            "سيتم استبدال قاعدة البيانات الحالية بالنسخة المختارة.\n"
+            "سيتم حفظ نسخة من القاعدة الحالية قبل الاسترجاع. متابعة؟",
+        ):
+            return
+        try:
+            res = restore_backup(path)
+        except Exception as e:
+            logging.exception("Restore failed")
+            messagebox.showerror("استرجاع", f"تعذر الاسترجاع:\n{e}")
+            return
+        messagebox.showinfo(
+            "استرجاع",
+            f"تم الاسترجاع خلال {res['restore_ms']} ms (الفحص {res['check_ms']} ms)\n"
+            f"آخر سند: #{res['max_receipt_id'] or '-'}\n"
+            f"نسخة القاعدة السابقة: {res['safety_copy'] or '-'}",
         )
-        row = cur.fetchone()
-        con.close()
-        if not row:
-            raise ValueError(f"لا يوجد سند برقم {receipt_no}")
-        self.open_receipt(int(row[0]))
-
-    def open_receipt(self, rid: int):
-        """
-        نافذة تفاصيل السند — أقسام قابلة للطي + حفظ الأبعاد + تمرير بالعجلة
-        """
-        import datetime, os, tkinter as tk
-        from tkinter import ttk, messagebox
+        # البيانات تغيّرت بالكامل → إعادة تسجيل الدخول
+        self.create_login()
 
+    # ---------- Receipt Detail ----------
+    def open_receipt_by_no(self, receipt_no: str):
+        receipt_no = normalize_scan(receipt_no)
+        rid = self.receipt_nos.get(receipt_no)
+        if rid is None:
+            rid = self.backend.receipt_id_by_no(receipt_no)
+            if not rid:
+                raise ValueError(f"لا يوجد سند برقم {receipt_no}")
+            self.receipt_nos.add(receipt_no, rid)
+        self.open_receipt(int(rid))
+
+    def _new_receipt_window(self, rid: int):
+        """Toplevel for one receipt: saved geometry, registry cleanup on close."""
         win = tk.Toplevel(self)
         win.title(f"تفاصيل السند #{rid}")
         win.configure(bg=SURFACE_BG)
@@ -2242,6 +3404,50 @@ class App(tk.Tk):
 
         win.bind("<Configure>", schedule_save_prefs)
 
+        def on_destroy(evt):
+            if evt.widget is not win:
+                return
+            if save_after_id["id"]:
+                win.after_cancel(save_after_id["id"])
+            if self._receipt_windows.get(rid) is win:
+                del self._receipt_windows[rid]
+
+        win.bind("<Destroy>", on_destroy, add="+")
+        return win
+
+    def open_receipt(self, rid: int):
+        """
+        نافذة تفاصيل السند — أقسام قابلة للطي + حفظ الأبعاد + تمرير بالعجلة.
+        One window per receipt: opening it again refreshes and raises the existing window;
+        at most RECEIPT_WINDOWS_MAX stay open (the least recently opened is closed).
+        """
+        import datetime, os, tkinter as tk
+        from tkinter import ttk, messagebox
+
+        # --- جلب بيانات السند (من الجداول الحالية أو الأرشيف) ---
+        try:
+            detail = self.backend.receipt_detail(rid)
+        except Exception as e:
+            messagebox.showerror("خطأ", f"تعذر تحميل السند:\n{e}")
+            return
+        if not detail:
+            messagebox.showerror("خطأ", "السند غير موجود")
+            return
+
+        win = self._receipt_windows.pop(rid, None)
+        if win is not None and win.winfo_exists():
+            for child in win.winfo_children():
+                child.destroy()
+            win.deiconify()
+            win.lift()
+            win.focus_force()
+        else:
+            while len(self._receipt_windows) >= RECEIPT_WINDOWS_MAX:
+                oldest = next(iter(self._receipt_windows))
+                self._receipt_windows.pop(oldest).destroy()
+            win = self._new_receipt_window(rid)
+        self._receipt_windows[rid] = win
+
         self.header_bar(win, text_left="📋 تفاصيل السند").pack(fill="x")
 
         # --- دالة إنشاء قسم قابل للطي ---
@@ -2280,11 +3486,20 @@ class App(tk.Tk):
 
             # محتوى القسم
             body = ttk.Frame(container, padding=8)
-            build_fn(body)
+            built = {"done": False}
+
+            def ensure_built():
+                # المحتوى يُبنى عند أول فتح فقط (QR، السجل...)
+                if not built["done"]:
+                    built["done"] = True
+                    build_fn(body)
+
             if opened:
+                ensure_built()
                 body.pack(fill="x")
 
             def toggle(_=None):
+                ensure_built()
                 if body.winfo_manager():
                     # إغلاق
                     body.pack_forget()
@@ -2303,29 +3518,6 @@ class App(tk.Tk):
 
             return container
 
-        # --- جلب بيانات السند ---
-        con = db_conn()
-        cur = con.cursor()
-        cur.execute(
-            """
-            SELECT r.receipt_no, c.name, c.phone, d.brand, d.model, d.serial_imei,
-                   r.est_amount, COALESCE(r.approved_amount,r.est_amount),
-                   COALESCE(r.paid_amount,0.0), COALESCE(r.paid_flag,0),
-                   COALESCE(r.payment_method,''), r.device_state,
-                   r.issue_desc, r.work_request, r.created_utc, r.status,
-                   r.otp_code, r.qr_path, r.delivered_utc
-            FROM receipts r
-            JOIN customers c ON r.customer_id=c.id
-            JOIN devices d   ON r.device_id=d.id
-            WHERE r.id=?""",
-            (rid,),
-        )
-        r = cur.fetchone()
-        con.close()
-        if not r:
-            messagebox.showerror("خطأ", "السند غير موجود")
-            return
-
         (
             receipt_no,
             cust_name,
@@ -2346,12 +3538,15 @@ class App(tk.Tk):
             otp,
             qr_path,
             delivered_utc,
-        ) = r
+            whatsapp_link,
+            archived,
+        ) = (detail[k] for k in RECEIPT_DETAIL_FIELDS)
+        log_rows = detail["log"]
 
         created_dt = parse_utc_iso(created_utc)
         created_local = to_riyadh(created_dt)
         warranty_end = created_dt + datetime.timedelta(days=WARRANTY_DAYS)
-        from datetime import datetime, UTC
+        from datetime import datetime
 
         warranty_valid = datetime.now().replace(tzinfo=None) <= warranty_end.replace(
             tzinfo=None
@@ -2366,7 +3561,7 @@ class App(tk.Tk):
             balance = (approved or est) - (paid or 0)
             if balance <= 0.01:
                 status_lbl.config(
-                    text=f"🟢 مدفوع بالكامل — لا يوجد رصيد متبقٍ.",
+                    text="🟢 مدفوع بالكامل — لا يوجد رصيد متبقٍ.",
                     fg="#0b6e0b",
                     bg="#e8f5e9",
                 )
@@ -2383,9 +3578,31 @@ class App(tk.Tk):
         status_lbl.pack(fill="x", pady=(4, 2))
         update_status_label()
 
+        if archived:
+            arc_bar = tk.Frame(root, bg="#fff8e1")
+            arc_bar.pack(fill="x", pady=(0, 4))
+            tk.Label(
+                arc_bar,
+                text="🗄️ هذا السند مؤرشف — استرجعه قبل التعديل عليه",
+                bg="#fff8e1",
+                fg="#6d4c41",
+                font=("Tahoma", 10, "bold"),
+            ).pack(side="left", padx=10, pady=6)
+
+            def restore_from_archive():
+                try:
+                    self.backend.unarchive(rid)
+                except Exception as e:
+                    messagebox.showerror("الأرشيف", f"تعذر استرجاع السند:\n{e}")
+                    return
+                self.open_receipt(rid)
+
+            ttk.Button(
+                arc_bar, text="↩️ استرجاع من الأرشيف", command=restore_from_archive
+            ).pack(side="right", padx=10, pady=4)
+
         # 💰 قسم الدفع
         def build_payment(body):
-            PAY_TOL = 0.01
             approved_var = tk.StringVar(value=f"{approved:.2f}")
             paid_var = tk.StringVar(value=f"{paid:.2f}")
             method_var = tk.StringVar(value=pay_method)
@@ -2424,26 +3641,16 @@ class App(tk.Tk):
             def show_toast(msg):
                 toast_lbl.config(text=f"✅ {msg}")
                 toast_lbl.grid()
-                body.after(2000, toast_lbl.grid_remove)
+                body.after(
+                    2000, lambda: toast_lbl.winfo_exists() and toast_lbl.grid_remove()
+                )
 
             def save_payment():
                 nonlocal approved, paid
                 try:
                     appr = float(approved_var.get() or 0)
                     p = float(paid_var.get() or 0)
-                    is_paid = 1 if (appr - p) <= PAY_TOL else 0
-                    con2 = db_conn()
-                    cur2 = con2.cursor()
-                    cur2.execute(
-                        """
-                        UPDATE receipts SET approved_amount=?, paid_amount=?, paid_flag=?,
-                            paid_utc = CASE WHEN ?=1 THEN datetime('now') ELSE NULL END,
-                            payment_method=? WHERE id=?
-                    """,
-                        (appr, p, is_paid, is_paid, method_var.get(), rid),
-                    )
-                    con2.commit()
-                    con2.close()
+                    self.backend.save_payment(rid, appr, p, method_var.get())
                     approved, paid = appr, p
                     update_status_label()
                     show_toast("تم حفظ بيانات الدفع بنجاح")
@@ -2492,7 +3699,7 @@ class App(tk.Tk):
             def show_toast(msg):
                 toast.config(text=f"✅ {msg}")
                 toast.pack(fill="x", pady=(0, 6))
-                body.after(2000, toast.pack_forget)
+                body.after(2000, lambda: toast.winfo_exists() and toast.pack_forget())
 
             top_row = ttk.Frame(body)
             top_row.pack(fill="x", pady=(0, 8))
@@ -2506,48 +3713,33 @@ class App(tk.Tk):
                     f"{SETTINGS.get('company','ATTA')} — أحضر رقم السند والرمز",
                     device_state,
                 )
-                open_whatsapp_desktop(cust_phone, text)
-                show_toast("تم إرسال رسالة فتح السند")
+                open_whatsapp_desktop(
+                    cust_phone,
+                    text,
+                    receipt_id=rid,
+                    kind="WA_OPEN",
+                    username=self.active_user["username"],
+                )
+                show_toast("تمت إضافة رسالة فتح السند لطابور الإرسال")
 
             def send_ready():
                 text = make_ready_text(
                     receipt_no, f"{brand} {model}", otp, SETTINGS.get("company", "ATTA")
                 )
-                open_whatsapp_desktop(cust_phone, text)
-                show_toast("تم إرسال إشعار الجاهزية")
-
-                # ✅ بعد إرسال الإشعار، حدّث حالة السند إلى "جاهز للاستلام"
+                # ✅ الحالة أولاً ثم الإشعار، حتى لا تكرره حملة "ready" لاحقاً
                 try:
-                    import datetime
-                    from datetime import UTC
-
-                    now_utc = datetime.datetime.now(UTC).isoformat()
-                    prev_status = status
-
-                    con = db_conn()
-                    cur = con.cursor()
-                    cur.execute(
-                        "UPDATE receipts SET status=? WHERE id=?",
-                        ("جاهز للاستلام", rid),
+                    notify_ready(
+                        self.backend,
+                        rid,
+                        cust_phone,
+                        text,
+                        self.active_user["username"],
                     )
-                    cur.execute(
-                        """
-                        INSERT INTO status_history(receipt_id, from_status, to_status, at_utc, by_username)
-                        VALUES (?, ?, ?, ?, ?)
-                        """,
-                        (
-                            rid,
-                            prev_status,
-                            "جاهز للاستلام",
-                            now_utc,
-                            self.active_user["username"],
-                        ),
-                    )
-                    con.commit()
-                    con.close()
-                    show_toast("تم تغيير حالة السند إلى جاهز للاستلام ✅")
                 except Exception as e:
                     messagebox.showerror("خطأ", f"فشل تحديث الحالة:\n{e}")
+                    return
+                start_wa_worker()
+                show_toast("جاهز للاستلام ✅ — أُضيف الإشعار لطابور الإرسال")
 
             ttk.Button(top_row, text="📲 رسالة فتح السند", command=wa_initial).pack(
                 side="left", padx=4
@@ -2559,7 +3751,12 @@ class App(tk.Tk):
             ttk.Button(
                 top_row,
                 text="🖨️ طباعة ملصق مباشر",
-                command=lambda: self.print_label_browser(receipt_no, cust_phone),
+                command=lambda: self.print_labels([(receipt_no, cust_phone)]),
+            ).pack(side="left", padx=4)
+            ttk.Button(
+                top_row,
+                text="👤 ملف العميل",
+                command=lambda: self.show_customer(phone=cust_phone),
             ).pack(side="left", padx=4)
 
             separator = ttk.Separator(body, orient="horizontal")
@@ -2587,18 +3784,13 @@ class App(tk.Tk):
                         messagebox.showerror("خطأ", "رمز OTP غير صحيح")
                         return
 
-                    from datetime import datetime
-
-                    nowu = datetime.now(datetime.UTC).isoformat()
-
-                    conx = db_conn()
-                    curx = conx.cursor()
-                    curx.execute(
-                        "UPDATE receipts SET status='تم التسليم', delivered_utc=? WHERE id=?",
-                        (nowu, rid),
-                    )
-                    conx.commit()
-                    conx.close()
+                    try:
+                        self.backend.set_status(
+                            rid, "تم التسليم", self.active_user["username"]
+                        )
+                    except Exception as e:
+                        messagebox.showerror("خطأ", f"تعذر تسليم الجهاز:\n{e}")
+                        return
                     update_status_label()
                     pop.destroy()
                     show_toast("تم تسليم الجهاز بنجاح")
@@ -2616,7 +3808,13 @@ class App(tk.Tk):
                                 f"الجهاز: {brand} {model}\n"
                                 f"نشكر ثقتك في {SETTINGS.get('company', 'ركن الذاكرة')} 🌹"
                             )
-                            open_whatsapp_desktop(cust_phone, msg)
+                            open_whatsapp_desktop(
+                                cust_phone,
+                                msg,
+                                receipt_id=rid,
+                                kind="WA_DELIVERED",
+                                username=self.active_user["username"],
+                            )
                             show_toast("تم إرسال رسالة تأكيد التسليم")
                         except Exception as e:
                             messagebox.showerror("خطأ", f"تعذر إرسال الرسالة:\n{e}")
@@ -2673,24 +3871,13 @@ class App(tk.Tk):
                 if not new_status or new_status == status:
                     messagebox.showinfo("تنبيه", "لم يتم تغيير الحالة.")
                     return
-                from datetime import datetime, UTC
-
-                now_utc = datetime.now(UTC).isoformat()
-                con = db_conn()
-                cur = con.cursor()
-                cur.execute(
-                    "UPDATE receipts SET status=?, delivered_utc=? WHERE id=?",
-                    (new_status, now_utc if new_status == "تم التسليم" else None, rid),
-                )
-                cur.execute(
-                    """
-                    INSERT INTO status_history(receipt_id,from_status,to_status,at_utc,by_username)
-                    VALUES(?,?,?,?,?)
-                """,
-                    (rid, status, new_status, now_utc, self.active_user["username"]),
-                )
-                con.commit()
-                con.close()
+                try:
+                    self.backend.set_status(
+                        rid, new_status, self.active_user["username"]
+                    )
+                except Exception as e:
+                    messagebox.showerror("خطأ", f"تعذر تحديث الحالة:\n{e}")
+                    return
                 update_status_label()
                 messagebox.showinfo("تم", "تم تحديث حالة السند بنجاح.")
 
@@ -2720,19 +3907,24 @@ class App(tk.Tk):
 
         # 🔳 كود QR
         def build_qr(body):
-            if os.path.exists(qr_path):
-                try:
-                    from PIL import Image, ImageTk
-
-                    img = Image.open(qr_path).resize((200, 200))
-                    ph = ImageTk.PhotoImage(img)
-                    lbl = ttk.Label(body, image=ph)
-                    lbl.image = ph
-                    lbl.pack()
-                except Exception:
-                    ttk.Label(body, text="(تعذر عرض QR)").pack()
-            else:
+            try:
+                if whatsapp_link:
+                    ph = qr_photo(whatsapp_link)
+                elif qr_path and os.path.exists(qr_path) and ImageTk is not None:
+                    # سندات قديمة بدون رابط محفوظ
+                    ph = ImageTk.PhotoImage(Image.open(qr_path).resize((200, 200)))
+                else:
+                    ph = None
+            except Exception as e:
+                logging.error(f"QR render failed: {e}")
+                ttk.Label(body, text="(تعذر عرض QR)").pack()
+                return
+            if ph is None:
                 ttk.Label(body, text="(لا يوجد QR)").pack()
+                return
+            lbl = ttk.Label(body, image=ph)
+            lbl.image = ph
+            lbl.pack()
 
         make_section(root, "🔳 كود QR", build_qr, opened=False)
 
@@ -2745,21 +3937,11 @@ class App(tk.Tk):
                 tree.heading(col, text=col)
                 tree.column(col, width=220 if col == "الوصف" else 140, anchor="w")
             tree.pack(fill="x", expand=True)
-            con = db_conn()
-            cur = con.cursor()
-            cur.execute(
-                """
-                SELECT kind, info, at_utc, by_username FROM activity_log
-                WHERE receipt_id=? ORDER BY id DESC
-            """,
-                (rid,),
-            )
-            for kind, info, at_utc, by in cur.fetchall():
+            for kind, info, at_utc, by in log_rows:
                 dt_local = fmt_dt(to_riyadh(parse_utc_iso(at_utc)))
                 tree.insert(
                     "", "end", values=(dt_local, kind, f"{info or ''} (by {by})")
                 )
-            con.close()
 
         make_section(root, "🧾 سجل النشاط", build_log, opened=False)
 
@@ -2902,121 +4084,41 @@ class App(tk.Tk):
                 messagebox.showinfo("PDF", "لا توجد قيود مدفوعة في هذا اليوم.")
                 return
 
-            # ✅ تسجيل خط عربي من النظام (يدعم التوصيل الكامل)
-            font_name = register_ar_font()
-            if not font_name:
-                font_name = "Helvetica"  # احتياطي لو فشل التحميل
-
-            # ===== بناء الجدول =====
-            headers = [
-                ar_text("رقم السند"),
-                ar_text("المبلغ"),
-                ar_text("طريقة الدفع"),
-                ar_text("وقت الدفع (الرياض)"),
-                ar_text("العميل"),
-                ar_text("الجهاز"),
-            ]
-            data = [headers]
-
-            total = 0.0
-            for no, amt, ts_local, method, cname, phone, devtxt in rows:
-                total += amt or 0.0
-                data.append(
-                    [
-                        ar_text(no),
-                        ar_text(f"{(amt or 0):.2f}"),
-                        ar_text(method or "-"),
-                        ar_text(ts_local),
-                        ar_text(f"{cname} ({phone})"),
-                        ar_text(devtxt),
-                    ]
-                )
-            data.append(
-                [
-                    ar_text("الإجمالي"),
-                    ar_text(f"{total:.2f} {SETTINGS.get('currency','SAR')}"),
-                    "",
-                    "",
-                    "",
-                    "",
-                ]
-            )
-
-            # ===== مسار الملف =====
             pdf_name = f"daily_paid_{self.active_branch['code']}_{d_obj.strftime('%Y%m%d')}.pdf"
             pdf_path = str(EXPORTS_DIR / pdf_name)
+            meta = {
+                "company": SETTINGS.get("company", "ركن الذاكرة للاتصالات"),
+                "day": d_obj.strftime("%Y-%m-%d"),
+                "currency": SETTINGS.get("currency", "SAR"),
+            }
 
-            # ===== إعداد التصميم =====
-            from reportlab.lib.styles import ParagraphStyle
-            from reportlab.platypus import (
-                Spacer,
-                Paragraph,
-                Table,
-                TableStyle,
-                SimpleDocTemplate,
-            )
-
-            doc = SimpleDocTemplate(
-                pdf_path,
-                pagesize=A4,
-                rightMargin=30,
-                leftMargin=30,
-                topMargin=30,
-                bottomMargin=18,
-            )
-
-            # ✅ تنسيق العناوين بالعربي
-            title_style = ParagraphStyle(
-                name="Title",
-                alignment=1,  # وسط
-                fontName=font_name,
-                fontSize=15,
-                leading=22,
-                spaceAfter=10,
-                textColor=colors.HexColor("#222222"),
-            )
-
-            # ===== الجدول =====
-            tbl = Table(data, repeatRows=1)
-            tbl.setStyle(
-                TableStyle(
-                    [
-                        ("FONT", (0, 0), (-1, -1), font_name, 10),
-                        ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
-                        ("TEXTCOLOR", (0, 0), (-1, 0), colors.black),
-                        ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-                        ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
-                        ("BACKGROUND", (0, -1), (-1, -1), colors.HexColor("#e8f5e9")),
-                        ("TEXTCOLOR", (0, -1), (-1, -1), colors.HexColor("#2e7d32")),
-                        ("FONTSIZE", (0, 0), (-1, -1), 10),
-                        ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
-                        ("TOPPADDING", (0, 0), (-1, -1), 6),
-                    ]
+            # البناء في عملية منفصلة؛ الواجهة تبقى تستجيب ونفتح الملف عند الانتهاء
+            try:
+                future = get_pdf_pool().submit(
+                    render_daily_paid_pdf, pdf_path, rows, meta
                 )
-            )
-
-            # ===== المحتوى =====
-            elements = [
-                Paragraph(
-                    ar_text(
-                        f"📱 {SETTINGS.get('company','ركن الذاكرة للاتصالات')} — التقرير اليومي"
-                    ),
-                    title_style,
-                ),
-                Spacer(1, 10),
-                Paragraph(
-                    ar_text(f"تاريخ التقرير: {d_obj.strftime('%Y-%m-%d')}"), title_style
-                ),
-                Spacer(1, 12),
-                tbl,
-            ]
+            except Exception as e:
+                logging.error(f"PDF worker start failed: {e}")
+                messagebox.showerror("PDF", f"تعذر إنشاء PDF:\n{e}")
+                return
+            pdf_btn.configure(state="disabled", text="⏳ جارٍ إنشاء PDF…")
+            self.after(150, lambda: on_pdf_done(future))
 
+        def on_pdf_done(future):
+            if not future.done():
+                self.after(150, lambda: on_pdf_done(future))
+                return
+            try:
+                if pdf_btn.winfo_exists():
+                    pdf_btn.configure(state="normal", text="🖨️ تصدير PDF")
+            except tk.TclError:
+                pass
             try:
-                doc.build(elements)
+                pdf_path = future.result()
             except Exception as e:
+                logging.error(f"PDF build failed: {e}")
                 messagebox.showerror("PDF", f"تعذر إنشاء PDF:\n{e}")
                 return
-
             messagebox.showinfo("PDF", f"تم إنشاء الملف:\n{pdf_path}")
             try:
                 self._open_path(pdf_path)
@@ -3048,9 +4150,8 @@ class App(tk.Tk):
         ttk.Button(
             top, text="عرض", style="Primary.TButton", command=refresh_table
         ).pack(side="left", padx=4)
-        ttk.Button(top, text="🖨️ تصدير PDF", command=export_pdf).pack(
-            side="left", padx=4
-        )
+        pdf_btn = ttk.Button(top, text="🖨️ تصدير PDF", command=export_pdf)
+        pdf_btn.pack(side="left", padx=4)
 
         # ===== Table =====
         table_wrap = ttk.Frame(win, padding=10)
@@ -3090,6 +4191,377 @@ class App(tk.Tk):
 
         refresh_table()
 
+    def show_customer(self, customer_id=None, phone=""):
+        """ملف العميل: كل السندات والأجهزة والمدفوع والمتبقي؛ تفاصيل السند تُحمّل عند اختياره فقط."""
+        try:
+            data = self.backend.customer_history(customer_id, phone)
+        except Exception as e:
+            messagebox.showerror("ملف العميل", f"تعذر تحميل ملف العميل:\n{e}")
+            return
+        if not data:
+            messagebox.showinfo("ملف العميل", "العميل غير موجود.")
+            return
+        cust, totals = data["customer"], data["totals"]
+        ccy = SETTINGS.get("currency", "SAR")
+
+        win = tk.Toplevel(self)
+        win.title(f"ملف العميل — {cust['name']}")
+        win.configure(bg=SURFACE_BG)
+        win.geometry("980x640")
+        self.header_bar(
+            win, text_left=f"👤 {cust['name']}", text_right=cust["phone"]
+        ).pack(fill="x")
+
+        cards = ttk.Frame(win, padding=10)
+        cards.pack(fill="x")
+        for title, value in (
+            ("السندات", totals["receipts"]),
+            ("الأجهزة", totals["devices"]),
+            ("المفتوحة", totals["open"]),
+            ("إجمالي المدفوع", f"{totals['paid']:.2f} {ccy}"),
+            ("المتبقي", f"{totals['due']:.2f} {ccy}"),
+        ):
+            card = self.card(cards)
+            card.pack(side="right", padx=6, fill="x", expand=True)
+            ttk.Label(card, text=title, style="Card.TLabel").pack(anchor="e")
+            ttk.Label(
+                card,
+                text=str(value),
+                style="Card.TLabel",
+                font=("Tahoma", 13, "bold"),
+            ).pack(anchor="e")
+
+        wrap = ttk.Frame(win, padding=(10, 0))
+        wrap.pack(fill="both", expand=True)
+        cols = ("no", "created", "dev", "status", "amount", "paid", "due")
+        tree = ttk.Treeview(wrap, columns=cols, show="headings", height=12)
+        for col, title, width in (
+            ("no", "رقم السند", 110),
+            ("created", "التاريخ", 140),
+            ("dev", "الجهاز", 240),
+            ("status", "الحالة", 120),
+            ("amount", "المبلغ", 90),
+            ("paid", "المدفوع", 90),
+            ("due", "المتبقي", 90),
+        ):
+            tree.heading(col, text=title)
+            tree.column(col, width=width, anchor="w")
+        add_treeview_scrollbars(wrap, tree)
+        apply_treeview_tag_styles(tree)
+        for r in data["receipts"]:
+            created = fmt_dt(to_riyadh(parse_utc_iso(r["created_utc"])))
+            dev = f"{r['brand']} {r['model']}" + (
+                f" — {r['serial']}" if r["serial"] else ""
+            )
+            tree.insert(
+                "",
+                "end",
+                iid=str(r["id"]),
+                values=(
+                    r["receipt_no"] + (" 🗄️" if r["archived"] else ""),
+                    created,
+                    dev,
+                    r["status"],
+                    f"{r['amount']:.2f}",
+                    f"{r['paid']:.2f}",
+                    f"{r['due']:.2f}",
+                ),
+                tags=(r["status"],),
+            )
+
+        preview_var = tk.StringVar(value="اختر سنداً لعرض تفاصيله — نقرتان لفتحه")
+        ttk.Label(
+            win,
+            textvariable=preview_var,
+            padding=10,
+            justify="right",
+            wraplength=940,
+        ).pack(fill="x")
+
+        def on_select(_=None):
+            sel = tree.focus()
+            if not sel:
+                return
+            try:
+                d = self.backend.receipt_detail(int(sel))
+            except Exception as e:
+                preview_var.set(f"تعذر تحميل التفاصيل: {e}")
+                return
+            if not d:
+                return
+            last_log = "، ".join(f"{kind}: {info}" for kind, info, *_ in d["log"][:3])
+            preview_var.set(
+                f"العطل: {d['issue']}\nالمطلوب: {d['work']}\n"
+                f"آخر النشاط: {last_log or '-'}"
+            )
+
+        tree.bind("<<TreeviewSelect>>", on_select)
+        tree.bind(
+            "<Double-1>",
+            lambda _e: tree.focus() and self.open_receipt(int(tree.focus())),
+        )
+
+    def show_campaigns(self):
+        """إشعار كل الأجهزة الجاهزة، أو تذكير من لم يستلم بعد N يوم — بالترتيب عبر طابور واتساب."""
+        win = tk.Toplevel(self)
+        win.title("حملات واتساب")
+        win.configure(bg=SURFACE_BG)
+        win.geometry("820x560")
+        self.header_bar(win, text_left="📣 حملات واتساب").pack(fill="x")
+
+        top = ttk.Frame(win, padding=10)
+        top.pack(fill="x")
+        kind_var = tk.StringVar(value="ready")
+        days_var = tk.IntVar(value=7)
+        ttk.Radiobutton(
+            top,
+            text="إشعار الجاهزية (لم يُرسل لهم بعد)",
+            variable=kind_var,
+            value="ready",
+        ).pack(side="right", padx=6)
+        ttk.Radiobutton(
+            top, text="تذكير بالاستلام بعد", variable=kind_var, value="reminder"
+        ).pack(side="right", padx=6)
+        ttk.Spinbox(top, from_=1, to=365, textvariable=days_var, width=5).pack(
+            side="right"
+        )
+        ttk.Label(top, text="يوم").pack(side="right", padx=4)
+        ttk.Button(top, text="معاينة", command=lambda: preview()).pack(
+            side="left", padx=4
+        )
+        send_btn = ttk.Button(
+            top, text="📤 إرسال", style="Primary.TButton", command=lambda: send()
+        )
+        send_btn.pack(side="left", padx=4)
+
+        wrap = ttk.Frame(win, padding=(10, 0))
+        wrap.pack(fill="both", expand=True)
+        tree = ttk.Treeview(
+            wrap, columns=("no", "cust", "dev", "since"), show="headings", height=14
+        )
+        for col, title in (
+            ("no", "رقم السند"),
+            ("cust", "العميل"),
+            ("dev", "الجهاز"),
+            ("since", "جاهز منذ"),
+        ):
+            tree.heading(col, text=title)
+        add_treeview_scrollbars(wrap, tree)
+
+        bottom = ttk.Frame(win, padding=10)
+        bottom.pack(fill="x")
+        progress = ttk.Progressbar(bottom, mode="determinate")
+        progress.pack(fill="x")
+        info_var = tk.StringVar(value="")
+        ttk.Label(bottom, textvariable=info_var).pack(anchor="w", pady=(4, 0))
+        state = {"recipients": [], "campaign": None}
+
+        def preview():
+            kind = kind_var.get()
+            days = int(days_var.get() or 0) if kind == "reminder" else 0
+            try:
+                cands = self.backend.campaign_candidates(self.active_branch["id"], days)
+                state["recipients"] = self.backend.campaign_recipients(
+                    kind, cands, days
+                )
+            except Exception as e:
+                messagebox.showerror(
+                    "الحملات", f"تعذر تحميل المستلمين:\n{e}", parent=win
+                )
+                return
+            tree.delete(*tree.get_children())
+            for c in state["recipients"]:
+                since = fmt_dt(to_riyadh(parse_utc_iso(c["since_utc"])))
+                tree.insert(
+                    "",
+                    "end",
+                    values=(
+                        c["receipt_no"],
+                        f"{c['name']} ({c['phone']})",
+                        f"{c['brand']} {c['model']}",
+                        since,
+                    ),
+                )
+            info_var.set(f"عدد المستلمين: {len(state['recipients'])}")
+
+        def send():
+            recipients = state["recipients"]
+            if not recipients:
+                messagebox.showinfo(
+                    "الحملات", "لا يوجد مستلمون — اضغط معاينة أولاً.", parent=win
+                )
+                return
+            if not messagebox.askyesno(
+                "الحملات", f"إرسال {len(recipients)} رسالة بالترتيب؟", parent=win
+            ):
+                return
+            try:
+                campaign, rows = build_campaign_rows(
+                    kind_var.get(), recipients, self.active_user["username"]
+                )
+                self.backend.wa_enqueue_many(rows)
+                state["campaign"] = campaign
+                start_wa_worker()
+            except Exception as e:
+                messagebox.showerror("الحملات", f"تعذر إنشاء الحملة:\n{e}", parent=win)
+                return
+            state["recipients"] = []
+            send_btn.configure(state="disabled")
+            poll()
+
+        def poll():
+            if not win.winfo_exists() or not state["campaign"]:
+                return
+            try:
+                p = self.backend.campaign_progress(state["campaign"])
+            except Exception as e:
+                logging.error(f"campaign progress failed: {e}")
+                return
+            done = p["sent"] + p["failed"]
+            progress.configure(maximum=max(1, p["total"]), value=done)
+            interval = float(SETTINGS.get("wa_send_interval_s", 4.0))
+            info_var.set(
+                f"تم: {p['sent']} — فشل: {p['failed']} — متبقٍ: {p['pending']} "
+                f"(≈ {int(p['pending'] * (interval + 2))} ث)"
+            )
+            if p["pending"]:
+                win.after(1000, poll)
+            else:
+                send_btn.configure(state="normal")
+
+        preview()
+
+    def show_range_report(self):
+        """
+        تقرير الإيراد لفترة (أسبوع/شهر/مخصص): مجاميع لكل يوم ولكل طريقة دفع ولكل فرع.
+        """
+        today_local = to_riyadh(datetime.datetime.now(datetime.UTC)).date()
+        try:
+            branches = self.backend.branches()
+        except Exception:
+            branches = [self.active_branch]
+        branch_names = {b["id"]: b["name"] for b in branches}
+        ALL = "كل الفروع"
+
+        win = tk.Toplevel(self)
+        win.title("تقرير الإيراد للفترة")
+        win.configure(bg=SURFACE_BG)
+        win.geometry("900x600")
+        self.header_bar(win, text_left="📈 تقرير الإيراد للفترة").pack(fill="x")
+
+        top = ttk.Frame(win, padding=10)
+        top.pack(fill="x")
+        from_var = tk.StringVar()
+        to_var = tk.StringVar()
+        branch_var = tk.StringVar(value=self.active_branch["name"])
+        ttk.Label(top, text="من:").pack(side="right", padx=4)
+        ttk.Entry(top, textvariable=from_var, width=12).pack(side="right")
+        ttk.Label(top, text="إلى:").pack(side="right", padx=4)
+        ttk.Entry(top, textvariable=to_var, width=12).pack(side="right")
+        ttk.Combobox(
+            top,
+            textvariable=branch_var,
+            values=[ALL] + [b["name"] for b in branches],
+            state="readonly",
+            width=18,
+        ).pack(side="right", padx=6)
+
+        def set_range(start, end):
+            from_var.set(start.isoformat())
+            to_var.set(end.isoformat())
+            refresh()
+
+        def this_week():
+            # الأسبوع يبدأ السبت
+            start = today_local - datetime.timedelta(
+                days=(today_local.weekday() + 2) % 7
+            )
+            set_range(start, today_local)
+
+        def this_month():
+            set_range(today_local.replace(day=1), today_local)
+
+        def last_month():
+            end = today_local.replace(day=1) - datetime.timedelta(days=1)
+            set_range(end.replace(day=1), end)
+
+        ttk.Button(top, text="هذا الأسبوع", command=this_week).pack(side="left", padx=3)
+        ttk.Button(top, text="هذا الشهر", command=this_month).pack(side="left", padx=3)
+        ttk.Button(top, text="الشهر السابق", command=last_month).pack(
+            side="left", padx=3
+        )
+        ttk.Button(
+            top, text="عرض", style="Primary.TButton", command=lambda: refresh()
+        ).pack(side="left", padx=6)
+
+        nb = ttk.Notebook(win)
+        nb.pack(fill="both", expand=True, padx=10, pady=6)
+        trees = {}
+        for key, title, first in (
+            ("day", "حسب اليوم", "اليوم"),
+            ("method", "حسب طريقة الدفع", "طريقة الدفع"),
+            ("branch", "حسب الفرع", "الفرع"),
+        ):
+            frame = ttk.Frame(nb)
+            nb.add(frame, text=title)
+            tree = ttk.Treeview(frame, columns=("k", "count", "total"), show="headings")
+            tree.heading("k", text=first)
+            tree.heading("count", text="عدد السندات")
+            tree.heading("total", text="الإجمالي")
+            tree.column("k", width=220, anchor="w")
+            add_treeview_scrollbars(frame, tree)
+            trees[key] = tree
+
+        total_var = tk.StringVar(value="—")
+        ttk.Label(
+            win, textvariable=total_var, font=("Tahoma", 10, "bold"), padding=10
+        ).pack(anchor="w")
+
+        def refresh():
+            try:
+                start = datetime.date.fromisoformat(from_var.get().strip())
+                end = datetime.date.fromisoformat(to_var.get().strip())
+            except ValueError:
+                messagebox.showerror(
+                    "تاريخ غير صالح", "أدخل التاريخ بصيغة YYYY-MM-DD", parent=win
+                )
+                return
+            if end < start:
+                start, end = end, start
+            bname = branch_var.get()
+            bid = next((b["id"] for b in branches if b["name"] == bname), None)
+            try:
+                rows = self.backend.revenue_report(start, end, bid)
+            except Exception as e:
+                messagebox.showerror("التقرير", f"تعذر تحميل التقرير:\n{e}", parent=win)
+                return
+
+            groups = {"day": {}, "method": {}, "branch": {}}
+            grand_n, grand_total = 0, 0.0
+            for day, row_bid, method, n, total in rows:
+                for key, k in (
+                    ("day", day),
+                    ("method", method or "-"),
+                    ("branch", branch_names.get(row_bid, str(row_bid))),
+                ):
+                    agg = groups[key].setdefault(k, [0, 0.0])
+                    agg[0] += n
+                    agg[1] += total
+                grand_n += n
+                grand_total += total
+
+            ccy = SETTINGS.get("currency", "SAR")
+            for key, tree in trees.items():
+                tree.delete(*tree.get_children())
+                for k, (n, total) in sorted(groups[key].items()):
+                    tree.insert("", "end", values=(k, n, f"{total:.2f} {ccy}"))
+            total_var.set(
+                f"{start.isoformat()} → {end.isoformat()} — الإجمالي: {grand_total:.2f} {ccy} "
+                f"— عدد السندات: {grand_n}"
+            )
+
+        this_week()
+
     # ---------- Utils ----------
     def clear(self):
         for w in self.winfo_children():
@@ -3098,6 +4570,62 @@ class App(tk.Tk):
 
 # ---------------------- main --------------------------
 def main():
+    parser = argparse.ArgumentParser(prog="RepairDesk")
+    parser.add_argument(
+        "--verify-backups", action="store_true", help="check every backup and exit"
+    )
+    parser.add_argument("--restore", metavar="BACKUP", help="restore a backup and exit")
+    parser.add_argument(
+        "--archive",
+        metavar="DAYS",
+        type=int,
+        nargs="?",
+        const=-1,
+        help="archive closed receipts older than DAYS (default: settings) and exit",
+    )
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="push pending changes to head office and exit",
+    )
+    parser.add_argument(
+        "--maintenance",
+        action="store_true",
+        help="run ANALYZE/optimize/incremental vacuum and exit",
+    )
+    args = parser.parse_args()
+
+    if args.verify_backups:
+        for b in list_backups():
+            info = verify_backup(b)
+            print(
+                f"{'OK ' if info['ok'] else 'BAD'} {b.name} quick_check={info['quick_check']} "
+                f"check_ms={info['check_ms']} max_receipt_id={info['max_receipt_id']}"
+            )
+        return
+    if args.restore:
+        res = restore_backup(args.restore)
+        print(
+            f"restored {res['file']} in {res['restore_ms']} ms "
+            f"(quick_check {res['check_ms']} ms), safety copy: {res['safety_copy']}"
+        )
+        return
+    if args.sync:
+        db_init()
+        print(json.dumps(sync_push()))
+        return
+    if args.maintenance:
+        db_init()
+        report = run_db_maintenance(vacuum_pages=None, convert=True)
+        for name, r in report.items():
+            print(f"{name}: {json.dumps(r)}")
+        return
+    if args.archive is not None:
+        db_init()
+        moved = archive_closed_receipts(None if args.archive < 0 else args.archive)
+        print(f"archived: {moved}")
+        return
+
     try:
         db_init()
     except Exception as e:
@@ -3109,4 +4637,7 @@ def main():
 
 
 if __name__ == "__main__":
+    import multiprocessing
+
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,2919 @@
+# طبقة البيانات: قاعدة SQLite والسندات وطابور واتساب والـ backends — بلا واجهة Tk
+# يستوردها main.py (الواجهة) و local_server.py (خادم المحل) دون تشغيل إعداد الواجهة
+import sqlite3, random, string, datetime, json, logging, re, platform, urllib.parse as ul, threading, time, zlib, bisect
+from pathlib import Path
+
+try:
+    import bcrypt
+except Exception:
+    bcrypt = None
+
+DATA_DIR = Path.home() / "Documents" / "RepairDeskDesktop"
+DB_PATH = DATA_DIR / "repairdesk.db"
+ARCHIVE_DB_PATH = DATA_DIR / "archive.db"
+DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+STATUS_ORDER = [
+    "جديد",
+    "قيد الفحص",
+    "بانتظار الموافقة",
+    "قيد الإصلاح",
+    "جاهز للاستلام",
+    "تم التسليم",
+    "ملغي",
+]
+
+# Warranty
+WARRANTY_DAYS = 30
+RIYADH_UTC_OFFSET_HOURS = 3
+
+
+# Warranty helpers
+def to_riyadh(dt_utc: datetime.datetime) -> datetime.datetime:
+    return dt_utc + datetime.timedelta(hours=RIYADH_UTC_OFFSET_HOURS)
+
+
+def fmt_dt(dt: datetime.datetime) -> str:
+    return dt.strftime("%Y-%m-%d %H:%M")
+
+
+def parse_utc_iso(iso_str: str) -> datetime.datetime:
+    try:
+        s = (iso_str or "").replace("Z", "+00:00")
+        return datetime.datetime.fromisoformat(s)
+    except Exception:
+        return datetime.datetime.now(datetime.UTC)
+
+
+SETTINGS_PATH = DATA_DIR / "config.json"
+DEFAULT_SETTINGS = {
+    "company": "ATTA Repair",
+    "currency": "SAR",
+    "use_shop_number_for_qr": False,
+    "shop_number": "9665XXXXXXXX",
+    "label_printer": "",
+    "label_format": "browser",  # browser | zpl | escpos
+    "label_raw_target": "",  # فارغ = طابعة الملصقات؛ أو tcp://IP:9100 أو file:PATH
+    "label_qr": False,  # QR برقم السند على الملصق الحراري
+    "company_latin": "",  # اسم المحل بحروف لاتينية إن تعذر رسم العربي على الملصق
+    "whatsapp_auto_send": True,  # Auto send enabled by default
+    "whatsapp_auto_delay_ms": 1200,  # ↑ زودنا الافتراضي لضمان لصق النص
+    "wa_fill_via_clipboard": True,
+    "wa_press_enter": True,
+    "wa_send_interval_s": 4.0,  # فاصل بين رسائل طابور واتساب
+    "archive_after_days": 180,  # أرشفة السندات المغلقة الأقدم من هذا العمر
+    "last_maintenance_utc": "",
+    "api_url": "",  # فارغ = فتح ملف القاعدة مباشرة؛ أو عنوان local_server.py على الشبكة
+    "api_token": "",
+    "sync_url": "",  # عنوان sync_server.py في المكتب الرئيسي
+    "sync_token": "",
+    "shop_id": "",
+    "win_prefs": {},
+}
+
+
+# ------------------------- Settings -------------------------
+def load_settings():
+    if SETTINGS_PATH.exists():
+        try:
+            d = json.loads(SETTINGS_PATH.read_text(encoding="utf-8"))
+            d.setdefault("win_prefs", {})
+            d.setdefault("label_printer", "")
+            d.setdefault("whatsapp_auto_send", True)
+            d.setdefault("whatsapp_auto_delay_ms", 1200)
+            d.setdefault("wa_fill_via_clipboard", True)
+            d.setdefault("wa_press_enter", True)
+            d.setdefault("archive_after_days", 180)
+            return d
+        except Exception as e:
+            logging.error(f"Failed to read settings: {e}")
+    return DEFAULT_SETTINGS.copy()
+
+
+def save_settings(s):
+    try:
+        SETTINGS_PATH.write_text(
+            json.dumps(s, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+    except Exception as e:
+        logging.error(f"Failed to save settings: {e}")
+
+
+SETTINGS = load_settings()
+
+
+# ------------------------- DB -------------------------
+DB_BUSY_TIMEOUT_MS = 5000
+
+
+def db_conn(archive: bool = False):
+    """
+    Open the shop DB. With archive=True the archive DB is attached as `arc` and
+    temp views all_receipts / all_status_history / all_activity_log span both tiers.
+    """
+    con = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    try:
+        con.execute("PRAGMA foreign_keys = ON")
+    except Exception:
+        pass
+    if archive:
+        _attach_archive(con)
+    return con
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS branches(
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  name TEXT NOT NULL,
+  code TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users(
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  branch_id INTEGER NOT NULL,
+  username TEXT NOT NULL,
+  password TEXT NOT NULL,
+  role TEXT NOT NULL DEFAULT 'admin'
+);
+CREATE TABLE IF NOT EXISTS customers(
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  name TEXT NOT NULL,
+  phone TEXT NOT NULL,
+  notes TEXT
+);
+CREATE TABLE IF NOT EXISTS devices(
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  customer_id INTEGER NOT NULL,
+  type TEXT NOT NULL,
+  brand TEXT NOT NULL,
+  model TEXT NOT NULL,
+  serial_imei TEXT,
+  color TEXT,
+  accessories TEXT
+);
+CREATE TABLE IF NOT EXISTS receipts(
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  branch_id INTEGER NOT NULL,
+  customer_id INTEGER NOT NULL,
+  device_id INTEGER NOT NULL,
+  receipt_no TEXT NOT NULL,
+  issue_desc TEXT NOT NULL,
+  work_request TEXT NOT NULL,
+  est_amount REAL NOT NULL DEFAULT 0,
+  approved_amount REAL,
+  device_state TEXT,
+  status TEXT NOT NULL DEFAULT 'جديد',
+  otp_code TEXT NOT NULL,
+  whatsapp_link TEXT,
+  qr_path TEXT,
+  signature_path TEXT,
+  created_utc TEXT NOT NULL,
+  delivered_utc TEXT
+);
+CREATE TABLE IF NOT EXISTS status_history(
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  receipt_id INTEGER NOT NULL,
+  from_status TEXT,
+  to_status TEXT NOT NULL,
+  at_utc TEXT NOT NULL,
+  by_username TEXT
+);
+CREATE TABLE IF NOT EXISTS activity_log(
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  receipt_id INTEGER NOT NULL,
+  kind TEXT NOT NULL,
+  info TEXT,
+  at_utc TEXT NOT NULL,
+  by_username TEXT
+);
+CREATE TABLE IF NOT EXISTS change_journal(
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  tbl TEXT NOT NULL,
+  row_id INTEGER NOT NULL,
+  op TEXT NOT NULL,
+  at_utc TEXT NOT NULL,
+  payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state(
+  k TEXT PRIMARY KEY,
+  v TEXT
+);
+-- مفاتيح بحث لكل كلمة (لاحقة الكلمات) لاسم العميل و"الماركة الموديل": c = عميل، d = جهاز
+CREATE TABLE IF NOT EXISTS search_keys(
+  kind TEXT NOT NULL,
+  key TEXT NOT NULL,
+  ref_id INTEGER NOT NULL,
+  PRIMARY KEY(kind, key, ref_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS wa_outbox(
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  receipt_id INTEGER NOT NULL DEFAULT 0,
+  phone TEXT NOT NULL,
+  body TEXT NOT NULL,
+  kind TEXT NOT NULL DEFAULT 'WA',
+  host TEXT NOT NULL,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_try_utc TEXT NOT NULL,
+  created_utc TEXT NOT NULL,
+  sent_utc TEXT,
+  last_error TEXT,
+  by_username TEXT,
+  campaign TEXT
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_receipts_status ON receipts(status);
+CREATE INDEX IF NOT EXISTS idx_receipts_no ON receipts(receipt_no);
+CREATE INDEX IF NOT EXISTS idx_status_history_receipt ON status_history(receipt_id);
+CREATE INDEX IF NOT EXISTS idx_activity_log_receipt ON activity_log(receipt_id);
+CREATE INDEX IF NOT EXISTS idx_receipts_branch_status_day
+  ON receipts(branch_id, status, created_utc, paid_flag, paid_utc, paid_amount);
+CREATE INDEX IF NOT EXISTS idx_receipts_paid_utc
+  ON receipts(paid_utc, branch_id, payment_method, paid_amount) WHERE paid_flag=1;
+CREATE INDEX IF NOT EXISTS idx_customers_phone ON customers(phone);
+CREATE INDEX IF NOT EXISTS idx_customers_name_norm ON customers(name_norm);
+CREATE INDEX IF NOT EXISTS idx_search_keys_ref ON search_keys(kind, ref_id);
+CREATE INDEX IF NOT EXISTS idx_customers_phone_rev ON customers(phone_rev);
+CREATE INDEX IF NOT EXISTS idx_receipts_customer ON receipts(customer_id, status);
+CREATE INDEX IF NOT EXISTS idx_receipts_device ON receipts(device_id);
+CREATE INDEX IF NOT EXISTS idx_devices_model_norm ON devices(model_norm);
+CREATE INDEX IF NOT EXISTS idx_devices_serial
+  ON devices(upper(trim(serial_imei))) WHERE serial_imei IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_wa_outbox_due ON wa_outbox(host, status, next_try_utc);
+CREATE INDEX IF NOT EXISTS idx_wa_outbox_receipt ON wa_outbox(receipt_id, kind, created_utc);
+CREATE INDEX IF NOT EXISTS idx_wa_outbox_campaign ON wa_outbox(campaign, status);
+CREATE INDEX IF NOT EXISTS idx_receipts_branch_status_since
+  ON receipts(branch_id, status, status_utc);
+-- لوحة الأوامر تتابع change_journal بدل status_utc
+DROP INDEX IF EXISTS idx_receipts_status_utc;
+"""
+
+
+def db_migrate():
+    """Ensure new payment columns exist on receipts table."""
+    con = db_conn()
+    cur = con.cursor()
+    cur.execute("PRAGMA table_info(receipts)")
+    cols = {row[1] for row in cur.fetchall()}
+    # approved_amount already in schema, but ensure it exists (older DBs)
+    if "approved_amount" not in cols:
+        try:
+            cur.execute("ALTER TABLE receipts ADD COLUMN approved_amount REAL")
+        except Exception:
+            pass
+    # paid fields
+    if "paid_flag" not in cols:
+        try:
+            cur.execute(
+                "ALTER TABLE receipts ADD COLUMN paid_flag INTEGER NOT NULL DEFAULT 0"
+            )
+        except Exception:
+            pass
+    if "paid_amount" not in cols:
+        try:
+            cur.execute(
+                "ALTER TABLE receipts ADD COLUMN paid_amount REAL NOT NULL DEFAULT 0"
+            )
+        except Exception:
+            pass
+    if "paid_utc" not in cols:
+        try:
+            cur.execute("ALTER TABLE receipts ADD COLUMN paid_utc TEXT")
+        except Exception:
+            pass
+    if "payment_method" not in cols:
+        try:
+            cur.execute("ALTER TABLE receipts ADD COLUMN payment_method TEXT")
+        except Exception:
+            pass
+    if "device_state" not in cols:
+        try:
+            cur.execute("ALTER TABLE receipts ADD COLUMN device_state TEXT")
+        except Exception:
+            pass
+    # وقت دخول الحالة الحالية (لحملات التذكير بالاستلام)
+    if "status_utc" not in cols:
+        cur.execute("ALTER TABLE receipts ADD COLUMN status_utc TEXT")
+        cur.execute("""
+            UPDATE receipts SET status_utc = COALESCE(
+                (SELECT MAX(h.at_utc) FROM status_history h
+                 WHERE h.receipt_id=receipts.id AND h.to_status=receipts.status),
+                created_utc)
+        """)
+    cur.execute("PRAGMA table_info(wa_outbox)")
+    if "campaign" not in {row[1] for row in cur.fetchall()}:
+        cur.execute("ALTER TABLE wa_outbox ADD COLUMN campaign TEXT")
+    # مفاتيح البحث المطبّعة (normalize_ar) تُحسب مرة عند الكتابة
+    con.create_function("normalize_ar", 1, normalize_ar, deterministic=True)
+    con.create_function("phone_rev", 1, phone_rev, deterministic=True)
+    for table, col, expr in (
+        ("customers", "name_norm", "normalize_ar(name)"),
+        ("customers", "phone_rev", "phone_rev(phone)"),
+        ("devices", "model_norm", "normalize_ar(brand || ' ' || model)"),
+    ):
+        cur.execute(f"PRAGMA table_info({table})")
+        if col not in {row[1] for row in cur.fetchall()}:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {col} TEXT")
+            # عمود مشتق: لا داعي لإرسال كل الصفوف للمكتب الرئيسي (المشغلات يعاد إنشاؤها أدناه)
+            cur.execute(f"DROP TRIGGER IF EXISTS trg_journal_{table}_u")
+            cur.execute(f"UPDATE {table} SET {col} = {expr}")
+    # paid_utc كان يُحفظ بصيغة datetime('now') ("YYYY-MM-DD HH:MM:SS")؛ نوحّده بصيغة ISO مثل created_utc
+    # حتى تصلح المقارنة النصية المباشرة واستخدام الفهرس
+    cur.execute("""
+        UPDATE receipts SET paid_utc = REPLACE(paid_utc,' ','T') || '+00:00'
+        WHERE paid_utc GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]'
+    """)
+    cur.executescript(INDEXES)
+    # أول تشغيل بعد إضافة search_keys: مفاتيح الكلمات للعملاء والأجهزة الموجودة
+    cur.execute("INSERT OR IGNORE INTO sync_state(k,v) VALUES('search_keys','1')")
+    if cur.rowcount:
+        for cid, name_norm in cur.execute(
+            "SELECT id, name_norm FROM customers"
+        ).fetchall():
+            _store_search_keys(cur, "c", cid, name_norm)
+        for did, model_norm in cur.execute(
+            "SELECT id, model_norm FROM devices"
+        ).fetchall():
+            _store_search_keys(cur, "d", did, model_norm)
+    _install_journal_triggers(cur)
+    # عدّاد تغييرات الدفع (مشترك بين كل الأجهزة والعمليات) يتحقق به كاش تقرير الإيراد
+    cur.execute("INSERT OR IGNORE INTO sync_state(k,v) VALUES('paid_rev','0')")
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_paid_rev
+        AFTER UPDATE OF paid_flag, paid_amount, paid_utc, payment_method ON receipts
+        BEGIN
+          UPDATE sync_state SET v = CAST(v AS INTEGER) + 1 WHERE k='paid_rev';
+        END
+    """)
+    con.commit()
+    con.close()
+
+
+def db_init():
+    con = db_conn()
+    cur = con.cursor()
+    # يسري فقط على قاعدة جديدة قبل إنشاء أول جدول (القواعد القديمة تُحوَّل في الصيانة)
+    cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cur.executescript(SCHEMA)
+    con.commit()
+    # Run migrations to add new columns if missing
+    db_migrate()
+    cur.execute("SELECT COUNT(*) FROM branches")
+    n = cur.fetchone()[0]
+    if n == 0:
+        cur.execute(
+            "INSERT INTO branches(name,code) VALUES(?,?)", ("فرع البوليفارد", "A")
+        )
+        cur.execute("INSERT INTO branches(name,code) VALUES(?,?)", ("فرع السوق", "B"))
+        con.commit()
+        cur.execute("SELECT id FROM branches WHERE code='A'")
+        b1 = cur.fetchone()[0]
+        cur.execute("SELECT id FROM branches WHERE code='B'")
+        b2 = cur.fetchone()[0]
+
+        def seed_user(bid, username, pwd):
+            if bcrypt:
+                ph = bcrypt.hashpw(pwd.encode(), bcrypt.gensalt()).decode()
+            else:
+                ph = pwd
+            cur.execute(
+                "INSERT INTO users(branch_id,username,password,role) VALUES(?,?,?,?)",
+                (bid, username, ph, "admin"),
+            )
+
+        seed_user(b1, "A1", "123")
+        seed_user(b2, "A2", "123")
+    con.commit()
+    con.close()
+
+
+# ---------------------- Archive -----------------------
+# السندات المغلقة القديمة تنتقل مع سجلاتها إلى archive.db (مرفقة باسم arc)
+ARCHIVE_TABLES = ("receipts", "status_history", "activity_log")
+CLOSED_STATUSES = ("تم التسليم", "ملغي")
+ARCHIVE_INDEXES = """
+CREATE INDEX IF NOT EXISTS arc.idx_arc_receipts_no ON receipts(receipt_no);
+CREATE INDEX IF NOT EXISTS arc.idx_arc_receipts_customer ON receipts(customer_id);
+CREATE INDEX IF NOT EXISTS arc.idx_arc_receipts_device ON receipts(device_id);
+CREATE INDEX IF NOT EXISTS arc.idx_arc_status_history_receipt ON status_history(receipt_id);
+CREATE INDEX IF NOT EXISTS arc.idx_arc_activity_log_receipt ON activity_log(receipt_id);
+CREATE INDEX IF NOT EXISTS arc.idx_arc_receipts_paid_utc
+  ON receipts(paid_utc, branch_id, payment_method, paid_amount) WHERE paid_flag=1;
+"""
+
+
+def _table_columns(con, schema: str, table: str) -> list:
+    return [r[1] for r in con.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _attach_archive(con):
+    """Attach archive.db as `arc`, keep its tables in step with main, and create the all_* views."""
+    con.execute("ATTACH DATABASE ? AS arc", (str(ARCHIVE_DB_PATH),))
+    if not con.execute("SELECT 1 FROM arc.sqlite_master LIMIT 1").fetchone():
+        con.execute("PRAGMA arc.auto_vacuum = INCREMENTAL")
+    for t in ARCHIVE_TABLES:
+        ddl_row = con.execute(
+            "SELECT sql FROM main.sqlite_master WHERE type='table' AND name=?", (t,)
+        ).fetchone()
+        arc_cols = _table_columns(con, "arc", t)
+        if not arc_cols:
+            ddl = re.sub(
+                rf"^CREATE TABLE\s+(IF NOT EXISTS\s+)?\"?{t}\"?",
+                f"CREATE TABLE arc.{t}",
+                ddl_row[0],
+                count=1,
+            )
+            con.execute(ddl)
+        else:
+            # أعمدة أضيفت لاحقًا في migrations
+            info = con.execute(f"PRAGMA main.table_info({t})").fetchall()
+            for _cid, name, typ, *_ in info:
+                if name not in arc_cols:
+                    con.execute(f"ALTER TABLE arc.{t} ADD COLUMN {name} {typ}")
+        cols = ",".join(_table_columns(con, "main", t))
+        con.execute(
+            f"CREATE TEMP VIEW IF NOT EXISTS all_{t} AS "
+            f"SELECT {cols}, 0 AS archived FROM main.{t} "
+            f"UNION ALL SELECT {cols}, 1 AS archived FROM arc.{t}"
+        )
+    con.executescript(ARCHIVE_INDEXES)
+
+
+def _move_receipts(con, src: str, dst: str, where: str, params=()) -> dict:
+    """Move receipts matching `where` (on src.receipts) plus their history/log rows from src to dst."""
+    cur = con.cursor()
+    cur.execute("CREATE TEMP TABLE IF NOT EXISTS _move_ids(id INTEGER PRIMARY KEY)")
+    cur.execute("DELETE FROM temp._move_ids")
+    cur.execute(
+        f"INSERT INTO temp._move_ids SELECT id FROM {src}.receipts WHERE {where}",
+        params,
+    )
+    moved = {}
+    for t in ARCHIVE_TABLES:
+        key = "id" if t == "receipts" else "receipt_id"
+        cols = ",".join(_table_columns(con, src, t))
+        cur.execute(
+            f"INSERT INTO {dst}.{t}({cols}) SELECT {cols} FROM {src}.{t} "
+            f"WHERE {key} IN (SELECT id FROM temp._move_ids)"
+        )
+        cur.execute(
+            f"DELETE FROM {src}.{t} WHERE {key} IN (SELECT id FROM temp._move_ids)"
+        )
+        moved[t] = cur.rowcount
+    return moved
+
+
+def archive_closed_receipts(older_than_days: int | None = None) -> dict:
+    """
+    انقل السندات المسلّمة/الملغاة الأقدم من older_than_days (الافتراضي من الإعدادات)
+    مع status_history و activity_log إلى قاعدة الأرشيف. Returns moved row counts per table.
+    """
+    if older_than_days is None:
+        older_than_days = int(SETTINGS.get("archive_after_days", 180))
+    cutoff = (
+        datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=older_than_days)
+    ).isoformat()
+    con = db_conn(archive=True)
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        moved = _move_receipts(
+            con,
+            "main",
+            "arc",
+            "status IN (?,?) AND COALESCE(delivered_utc, created_utc) < ?",
+            (*CLOSED_STATUSES, cutoff),
+        )
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        con.close()
+    logging.info(f"Archived receipts older than {older_than_days} days: {moved}")
+    _revenue_day_cache.clear()
+    RECEIPT_DETAIL_CACHE.invalidate()
+    return moved
+
+
+def unarchive_receipt(rid: int) -> bool:
+    """Bring one archived receipt (and its history) back to the hot tables."""
+    if not ARCHIVE_DB_PATH.exists():
+        return False
+    con = db_conn(archive=True)
+    try:
+        con.execute("BEGIN IMMEDIATE")
+        moved = _move_receipts(con, "arc", "main", "id=?", (rid,))
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        con.close()
+    RECEIPT_DETAIL_CACHE.invalidate(rid)
+    return moved.get("receipts", 0) > 0
+
+
+# ---------------------- Change journal / head-office sync -----------------------
+# Triggers تسجل كل إضافة/تعديل في change_journal؛ sync_push يرسل الجديد فقط للمكتب الرئيسي.
+# الحذف لا يُسجَّل: التطبيق لا يحذف إلا عند الأرشفة، والمكتب الرئيسي يحتفظ بكل السجل.
+JOURNAL_TABLES = ("customers", "devices", "receipts", "status_history", "activity_log")
+SYNC_BATCH_SIZE = 500
+SYNC_INTERVAL_MS = 15 * 60 * 1000
+# بلا مزامنة: القيود تبقى أياماً فقط (تكفي عدّاد التغييرات واللوحات) ثم تُحذف في الصيانة
+JOURNAL_KEEP_DAYS = 7
+
+
+def _install_journal_triggers(cur):
+    """
+    (Re)create the journal triggers so their payload follows the current columns.
+    They run even without sync: the journal seq is the DB-wide change counter.
+    """
+    for t in JOURNAL_TABLES:
+        cols = [r[1] for r in cur.execute(f"PRAGMA main.table_info({t})").fetchall()]
+        payload = "json_object(" + ",".join(f"'{c}',NEW.{c}" for c in cols) + ")"
+        for op, event in (("I", "INSERT"), ("U", "UPDATE")):
+            name = f"trg_journal_{t}_{op.lower()}"
+            cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cur.execute(f"""
+                CREATE TRIGGER {name} AFTER {event} ON {t}
+                BEGIN
+                  INSERT INTO change_journal(tbl,row_id,op,at_utc,payload)
+                  VALUES('{t}', NEW.id, '{op}', strftime('%Y-%m-%dT%H:%M:%fZ','now'), {payload});
+                END
+            """)
+
+
+def _journal_backfill(cur):
+    """أول مزامنة: لقطة كاملة للصفوف الموجودة حتى يبدأ المكتب الرئيسي من نسخة كاملة."""
+    cur.execute("SELECT v FROM sync_state WHERE k='journal_backfilled'")
+    if not cur.fetchone():
+        for t in JOURNAL_TABLES:
+            cols = [
+                r[1] for r in cur.execute(f"PRAGMA main.table_info({t})").fetchall()
+            ]
+            payload = "json_object(" + ",".join(f"'{c}',{c}" for c in cols) + ")"
+            cur.execute(f"""
+                INSERT INTO change_journal(tbl,row_id,op,at_utc,payload)
+                SELECT '{t}', id, 'I', strftime('%Y-%m-%dT%H:%M:%fZ','now'), {payload}
+                FROM {t} ORDER BY id
+            """)
+        cur.execute(
+            "INSERT INTO sync_state(k,v) VALUES('journal_backfilled', ?)",
+            (datetime.datetime.now(datetime.UTC).isoformat(),),
+        )
+
+
+def get_shop_id() -> str:
+    """
+    Stable id for this shop's DB; head office keys every row by (shop_id, table, id).
+    Stored in the DB (sync_state) so every terminal and any restore of it agree.
+    """
+
+    def tx(cur):
+        row = cur.execute("SELECT v FROM sync_state WHERE k='shop_id'").fetchone()
+        if row:
+            return row[0]
+        # أجهزة قديمة حفظته في الإعدادات: نكمل به حتى لا يرى المكتب الرئيسي محلاً جديداً
+        shop_id = SETTINGS.get("shop_id") or f"shop-{random_otp(4)}-{int(time.time())}"
+        cur.execute("INSERT INTO sync_state(k,v) VALUES('shop_id', ?)", (shop_id,))
+        return shop_id
+
+    return run_write_tx(tx)
+
+
+def prune_change_journal(keep_days: int = JOURNAL_KEEP_DAYS) -> int:
+    """Without sync_url nobody consumes the journal: drop entries older than keep_days."""
+    if (SETTINGS.get("sync_url") or "").strip():
+        return 0
+    cutoff = (
+        datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=keep_days)
+    ).strftime("%Y-%m-%dT%H:%M:%fZ")
+    n = run_write_tx(
+        lambda cur: cur.execute(
+            "DELETE FROM change_journal WHERE at_utc < ?", (cutoff,)
+        ).rowcount
+    )
+    # المزامنة إن فُعّلت لاحقاً تبدأ بلقطة كاملة
+    run_write_tx(
+        lambda cur: cur.execute("DELETE FROM sync_state WHERE k='journal_backfilled'")
+    )
+    return n
+
+
+def sync_pending_count() -> int:
+    con = db_conn()
+    try:
+        return con.execute("SELECT COUNT(*) FROM change_journal").fetchone()[0]
+    finally:
+        con.close()
+
+
+def _http_sync_sender(url: str, token: str = "", timeout: float = 30.0):
+    import urllib.request
+
+    def send(body: bytes, shop_id: str) -> dict:
+        req = urllib.request.Request(
+            f"{url.rstrip('/')}/sync/push",
+            data=body,
+            method="POST",
+            headers={
+                "Content-Type": "application/json",
+                "Content-Encoding": "deflate",
+                "X-Shop-Id": shop_id,
+                "X-Sync-Token": token,
+            },
+        )
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+    return send
+
+
+def sync_push(send=None, batch_size: int = SYNC_BATCH_SIZE, max_batches=None) -> dict:
+    """
+    ادفع قيود change_journal الجديدة على دفعات مضغوطة (zlib) وامسح ما أكّد المكتب الرئيسي استلامه.
+    send(body_bytes, shop_id) -> {"ack": last_id}; defaults to HTTP POST to SETTINGS["sync_url"].
+    """
+    if send is None:
+        url = (SETTINGS.get("sync_url") or "").strip()
+        if not url:
+            raise ValueError("لم يتم ضبط عنوان المكتب الرئيسي (sync_url)")
+        send = _http_sync_sender(url, SETTINGS.get("sync_token", ""))
+    shop_id = get_shop_id()
+    run_write_tx(_journal_backfill)
+    t0 = time.perf_counter()
+    batches = entries = raw_bytes = sent_bytes = 0
+    while max_batches is None or batches < max_batches:
+        con = db_conn()
+        try:
+            rows = con.execute(
+                "SELECT id,tbl,row_id,op,at_utc,payload FROM change_journal ORDER BY id LIMIT ?",
+                (batch_size,),
+            ).fetchall()
+        finally:
+            con.close()
+        if not rows:
+            break
+        doc = {
+            "shop_id": shop_id,
+            "entries": [
+                {
+                    "id": r[0],
+                    "tbl": r[1],
+                    "row_id": r[2],
+                    "op": r[3],
+                    "at_utc": r[4],
+                    "row": json.loads(r[5]),
+                }
+                for r in rows
+            ],
+        }
+        raw = json.dumps(doc, ensure_ascii=False).encode("utf-8")
+        body = zlib.compress(raw, 6)
+        res = send(body, shop_id)
+        ack = int(res.get("ack") or 0)
+        if ack < rows[0][0]:
+            raise RuntimeError(f"head office did not acknowledge batch: {res}")
+        run_write_tx(
+            lambda cur: (
+                cur.execute("DELETE FROM change_journal WHERE id <= ?", (ack,)),
+                cur.execute(
+                    "INSERT OR REPLACE INTO sync_state(k,v) VALUES('last_ack', ?)",
+                    (str(ack),),
+                ),
+            )
+        )
+        batches += 1
+        entries += sum(1 for r in rows if r[0] <= ack)
+        raw_bytes += len(raw)
+        sent_bytes += len(body)
+    report = {
+        "batches": batches,
+        "entries": entries,
+        "raw_bytes": raw_bytes,
+        "sent_bytes": sent_bytes,
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+    if batches:
+        logging.info(f"Sync push: {report}")
+    return report
+
+
+# ---------------------- Maintenance -----------------------
+MAINTENANCE_INTERVAL_HOURS = 24
+MAINTENANCE_IDLE_SECONDS = 300
+
+
+def _db_size_stats(con) -> dict:
+    page_size = con.execute("PRAGMA page_size").fetchone()[0]
+    page_count = con.execute("PRAGMA page_count").fetchone()[0]
+    freelist = con.execute("PRAGMA freelist_count").fetchone()[0]
+    return {
+        "size_bytes": page_size * page_count,
+        "page_count": page_count,
+        "freelist_count": freelist,
+        "freelist_bytes": page_size * freelist,
+    }
+
+
+def maintenance_due() -> bool:
+    last = SETTINGS.get("last_maintenance_utc") or ""
+    if not last:
+        return True
+    age = datetime.datetime.now(datetime.UTC) - parse_utc_iso(last)
+    return age >= datetime.timedelta(hours=MAINTENANCE_INTERVAL_HOURS)
+
+
+def needs_vacuum_conversion() -> bool:
+    """True when a DB file is still on auto_vacuum=NONE (conversion = full VACUUM)."""
+    for path in (DB_PATH, ARCHIVE_DB_PATH):
+        if path.exists():
+            con = sqlite3.connect(path)
+            try:
+                if con.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                    return True
+            finally:
+                con.close()
+    return False
+
+
+def mark_maintenance_done(at_utc: str):
+    SETTINGS["last_maintenance_utc"] = at_utc
+    save_settings(SETTINGS)
+
+
+def run_db_maintenance(
+    vacuum_pages: int | None = 2000, convert: bool = False, record: bool = True
+) -> dict:
+    """
+    صيانة دورية: ANALYZE (أول مرة) + PRAGMA optimize + incremental_vacuum.
+    vacuum_pages bounds the pages reclaimed per run (None = all). With convert=True a DB
+    still on auto_vacuum=NONE gets a one-off VACUUM to switch it to INCREMENTAL — a full
+    rewrite under an exclusive lock, so only on explicit request. record=False leaves
+    SETTINGS untouched (caller records report["at_utc"] itself, e.g. on the UI thread).
+    Returns before/after size and freelist per database file.
+    """
+    report = {}
+    if DB_PATH.exists():
+        pruned = prune_change_journal()
+        if pruned:
+            logging.info(f"Pruned {pruned} change_journal entries (sync disabled)")
+    for name, path in (("main", DB_PATH), ("archive", ARCHIVE_DB_PATH)):
+        if not path.exists():
+            continue
+        t0 = time.perf_counter()
+        con = sqlite3.connect(path)
+        try:
+            before = _db_size_stats(con)
+            actions = []
+            mode = con.execute("PRAGMA auto_vacuum").fetchone()[0]
+            if mode != 2 and convert:
+                con.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                con.execute("VACUUM")
+                actions.append("VACUUM (auto_vacuum→INCREMENTAL)")
+            has_stats = con.execute(
+                "SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'"
+            ).fetchone()
+            if not has_stats:
+                con.execute("ANALYZE")
+                actions.append("ANALYZE")
+            con.execute("PRAGMA optimize")
+            actions.append("optimize")
+            if con.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                if vacuum_pages is None:
+                    con.execute("PRAGMA incremental_vacuum").fetchall()
+                else:
+                    con.execute(
+                        f"PRAGMA incremental_vacuum({int(vacuum_pages)})"
+                    ).fetchall()
+                actions.append("incremental_vacuum")
+            con.commit()
+            after = _db_size_stats(con)
+        finally:
+            con.close()
+        elapsed = round((time.perf_counter() - t0) * 1000, 1)
+        report[name] = {
+            "actions": actions,
+            "before": before,
+            "after": after,
+            "elapsed_ms": elapsed,
+        }
+        logging.info(
+            f"DB maintenance [{name}] {', '.join(actions)}: "
+            f"{before['size_bytes']}→{after['size_bytes']} bytes, "
+            f"freelist {before['freelist_count']}→{after['freelist_count']} pages, {elapsed} ms"
+        )
+    at_utc = datetime.datetime.now(datetime.UTC).isoformat()
+    if record:
+        mark_maintenance_done(at_utc)
+    report["at_utc"] = at_utc
+    return report
+
+
+# ---------------------- Helpers -----------------------
+def random_otp(k=6):
+    return "".join(random.choice(string.digits) for _ in range(k))
+
+
+def generate_receipt_no(branch_code: str, cur=None) -> str:
+    """
+    Next receipt number for the branch. Pass the cursor of an open write
+    transaction (see run_write_tx) so two terminals can never draw the same number.
+    """
+    con = None
+    if cur is None:
+        con = db_conn()
+        cur = con.cursor()
+    cur.execute(
+        "SELECT receipt_no FROM receipts WHERE receipt_no LIKE ? ORDER BY id DESC LIMIT 1",
+        (f"{branch_code}%",),
+    )
+    row = cur.fetchone()
+    if con is not None:
+        con.close()
+    # كل سندات الفرع مؤرشفة؟ نكمل الترقيم من الأرشيف حتى لا تتكرر الأرقام
+    if not row and ARCHIVE_DB_PATH.exists():
+        arc = sqlite3.connect(ARCHIVE_DB_PATH)
+        try:
+            row = arc.execute(
+                "SELECT receipt_no FROM receipts WHERE receipt_no LIKE ? ORDER BY id DESC LIMIT 1",
+                (f"{branch_code}%",),
+            ).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        finally:
+            arc.close()
+    seq = 1
+    if row and row[0]:
+        m = re.search(r"(\d+)$", row[0])
+        if m:
+            try:
+                seq = int(m.group(1)) + 1
+            except Exception:
+                seq = 1
+    return f"{branch_code}{seq:04d}"
+
+
+# مفتاح بحث عربي: توحيد الألف والتاء المربوطة والياء وحذف التشكيل والتطويل
+_AR_NORM_TABLE = str.maketrans(
+    {
+        "أ": "ا",
+        "إ": "ا",
+        "آ": "ا",
+        "ٱ": "ا",
+        "ة": "ه",
+        "ى": "ي",
+        "ؤ": "و",
+        "ئ": "ي",
+        "ـ": None,  # tatweel
+        **{chr(c): None for c in range(0x064B, 0x0653)},  # harakat
+        "\u0670": None,  # superscript alef
+        **{chr(0x0660 + i): str(i) for i in range(10)},  # ٠-٩
+        **{chr(0x06F0 + i): str(i) for i in range(10)},  # ۰-۹
+    }
+)
+
+
+def normalize_ar(s) -> str:
+    """Search key: Arabic letter variants folded, diacritics/tatweel dropped, casefolded."""
+    return " ".join(str(s or "").translate(_AR_NORM_TABLE).casefold().split())
+
+
+def normalize_phone(num: str) -> str:
+    digits = "".join(ch for ch in num if ch.isdigit())
+    if digits.startswith("00"):
+        digits = digits[2:]
+    return digits
+
+
+def phone_rev(num: str) -> str:
+    """Reversed digits: "آخر 4 أرقام" تصبح بادئة ← بحث نطاق على الفهرس."""
+    return normalize_phone(num or "")[::-1]
+
+
+def make_whatsapp_initial_text(
+    receipt_no: str,
+    device: str,
+    issue: str,
+    otp: str,
+    tracking_hint: str,
+    device_state: str | None = None,
+) -> str:
+    """
+    توليد رسالة واتساب احترافية لفتح السند مع تنسيق وأيقونات.
+    """
+    state_line = f"\n💡 حالة الجهاز: *{device_state}*" if device_state else ""
+    return (
+        f"📱✨ *مرحبًا بك في متجر {SETTINGS.get('company', 'Memory Corner')}* ✨\n\n"
+        f"📄 *تم فتح سند صيانة جديد*\n"
+        f"🔢 رقم السند: *{receipt_no}*\n"
+        f"📱 الجهاز: *{device}*\n"
+        f"⚙️ العطل: *{issue}*"
+        f"{state_line}\n"
+        f"🔑 رمز الاستلام (OTP): *{otp}*\n\n"
+        f"📍 {tracking_hint}\n"
+        f"نشكر ثقتك بنا ❤️"
+    )
+
+
+def make_ready_text(receipt_no: str, device: str, otp: str, company: str) -> str:
+    return (
+        f"السلام عليكم\n"
+        f"تم الانتهاء من صيانة جهازك ({device}).\n"
+        f"رقم السند: {receipt_no}\n"
+        f"رمز الاستلام (OTP): {otp}\n"
+        f"يمكنك الاستلام خلال أوقات العمل. — {company}"
+    )
+
+
+def make_pickup_reminder_text(
+    receipt_no: str, device: str, otp: str, company: str, days: int
+) -> str:
+    return f"⏰ تذكير: جهازك بانتظارك منذ {days} يوم.\n" + make_ready_text(
+        receipt_no, device, otp, company
+    )
+
+
+def make_delivered_text(receipt_no: str, device: str, company: str) -> str:
+    return (
+        f"السلام عليكم\n"
+        f"تم تسليم جهازك ({device}) بنجاح.\n"
+        f"رقم السند: {receipt_no}\n"
+        f"شاكرين زيارتكم — {company}"
+    )
+
+
+def hash_password_if_possible(pw: str) -> str:
+    if bcrypt is None:
+        return pw
+    return bcrypt.hashpw(pw.encode(), bcrypt.gensalt()).decode()
+
+
+def password_matches(stored: str, supplied: str) -> bool:
+    try:
+        if stored and stored.startswith("$2"):
+            if bcrypt is None:
+                return False
+            return bcrypt.checkpw(supplied.encode(), stored.encode())
+        return stored == supplied
+    except Exception as e:
+        logging.error(f"Password check error: {e}")
+        return False
+
+
+# ---------------------- Customer lookup (prefix index) ----------------------
+def _name_key(name: str) -> str:
+    return normalize_ar(name)
+
+
+def _word_keys(text: str) -> list:
+    """النص المطبّع وكل لاحقة كلمات منه: "علي محمد" → ["علي محمد", "محمد"]."""
+    words = _name_key(text).split(" ")
+    return [" ".join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+def _store_search_keys(cur, kind: str, ref_id: int, text: str):
+    """Replace the search_keys rows of one customer ("c") or device ("d")."""
+    cur.execute("DELETE FROM search_keys WHERE kind=? AND ref_id=?", (kind, ref_id))
+    cur.executemany(
+        "INSERT OR IGNORE INTO search_keys(kind, key, ref_id) VALUES(?,?,?)",
+        [(kind, k, ref_id) for k in _word_keys(text)],
+    )
+
+
+class PrefixIndex:
+    """Sorted keys + bisect: prefix lookup in O(log n + k); insert keeps the order."""
+
+    def __init__(self, pairs=()):
+        items = sorted(pairs)
+        self._keys = [k for k, _v in items]
+        self._vals = [v for _k, v in items]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key: str, value):
+        if not key:
+            return
+        with self._lock:
+            i = bisect.bisect_left(self._keys, key)
+            j = i
+            while j < len(self._keys) and self._keys[j] == key:
+                if self._vals[j] == value:
+                    return
+                j += 1
+            self._keys.insert(i, key)
+            self._vals.insert(i, value)
+
+    def prefix(self, prefix: str, limit: int = 10) -> list:
+        out = []
+        with self._lock:
+            i = bisect.bisect_left(self._keys, prefix)
+            while (
+                i < len(self._keys)
+                and self._keys[i].startswith(prefix)
+                and len(out) < limit
+            ):
+                if self._vals[i] not in out:
+                    out.append(self._vals[i])
+                i += 1
+        return out
+
+
+class CustomerDirectory:
+    """
+    فهرس العملاء في الذاكرة للإكمال التلقائي: الجوال (أرقام فقط) والاسم وكل كلمة من الاسم.
+    Built once in the background after login and kept current with upsert().
+    """
+
+    def __init__(self, rows=()):
+        self.by_id = {}
+        phones, names = [], []
+        for cid, name, phone in rows:
+            self.by_id[cid] = (name, phone)
+            phones.append((normalize_phone(phone), cid))
+            names.extend((k, cid) for k in self._name_keys(name))
+        self.phones = PrefixIndex(phones)
+        self.names = PrefixIndex(names)
+
+    @staticmethod
+    def _name_keys(name: str) -> list:
+        return _word_keys(name)
+
+    def upsert(self, cid: int, name: str, phone: str):
+        if self.by_id.get(cid) == (name, phone):
+            return
+        self.by_id[cid] = (name, phone)
+        self.phones.add(normalize_phone(phone), cid)
+        for k in self._name_keys(name):
+            self.names.add(k, cid)
+
+    def search(self, text: str, limit: int = 8) -> list:
+        """[(customer_id, name, phone)] whose phone or name starts with text."""
+        text = (text or "").strip()
+        digits = normalize_phone(text)
+        if digits and len(digits) >= len(text.replace(" ", "")) - 1:
+            if digits.startswith("05"):
+                digits = "966" + digits[1:]
+            ids = self.phones.prefix(digits, limit * 2)
+            match = lambda name, phone: normalize_phone(phone).startswith(digits)
+        else:
+            key = _name_key(text)
+            ids = self.names.prefix(key, limit * 2)
+            # مفاتيح قديمة بعد تعديل الاسم تُستبعد هنا
+            match = lambda name, phone: any(
+                k.startswith(key) for k in self._name_keys(name)
+            )
+        out = []
+        for cid in ids:
+            name, phone = self.by_id[cid]
+            if match(name, phone):
+                out.append((cid, name, phone))
+                if len(out) >= limit:
+                    break
+        return out
+
+
+class DeviceSuggestions:
+    """
+    اقتراحات النوع/الماركة/الموديل/الملحقات مرتبة بعدد مرات الاستخدام.
+    Spelling variants share one casefolded key; the most used spelling is shown.
+    """
+
+    FIELDS = ("type", "brand", "model", "accessories")
+
+    def __init__(self, rows=()):
+        # field -> key -> {spelling: count}; models are keyed per brand
+        self.counts = {f: {} for f in self.FIELDS}
+        self.models = {}
+        for dev_type, brand, model, accessories, n in rows:
+            self.add(dev_type, brand, model, accessories, n)
+
+    @staticmethod
+    def _bump(table, value, n):
+        value = " ".join(str(value or "").split())
+        if value:
+            spellings = table.setdefault(_name_key(value), {})
+            spellings[value] = spellings.get(value, 0) + n
+
+    def add(self, dev_type, brand, model, accessories, n=1):
+        self._bump(self.counts["type"], dev_type, n)
+        self._bump(self.counts["brand"], brand, n)
+        self._bump(self.counts["model"], model, n)
+        self._bump(self.models.setdefault(_name_key(brand), {}), model, n)
+        self._bump(self.counts["accessories"], accessories, n)
+
+    def suggest(self, field: str, text: str, brand: str = "", limit: int = 8) -> list:
+        """Most used values of field starting with text (model: within brand if known)."""
+        table = self.counts[field]
+        if field == "model" and _name_key(brand) in self.models:
+            table = self.models[_name_key(brand)]
+        key = _name_key(text)
+        ranked = []
+        for k, spellings in table.items():
+            if k.startswith(key) and k != key:
+                best = max(spellings, key=spellings.get)
+                ranked.append((sum(spellings.values()), best))
+        ranked.sort(key=lambda r: (-r[0], r[1]))
+        return [v for _n, v in ranked[:limit]]
+
+
+def device_suggestion_rows() -> list:
+    con = db_conn()
+    try:
+        return con.execute("""
+            SELECT type, brand, model, COALESCE(accessories,''), COUNT(*)
+            FROM devices GROUP BY type, brand, model, accessories
+        """).fetchall()
+    finally:
+        con.close()
+
+
+def list_customers() -> list:
+    con = db_conn()
+    try:
+        return con.execute("SELECT id, name, phone FROM customers").fetchall()
+    finally:
+        con.close()
+
+
+# ---------------------- Barcode scan -----------------------
+# ماسح "لوحة مفاتيح" (wedge) يكتب الرمز كاملاً خلال أجزاء من الثانية ثم Enter
+SCAN_MAX_GAP_MS = 40
+SCAN_MIN_CHARS = 5
+# تخطيط لوحة المفاتيح العربي يحوّل حروف الرمز: نعيدها لمقابلها اللاتيني
+_SCAN_AR_LAYOUT = str.maketrans(
+    "ضصثقفغعهخحشسيبلاتنمئءؤرىة٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹",
+    "QWERTYUIOPASDFGHJKLZXCVNM" + "0123456789" * 2,
+)
+_SCAN_NO_RE = re.compile(r"[A-Z]{1,6}\d{4,}")
+
+
+def normalize_scan(raw: str) -> str:
+    """
+    Scanner input → receipt_no: drops AIM prefix/suffix/control chars, fixes case and
+    Arabic keyboard layout, and picks the receipt number out of a URL/QR payload.
+    """
+    s = "".join(ch for ch in (raw or "") if ch.isprintable()).strip()
+    s = re.sub(r"^\][A-Za-z]\d", "", s)
+    s = s.replace("لا", "B").translate(_SCAN_AR_LAYOUT).upper()
+    s = re.sub(r"\s+", "", s)
+    if _SCAN_NO_RE.fullmatch(s):
+        return s
+    found = _SCAN_NO_RE.findall(s)
+    return found[-1] if found else s
+
+
+class ReceiptNoMap:
+    """receipt_no → id في الذاكرة (تحميل بالخلفية + إضافة عند الحفظ/البحث)؛ آمن بين الخيوط."""
+
+    def __init__(self, rows=()):
+        self._ids = {no: rid for no, rid in rows if no}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get(self, receipt_no: str) -> int | None:
+        return self._ids.get(receipt_no)
+
+    def add(self, receipt_no: str, rid: int):
+        if receipt_no:
+            with self._lock:
+                self._ids[receipt_no] = int(rid)
+
+
+def list_receipt_numbers() -> list:
+    """(receipt_no, id) لكل السندات، الحالية ثم المؤرشفة."""
+    with_archive = ARCHIVE_DB_PATH.exists()
+    con = db_conn(archive=with_archive)
+    try:
+        return con.execute(
+            f"SELECT receipt_no, id FROM {'all_receipts' if with_archive else 'receipts'}"
+        ).fetchall()
+    finally:
+        con.close()
+
+
+# ---------------------- Quick open (command palette) -----------------------
+def palette_receipt_rows(since_seq: int = 0) -> dict:
+    """
+    {"seq", "full", "rows"}: rows = (id, receipt_no, customer_id, name, phone, brand, model,
+    status, status_utc) for receipts whose receipt, customer or device row has a
+    change_journal entry after since_seq. The cursor is the journal seq (monotonic, not
+    the wall clock), so renames, device edits and late commits are never skipped.
+    full=True (every row) on first load, or when the journal was pruned past the cursor
+    or the DB was restored to an older seq.
+    """
+    con = db_conn()
+    try:
+        con.execute("BEGIN")  # seq والصفوف من نفس اللقطة
+        seq = _journal_seq(con)
+        oldest = con.execute("SELECT MIN(id) FROM change_journal").fetchone()[0]
+        full = (
+            since_seq <= 0
+            or since_seq > seq
+            or (seq > since_seq and (oldest or seq + 1) > since_seq + 1)
+        )
+        sql = """
+            SELECT r.id, r.receipt_no, r.customer_id, c.name, c.phone,
+                   d.brand, d.model, r.status, r.status_utc
+            FROM receipts r
+            CROSS JOIN customers c ON c.id=r.customer_id
+            CROSS JOIN devices d ON d.id=r.device_id
+        """
+        if full:
+            rows = con.execute(sql + " ORDER BY r.id").fetchall()
+        elif seq == since_seq:
+            rows = []
+        else:
+            changed = "SELECT row_id FROM change_journal WHERE id>? AND tbl="
+            rows = con.execute(
+                sql + f"""
+                WHERE r.id IN ({changed}'receipts')
+                   OR r.customer_id IN ({changed}'customers')
+                   OR r.device_id IN ({changed}'devices')
+                ORDER BY r.id
+                """,
+                (since_seq, since_seq, since_seq),
+            ).fetchall()
+        con.commit()
+    finally:
+        con.close()
+    return {"seq": seq, "full": full, "rows": rows}
+
+
+class QuickOpenIndex:
+    """
+    فهرس لوحة الأوامر (Ctrl+K): السندات الحالية برقم السند والجهاز، والعملاء عبر CustomerDirectory.
+    Loaded once in the background; update() merges palette_receipt_rows(.seq).
+    """
+
+    def __init__(self, snapshot=None):
+        self.receipts = {}
+        self.seq = 0
+        self.keys = PrefixIndex()
+        if snapshot:
+            self.update(snapshot)
+
+    @staticmethod
+    def _keys(receipt_no: str, brand: str, model: str) -> list:
+        words = _name_key(f"{brand} {model}").split(" ")
+        return [receipt_no.upper()] + [" ".join(words[i:]) for i in range(len(words))]
+
+    def update(self, snapshot: dict):
+        rows = [tuple(r) for r in snapshot["rows"]]
+        if snapshot["full"]:
+            self.receipts = {}
+            self.keys = PrefixIndex(
+                (k, r[0]) for r in rows for k in self._keys(r[1], r[5], r[6])
+            )
+        else:
+            for r in rows:
+                for k in self._keys(r[1], r[5], r[6]):
+                    self.keys.add(k, r[0])
+        for r in rows:
+            self.receipts[r[0]] = r
+        self.seq = snapshot["seq"]
+
+    def search(self, text: str, limit: int = 8) -> list:
+        """Receipt rows whose number or device (brand/model words) starts with text."""
+        key = _name_key(text)
+        if not key:
+            return []
+        no = normalize_scan(text) if any(ch.isdigit() for ch in text) else text.upper()
+        hits = self.keys.prefix(no.strip(), limit)
+        hits += [i for i in self.keys.prefix(key, limit) if i not in hits]
+        return [self.receipts[i] for i in hits[:limit]]
+
+
+# ---------------------- Write retry ---------------------------
+# كل الكتابات تمر عبر run_write_tx: BEGIN IMMEDIATE + إعادة المحاولة عند "database is locked"
+WRITE_RETRY_ATTEMPTS = 6
+WRITE_RETRY_BASE_DELAY = 0.05
+WRITE_RETRY_MAX_DELAY = 1.0
+# الكتابات تُستدعى من خيط الواجهة: مهلة قصيرة لكل محاولة وسقف لمجموع الانتظار
+WRITE_BUSY_TIMEOUT_MS = 500
+WRITE_MAX_WAIT_SECONDS = 3.0
+LOCK_WAIT_THRESHOLD_MS = 20
+
+DB_LOCK_STATS = {
+    "transactions": 0,
+    "lock_waits": 0,
+    "lock_wait_ms": 0.0,
+    "retries": 0,
+    "failures": 0,
+}
+_lock_stats_guard = threading.Lock()
+
+
+def _bump_lock_stat(key, amount=1):
+    with _lock_stats_guard:
+        DB_LOCK_STATS[key] += amount
+
+
+def _is_lock_error(e: Exception) -> bool:
+    msg = str(e).lower()
+    return isinstance(e, sqlite3.OperationalError) and (
+        "locked" in msg or "busy" in msg
+    )
+
+
+def run_write_tx(
+    fn, attempts: int = WRITE_RETRY_ATTEMPTS, max_wait: float = WRITE_MAX_WAIT_SECONDS
+):
+    """
+    Run fn(cur) in its own BEGIN IMMEDIATE transaction and return its result.
+    On a lock error the whole transaction is rolled back and re-run with bounded
+    exponential backoff, so fn must read everything it depends on through cur.
+    Each attempt waits at most WRITE_BUSY_TIMEOUT_MS for the lock and all attempts
+    together about max_wait seconds, so a Tk handler never hangs on a busy DB.
+    """
+    delay = WRITE_RETRY_BASE_DELAY
+    deadline = time.monotonic() + max_wait
+    for attempt in range(1, attempts + 1):
+        con = db_conn()
+        try:
+            con.execute(f"PRAGMA busy_timeout = {WRITE_BUSY_TIMEOUT_MS}")
+            t0 = time.perf_counter()
+            con.execute("BEGIN IMMEDIATE")
+            waited_ms = (time.perf_counter() - t0) * 1000
+            if waited_ms >= LOCK_WAIT_THRESHOLD_MS:
+                _bump_lock_stat("lock_waits")
+                _bump_lock_stat("lock_wait_ms", round(waited_ms, 1))
+            result = fn(con.cursor())
+            con.commit()
+            _bump_lock_stat("transactions")
+            return result
+        except sqlite3.OperationalError as e:
+            try:
+                con.rollback()
+            except Exception:
+                pass
+            if not _is_lock_error(e):
+                raise
+            left = deadline - time.monotonic()
+            if attempt == attempts or left <= 0:
+                _bump_lock_stat("failures")
+                logging.error(
+                    f"write transaction gave up after {attempt} attempts: {e}"
+                )
+                raise
+            _bump_lock_stat("retries")
+            time.sleep(
+                min(WRITE_RETRY_MAX_DELAY, delay, left) * random.uniform(0.5, 1.0)
+            )
+            delay *= 2
+        except Exception:
+            try:
+                con.rollback()
+            except Exception:
+                pass
+            raise
+        finally:
+            con.close()
+
+
+# ---------------------- Activity Log ---------------------------
+def _insert_activity(cur, receipt_id: int, kind: str, info: str, by_username: str):
+    cur.execute(
+        """
+        INSERT INTO activity_log(receipt_id, kind, info, at_utc, by_username)
+        VALUES(?,?,?,?,?)
+    """,
+        (
+            receipt_id,
+            kind,
+            info,
+            datetime.datetime.now(datetime.UTC).isoformat(),
+            by_username,
+        ),
+    )
+
+
+def log_activity(receipt_id: int, kind: str, info: str, by_username: str):
+    try:
+        run_write_tx(
+            lambda cur: _insert_activity(cur, receipt_id, kind, info, by_username)
+        )
+    except Exception as e:
+        logging.error(f"activity_log insert failed: {e}")
+    RECEIPT_DETAIL_CACHE.invalidate(receipt_id)
+
+
+# ---------------------- WhatsApp outbox ---------------------------
+# طابور دائم في SQLite + عامل واحد: رسالة واحدة في كل مرة (لا تسابق على الحافظة/التركيز)
+WA_SEND_INTERVAL_SECONDS = 4.0
+WA_MAX_ATTEMPTS = 4
+WA_RETRY_BASE_SECONDS = 30
+WA_HOST = platform.node() or "local"  # كل جهاز يرسل من واتساب المثبت عليه فقط
+WA_PARTIAL_SEND_ERROR = "ربما أُرسلت (فشل بعد اللصق) — تحقق قبل إعادة الإرسال"
+
+_wa_wake = threading.Event()
+# الطابور يعيش مع البيانات: في وضع الشبكة (RemoteBackend) على خادم المحل
+_wa_backend = None
+
+
+def set_wa_backend(backend):
+    global _wa_backend
+    _wa_backend = backend
+    _wa_wake.set()
+
+
+def _wa_queue():
+    return _wa_backend or LocalBackend()
+
+
+def wa_enqueue(
+    phone: str,
+    body: str,
+    receipt_id: int = 0,
+    kind: str = "WA",
+    username: str = "",
+    host: str = WA_HOST,
+) -> int:
+    now = datetime.datetime.now(datetime.UTC).isoformat()
+
+    def tx(cur):
+        cur.execute(
+            """
+            INSERT INTO wa_outbox(receipt_id, phone, body, kind, host, next_try_utc, created_utc, by_username)
+            VALUES(?,?,?,?,?,?,?,?)
+        """,
+            (receipt_id or 0, phone, body, kind, host, now, now, username),
+        )
+        return cur.lastrowid
+
+    oid = run_write_tx(tx)
+    _wa_wake.set()
+    return oid
+
+
+def wa_enqueue_many(rows) -> int:
+    """rows of (receipt_id, phone, body, kind, host, username, campaign) in one transaction."""
+    now = datetime.datetime.now(datetime.UTC).isoformat()
+    params = [
+        (rid, phone, body, kind, host, now, now, username, campaign)
+        for rid, phone, body, kind, host, username, campaign in rows
+    ]
+
+    def tx(cur):
+        cur.executemany(
+            """
+            INSERT INTO wa_outbox(receipt_id, phone, body, kind, host, next_try_utc, created_utc, by_username, campaign)
+            VALUES(?,?,?,?,?,?,?,?,?)
+        """,
+            params,
+        )
+
+    run_write_tx(tx)
+    _wa_wake.set()
+    return len(params)
+
+
+def _wa_claim_next(host: str = WA_HOST):
+    """Mark the oldest due message of host as 'sending' and return it (or None)."""
+    now = datetime.datetime.now(datetime.UTC).isoformat()
+
+    def tx(cur):
+        row = cur.execute(
+            """
+            SELECT id, receipt_id, phone, body, kind, attempts, by_username
+            FROM wa_outbox
+            WHERE host=? AND status='pending' AND next_try_utc<=?
+            ORDER BY id LIMIT 1
+        """,
+            (host, now),
+        ).fetchone()
+        if row:
+            cur.execute("UPDATE wa_outbox SET status='sending' WHERE id=?", (row[0],))
+        return row
+
+    return run_write_tx(tx)
+
+
+def _wa_mark_attempted(oid: int):
+    """
+    'attempted' = بدأ اللصق في واجهة واتساب؛ قد تكون الرسالة أُرسلت فعلاً، لذلك لا
+    تُعاد تلقائياً بعد فشل أو إغلاق مفاجئ (تذهب لـ failed للتحقق اليدوي).
+    """
+    run_write_tx(
+        lambda cur: cur.execute(
+            "UPDATE wa_outbox SET status='attempted' WHERE id=? AND status='sending'",
+            (oid,),
+        )
+    )
+
+
+def _wa_finish(row, ok: bool, error: str = ""):
+    oid, receipt_id, phone, _body, kind, attempts, username = row
+    attempts += 1
+    now = datetime.datetime.now(datetime.UTC)
+
+    def tx(cur):
+        st = cur.execute("SELECT status FROM wa_outbox WHERE id=?", (oid,)).fetchone()
+        attempted = bool(st) and st[0] == "attempted"
+        err = f"{WA_PARTIAL_SEND_ERROR}: {error}" if attempted else error
+        if ok:
+            cur.execute(
+                "UPDATE wa_outbox SET status='sent', attempts=?, sent_utc=?, last_error=NULL WHERE id=?",
+                (attempts, now.isoformat(), oid),
+            )
+            _insert_activity(cur, receipt_id, "WA_SENT", f"{kind} → {phone}", username)
+        elif attempted or attempts >= WA_MAX_ATTEMPTS:
+            cur.execute(
+                "UPDATE wa_outbox SET status='failed', attempts=?, last_error=? WHERE id=?",
+                (attempts, err, oid),
+            )
+            _insert_activity(
+                cur,
+                receipt_id,
+                "WA_FAILED",
+                f"{kind} → {phone} بعد {attempts} محاولات: {err}",
+                username,
+            )
+        else:
+            retry_at = now + datetime.timedelta(
+                seconds=WA_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+            )
+            cur.execute(
+                "UPDATE wa_outbox SET status='pending', attempts=?, next_try_utc=?, last_error=? WHERE id=?",
+                (attempts, retry_at.isoformat(), error, oid),
+            )
+
+    run_write_tx(tx)
+    RECEIPT_DETAIL_CACHE.invalidate(receipt_id)
+
+
+def wa_reset_sending(host: str = WA_HOST) -> int:
+    def tx(cur):
+        cur.execute(
+            "UPDATE wa_outbox SET status='failed', last_error=? WHERE host=? AND status='attempted'",
+            (WA_PARTIAL_SEND_ERROR, host),
+        )
+        return cur.execute(
+            "UPDATE wa_outbox SET status='pending' WHERE host=? AND status='sending'",
+            (host,),
+        ).rowcount
+
+    return run_write_tx(tx)
+
+
+def wa_outbox_stats(host: str = WA_HOST) -> dict:
+    con = db_conn()
+    try:
+        rows = con.execute(
+            "SELECT status, COUNT(*) FROM wa_outbox WHERE host=? GROUP BY status",
+            (host,),
+        ).fetchall()
+    finally:
+        con.close()
+    return {st: n for st, n in rows}
+
+
+def wa_retry_failed(host: str = WA_HOST) -> int:
+    now = datetime.datetime.now(datetime.UTC).isoformat()
+    n = run_write_tx(
+        lambda cur: cur.execute(
+            "UPDATE wa_outbox SET status='pending', attempts=0, next_try_utc=? WHERE host=? AND status='failed'",
+            (now, host),
+        ).rowcount
+    )
+    _wa_wake.set()
+    return n
+
+
+# ---------------------- WhatsApp campaigns ---------------------------
+# إشعار كل السندات الجاهزة أو تذكير من تأخر في الاستلام: المستلمون من استعلام واحد مفهرس،
+# والرسائل تُجهز دفعة واحدة ثم تدخل طابور wa_outbox بالترتيب.
+READY_STATUS = "جاهز للاستلام"
+CAMPAIGN_KINDS = {"ready": "WA_READY", "reminder": "WA_REMIND"}
+
+
+def campaign_candidates(branch_id: int, min_days: int = 0) -> list:
+    """Ready-for-pickup receipts of a branch that have waited at least min_days."""
+    cutoff = (
+        datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=min_days)
+    ).isoformat()
+    con = db_conn()
+    try:
+        rows = con.execute(
+            """
+            SELECT r.id, r.receipt_no, c.name, c.phone, d.brand, d.model, r.otp_code, r.status_utc,
+                   (SELECT MAX(h.at_utc) FROM status_history h
+                     WHERE h.receipt_id=r.id AND h.at_utc<r.status_utc)
+            FROM receipts r
+            JOIN customers c ON r.customer_id=c.id
+            JOIN devices d   ON r.device_id=d.id
+            WHERE r.branch_id=? AND r.status=? AND r.status_utc<=?
+            ORDER BY r.status_utc
+        """,
+            (branch_id, READY_STATUS, cutoff),
+        ).fetchall()
+    finally:
+        con.close()
+    keys = (
+        "id",
+        "receipt_no",
+        "name",
+        "phone",
+        "brand",
+        "model",
+        "otp",
+        "since_utc",
+        "prev_change_utc",
+    )
+    return [dict(zip(keys, r)) for r in rows]
+
+
+def campaign_recipients(kind: str, candidates: list, min_days: int = 0) -> list:
+    """
+    Drop receipts already notified (from the outbox): "ready" = a notice since the
+    status change before the current one (a notice queued just before the receipt was
+    marked ready still counts); "reminder" = a reminder within the last min_days.
+    """
+    wa_kind = CAMPAIGN_KINDS[kind]
+    con = db_conn()
+    try:
+        last = dict(
+            con.execute(
+                """
+                SELECT receipt_id, MAX(created_utc) FROM wa_outbox
+                WHERE kind=? AND status!='failed' GROUP BY receipt_id
+            """,
+                (wa_kind,),
+            ).fetchall()
+        )
+    finally:
+        con.close()
+    recent = (
+        datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=max(1, min_days))
+    ).isoformat()
+    out = []
+    for c in candidates:
+        sent = last.get(c["id"])
+        if sent and (
+            sent >= (c.get("prev_change_utc") or "")
+            if kind == "ready"
+            else sent >= recent
+        ):
+            continue
+        out.append(c)
+    return out
+
+
+def notify_ready(backend, rid: int, phone: str, text: str, username: str) -> int:
+    """
+    السند ← "جاهز للاستلام" أولاً ثم إشعار الجاهزية في الطابور (لا يسبق الإشعار status_utc).
+    Returns the outbox id.
+    """
+    backend.set_status(rid, READY_STATUS, username)
+    return backend.wa_enqueue(phone, text, rid, "WA_READY", username)
+
+
+def build_campaign_rows(kind: str, recipients: list, username: str = "") -> tuple:
+    """
+    Pre-render every message: (campaign id, rows for wa_enqueue_many). The rows carry
+    this PC's WA_HOST — it is the one whose WhatsApp sends them.
+    """
+    wa_kind = CAMPAIGN_KINDS[kind]
+    company = SETTINGS.get("company", "ATTA")
+    now = datetime.datetime.now(datetime.UTC)
+    campaign = f"{kind}-{now.strftime('%Y%m%d%H%M%S')}-{random_otp(3)}"
+    rows = []
+    for c in recipients:
+        device = f"{c['brand']} {c['model']}"
+        if kind == "ready":
+            text = make_ready_text(c["receipt_no"], device, c["otp"], company)
+        else:
+            days = (now - parse_utc_iso(c["since_utc"])).days
+            text = make_pickup_reminder_text(
+                c["receipt_no"], device, c["otp"], company, days
+            )
+        rows.append((c["id"], c["phone"], text, wa_kind, WA_HOST, username, campaign))
+    return campaign, rows
+
+
+def campaign_progress(campaign: str) -> dict:
+    con = db_conn()
+    try:
+        rows = con.execute(
+            "SELECT status, COUNT(*) FROM wa_outbox WHERE campaign=? GROUP BY status",
+            (campaign,),
+        ).fetchall()
+    finally:
+        con.close()
+    st = dict(rows)
+    return {
+        "total": sum(st.values()),
+        "sent": st.get("sent", 0),
+        "failed": st.get("failed", 0),
+        "pending": st.get("pending", 0) + st.get("sending", 0) + st.get("attempted", 0),
+    }
+
+
+# ---------------------- Receipt writes ---------------------------
+def create_receipt(
+    branch: dict,
+    username: str,
+    *,
+    name: str,
+    phone: str,
+    dev_type: str,
+    brand: str,
+    model: str,
+    serial: str = "",
+    color: str = "",
+    accessories: str = "",
+    device_state: str | None = None,
+    issue: str = "",
+    work: str = "",
+    est: float = 0.0,
+    device_id: int | None = None,
+) -> dict:
+    """
+    أنشئ عميل/جهاز/سند + سجل الحالة + سجل النشاط في معاملة واحدة.
+    The receipt number is drawn inside the same transaction. Returns id, receipt_no,
+    otp, customer_id, initial WhatsApp text and link.
+    device_id reuses a known device row (same serial/IMEI) instead of inserting a new one;
+    its owner is kept, brand/model/accessories take the values from this intake.
+    """
+    otp = random_otp()
+    tracking_hint = f"{SETTINGS.get('company','ATTA')} — أحضر رقم السند والرمز"
+    renamed = {"v": False}
+
+    def tx(cur):
+        cur.execute("SELECT id,name FROM customers WHERE phone=?", (phone,))
+        row = cur.fetchone()
+        if row:
+            cust_id = row[0]
+            renamed["v"] = row[1] != name
+            if row[1] != name:
+                cur.execute(
+                    "UPDATE customers SET name=?, name_norm=? WHERE id=?",
+                    (name, normalize_ar(name), cust_id),
+                )
+                _store_search_keys(cur, "c", cust_id, name)
+        else:
+            cur.execute(
+                "INSERT INTO customers(name,phone,name_norm,phone_rev) VALUES(?,?,?,?)",
+                (name, phone, normalize_ar(name), phone_rev(phone)),
+            )
+            cust_id = cur.lastrowid
+            _store_search_keys(cur, "c", cust_id, name)
+
+        dev_id = None
+        if device_id:
+            cur.execute("SELECT id FROM devices WHERE id=?", (device_id,))
+            if cur.fetchone():
+                dev_id = device_id
+                # الجهاز نفسه عاد: نربطه بالسند دون نقل مالكه (السند يحمل عميله)،
+                # ونحفظ الماركة/الموديل كما صُححت في النموذج مع الملحقات الحالية
+                cur.execute(
+                    "UPDATE devices SET brand=?, model=?, model_norm=?, accessories=? WHERE id=?",
+                    (
+                        brand,
+                        model,
+                        normalize_ar(f"{brand} {model}"),
+                        accessories or None,
+                        dev_id,
+                    ),
+                )
+                _store_search_keys(cur, "d", dev_id, f"{brand} {model}")
+        if dev_id is None:
+            cur.execute(
+                "INSERT INTO devices(customer_id,type,brand,model,serial_imei,color,accessories,model_norm) VALUES(?,?,?,?,?,?,?,?)",
+                (
+                    cust_id,
+                    dev_type,
+                    brand,
+                    model,
+                    (serial or "").strip() or None,
+                    color or None,
+                    accessories or None,
+                    normalize_ar(f"{brand} {model}"),
+                ),
+            )
+            dev_id = cur.lastrowid
+            _store_search_keys(cur, "d", dev_id, f"{brand} {model}")
+
+        rno = generate_receipt_no(branch["code"], cur)
+        initial_text = make_whatsapp_initial_text(
+            rno, f"{brand} {model}", issue, otp, tracking_hint, device_state
+        )
+        wa = f"whatsapp://send?phone={phone}&text={ul.quote(initial_text,safe='')}"
+        now = datetime.datetime.now(datetime.UTC).isoformat()
+
+        cur.execute(
+            """
+            INSERT INTO receipts(
+                branch_id,customer_id,device_id,receipt_no,issue_desc,work_request,est_amount,approved_amount,device_state,status,
+                otp_code,whatsapp_link,qr_path,signature_path,created_utc,paid_flag,paid_amount,paid_utc,payment_method,
+                status_utc
+            )
+            VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+        """,
+            (
+                branch["id"],
+                cust_id,
+                dev_id,
+                rno,
+                issue,
+                work,
+                est,
+                None,
+                device_state,
+                "جديد",
+                otp,
+                wa,
+                None,  # QR يُنشأ عند العرض (make_qr / qr_photo)
+                None,
+                now,
+                0,
+                0.0,
+                None,
+                None,
+                now,
+            ),
+        )
+        rid = cur.lastrowid
+        cur.execute(
+            "INSERT INTO status_history(receipt_id,from_status,to_status,at_utc,by_username) VALUES(?,?,?,?,?)",
+            (rid, None, "جديد", now, username),
+        )
+        _insert_activity(cur, rid, "CREATE", f"Receipt created with no {rno}", username)
+        return {
+            "id": rid,
+            "receipt_no": rno,
+            "otp": otp,
+            "customer_id": cust_id,
+            "device_id": dev_id,
+            "initial_text": initial_text,
+            "whatsapp_link": wa,
+        }
+
+    res = run_write_tx(tx)
+    if renamed["v"] or device_id:
+        # الاسم الجديد / الموديل المصحح يظهر في تفاصيل السندات السابقة
+        RECEIPT_DETAIL_CACHE.invalidate()
+    return res
+
+
+def save_receipt_payment(rid: int, approved: float, paid: float, method: str) -> int:
+    """Store approved/paid amounts; returns the resulting paid_flag."""
+    is_paid = 1 if (approved - paid) <= 0.01 else 0
+
+    def tx(cur):
+        cur.execute(
+            """
+            UPDATE receipts SET approved_amount=?, paid_amount=?, paid_flag=?,
+                paid_utc = CASE WHEN ?=1 THEN ? ELSE NULL END,
+                payment_method=? WHERE id=?
+        """,
+            (
+                approved,
+                paid,
+                is_paid,
+                is_paid,
+                datetime.datetime.now(datetime.UTC).isoformat(),
+                method,
+                rid,
+            ),
+        )
+
+    run_write_tx(tx)
+    RECEIPT_DETAIL_CACHE.invalidate(rid)
+    # الدفع قد ينقل سندًا من يوم مغلق → التقارير المخزنة لم تعد صحيحة
+    _revenue_day_cache.clear()
+    return is_paid
+
+
+def set_receipt_status(rid: int, new_status: str, username: str) -> str | None:
+    """
+    غيّر حالة السند وسجّلها في status_history (delivered_utc يُضبط عند التسليم فقط).
+    Returns the previous status as read inside the transaction.
+    """
+
+    def tx(cur):
+        cur.execute("SELECT status FROM receipts WHERE id=?", (rid,))
+        row = cur.fetchone()
+        prev = row[0] if row else None
+        now_utc = datetime.datetime.now(datetime.UTC).isoformat()
+        cur.execute(
+            "UPDATE receipts SET status=?, status_utc=?, delivered_utc=? WHERE id=?",
+            (
+                new_status,
+                now_utc,
+                now_utc if new_status == "تم التسليم" else None,
+                rid,
+            ),
+        )
+        cur.execute(
+            """
+            INSERT INTO status_history(receipt_id,from_status,to_status,at_utc,by_username)
+            VALUES(?,?,?,?,?)
+        """,
+            (rid, prev, new_status, now_utc, username),
+        )
+        return prev
+
+    prev = run_write_tx(tx)
+    RECEIPT_DETAIL_CACHE.invalidate(rid)
+    return prev
+
+
+# ---------------------- Receipt reads ---------------------------
+def search_receipts(
+    branch_id: int,
+    q: str = "",
+    status: str = "",
+    paid: str = "",
+    include_archive: bool = False,
+) -> list:
+    """
+    صفوف قائمة السندات: (id, receipt_no, name, phone, brand, model, status, est, created_utc, paid_flag).
+    paid is "" / "مدفوع" / "غير مدفوع"; q matches number, phone or local date anywhere,
+    and any word onward of the customer name / "brand model" (range on search_keys).
+    """
+    where = ["r.branch_id=?"]
+    params = [branch_id]
+    if status:
+        where.append("r.status=?")
+        params.append(status)
+    if paid == "مدفوع":
+        where.append("COALESCE(r.paid_flag,0)=1")
+    elif paid == "غير مدفوع":
+        where.append("COALESCE(r.paid_flag,0)=0")
+    q = (q or "").strip()
+    if q:
+        # نفس التطبيع المستخدم عند الكتابة في name_norm / model_norm
+        key = normalize_ar(q)
+        like = "%" + re.sub(r"([\\%_])", r"\\\1", key) + "%"
+        # بداية أي كلمة = نطاق [key, key+U+10FFFF) على مفتاح search_keys الأساسي
+        hi = key + "\U0010ffff"
+        where.append("""(lower(r.receipt_no) LIKE ? ESCAPE '\\'
+                OR r.customer_id IN (SELECT ref_id FROM search_keys
+                                     WHERE kind='c' AND key>=? AND key<?)
+                OR c.phone LIKE ? ESCAPE '\\'
+                OR r.device_id IN (SELECT ref_id FROM search_keys
+                                   WHERE kind='d' AND key>=? AND key<?)
+                OR strftime('%Y-%m-%d %H:%M', r.created_utc, ?) LIKE ? ESCAPE '\\')""")
+        params += [like, key, hi, like, key, hi]
+        params += [f"+{RIYADH_UTC_OFFSET_HOURS} hours", like]
+    con = db_conn(archive=include_archive)
+    try:
+        rows = con.execute(
+            f"""
+            SELECT r.id,r.receipt_no,c.name,c.phone,d.brand,d.model,
+                   r.status,r.est_amount,r.created_utc,
+                   COALESCE(r.paid_flag,0) AS paid_flag
+            FROM {"all_receipts" if include_archive else "receipts"} r
+            JOIN customers c ON r.customer_id=c.id
+            JOIN devices d   ON r.device_id=d.id
+            WHERE {" AND ".join(where)}
+            ORDER BY r.id DESC
+            """,
+            params,
+        ).fetchall()
+    finally:
+        con.close()
+    return rows
+
+
+def device_history_by_serial(serial: str) -> list:
+    """
+    كل السندات السابقة لجهاز بنفس Serial/IMEI (الحالية والمؤرشفة) مع حالة الضمان.
+    Uses the upper(trim(serial_imei)) expression index. Newest first.
+    """
+    key = (serial or "").strip().upper()
+    if len(key) < 4:
+        return []
+    with_archive = ARCHIVE_DB_PATH.exists()
+    con = db_conn(archive=with_archive)
+    try:
+        rows = con.execute(
+            f"""
+            SELECT d.id, d.type, d.brand, d.model, d.color,
+                   r.id, r.receipt_no, r.status, r.created_utc, r.delivered_utc,
+                   r.issue_desc, c.name, c.phone
+            FROM devices d
+            CROSS JOIN {"all_receipts" if with_archive else "receipts"} r ON r.device_id=d.id
+            JOIN customers c ON r.customer_id=c.id
+            WHERE upper(trim(d.serial_imei))=? AND d.serial_imei IS NOT NULL
+            ORDER BY r.created_utc DESC
+            """,
+            (key,),
+        ).fetchall()
+    finally:
+        con.close()
+    now = datetime.datetime.now(datetime.UTC)
+    out = []
+    for r in rows:
+        warranty_end = None
+        if r[9]:
+            warranty_end = parse_utc_iso(r[9]) + datetime.timedelta(days=WARRANTY_DAYS)
+        out.append(
+            {
+                "device_id": r[0],
+                "type": r[1],
+                "brand": r[2],
+                "model": r[3],
+                "color": r[4] or "",
+                "receipt_id": r[5],
+                "receipt_no": r[6],
+                "status": r[7],
+                "created_utc": r[8],
+                "delivered_utc": r[9],
+                "issue": r[10],
+                "cust_name": r[11],
+                "cust_phone": r[12],
+                "warranty_end_utc": warranty_end.isoformat() if warranty_end else None,
+                "in_warranty": bool(warranty_end and now <= warranty_end),
+            }
+        )
+    return out
+
+
+CUSTOMER_RECEIPT_FIELDS = (
+    "id",
+    "receipt_no",
+    "status",
+    "created_utc",
+    "delivered_utc",
+    "device_id",
+    "brand",
+    "model",
+    "serial",
+    "amount",
+    "paid",
+    "archived",
+    "due",
+)
+
+
+def customer_history(customer_id: int | None = None, phone: str = "") -> dict | None:
+    """
+    ملف العميل: كل سنداته (الحالية والمؤرشفة) وأجهزته والمدفوع والمتبقي.
+    One query over receipts(customer_id) with window totals; details load lazily per receipt.
+    """
+    with_archive = ARCHIVE_DB_PATH.exists()
+    con = db_conn(archive=with_archive)
+    try:
+        if customer_id is None:
+            row = con.execute(
+                "SELECT id, name, phone FROM customers WHERE phone=?",
+                (normalize_phone(phone),),
+            ).fetchone()
+        else:
+            row = con.execute(
+                "SELECT id, name, phone FROM customers WHERE id=?", (customer_id,)
+            ).fetchone()
+        if not row:
+            return None
+        rows = con.execute(
+            f"""
+            WITH x AS (
+                SELECT r.id, r.receipt_no, r.status, r.created_utc, r.delivered_utc,
+                       d.id AS device_id, d.brand, d.model, COALESCE(d.serial_imei,'') AS serial,
+                       COALESCE(r.approved_amount, r.est_amount, 0) AS amount,
+                       COALESCE(r.paid_amount, 0) AS paid,
+                       {"r.archived" if with_archive else "0"} AS archived
+                FROM {"all_receipts" if with_archive else "receipts"} r
+                JOIN devices d ON r.device_id=d.id
+                WHERE r.customer_id=?
+            )
+            SELECT x.*,
+                   CASE WHEN status='ملغي' THEN 0 ELSE MAX(amount - paid, 0) END AS due,
+                   SUM(paid) OVER () AS total_paid,
+                   SUM(CASE WHEN status='ملغي' THEN 0 ELSE MAX(amount - paid, 0) END) OVER () AS total_due,
+                   SUM(status NOT IN ({",".join("?" * len(CLOSED_STATUSES))})) OVER () AS n_open
+            FROM x ORDER BY id DESC
+            """,
+            (row[0], *CLOSED_STATUSES),
+        ).fetchall()
+    finally:
+        con.close()
+    receipts = [dict(zip(CUSTOMER_RECEIPT_FIELDS, r[:13])) for r in rows]
+    first = rows[0] if rows else None
+    return {
+        "customer": {"id": row[0], "name": row[1], "phone": row[2]},
+        "receipts": receipts,
+        "totals": {
+            "receipts": len(rows),
+            "devices": len({r["device_id"] for r in receipts}),
+            "open": int(first[15]) if first else 0,
+            "paid": float(first[13]) if first else 0.0,
+            "due": float(first[14]) if first else 0.0,
+        },
+    }
+
+
+def open_receipts_by_phone_suffix(
+    branch_id: int, digits: str, limit: int = 200
+) -> list:
+    """
+    السندات المفتوحة لعملاء ينتهي جوالهم بـ digits (نفس صفوف search_receipts).
+    phone_rev range scan → receipts by customer index; no full-table scan.
+    """
+    # لاحقة خام: لا normalize_phone هنا (يحذف 00 البادئة فيصبح "0045" ← "45")
+    rev = "".join(ch for ch in str(digits or "") if ch.isdigit())[::-1]
+    if not rev:
+        return []
+    hi = rev[:-1] + chr(ord(rev[-1]) + 1)
+    con = db_conn()
+    try:
+        return con.execute(
+            f"""
+            SELECT r.id,r.receipt_no,c.name,c.phone,d.brand,d.model,
+                   r.status,r.est_amount,r.created_utc,
+                   COALESCE(r.paid_flag,0) AS paid_flag
+            FROM customers c
+            CROSS JOIN receipts r ON r.customer_id=c.id  -- CROSS: ابدأ من نطاق phone_rev
+            JOIN devices d  ON r.device_id=d.id
+            WHERE c.phone_rev >= ? AND c.phone_rev < ?
+              AND r.branch_id=? AND r.status NOT IN ({",".join("?" * len(CLOSED_STATUSES))})
+            ORDER BY r.id DESC
+            LIMIT ?
+            """,
+            (rev, hi, branch_id, *CLOSED_STATUSES, limit),
+        ).fetchall()
+    finally:
+        con.close()
+
+
+RECEIPT_DETAIL_FIELDS = (
+    "receipt_no",
+    "cust_name",
+    "cust_phone",
+    "brand",
+    "model",
+    "serial",
+    "est",
+    "approved",
+    "paid",
+    "paid_flag",
+    "pay_method",
+    "device_state",
+    "issue",
+    "work",
+    "created_utc",
+    "status",
+    "otp",
+    "qr_path",
+    "delivered_utc",
+    "whatsapp_link",
+    "archived",
+)
+
+
+def fetch_receipt_detail(rid: int) -> dict | None:
+    """Everything the detail window shows for one receipt (hot or archived), incl. its activity log."""
+    with_archive = ARCHIVE_DB_PATH.exists()
+    con = db_conn(archive=with_archive)
+    cur = con.cursor()
+    cur.execute(
+        f"""
+        SELECT r.receipt_no, c.name, c.phone, d.brand, d.model, d.serial_imei,
+               r.est_amount, COALESCE(r.approved_amount,r.est_amount),
+               COALESCE(r.paid_amount,0.0), COALESCE(r.paid_flag,0),
+               COALESCE(r.payment_method,''), r.device_state,
+               r.issue_desc, r.work_request, r.created_utc, r.status,
+               r.otp_code, r.qr_path, r.delivered_utc, r.whatsapp_link,
+               {"r.archived" if with_archive else "0"}
+        FROM {"all_receipts" if with_archive else "receipts"} r
+        JOIN customers c ON r.customer_id=c.id
+        JOIN devices d   ON r.device_id=d.id
+        WHERE r.id=?""",
+        (rid,),
+    )
+    r = cur.fetchone()
+    if not r:
+        con.close()
+        return None
+    detail = dict(zip(RECEIPT_DETAIL_FIELDS, r))
+    cur.execute(
+        f"""
+        SELECT kind, info, at_utc, by_username
+        FROM {"all_activity_log" if detail["archived"] else "activity_log"}
+        WHERE receipt_id=? ORDER BY id DESC
+    """,
+        (rid,),
+    )
+    detail["log"] = cur.fetchall()
+    con.close()
+    return detail
+
+
+def receipt_version(rid: int):
+    """
+    Cheap freshness token for a cached detail: the receipt's status/payment columns and
+    its newest activity id (PK + idx_activity_log_receipt lookups). Writes from other
+    terminals change it. None when the receipt is not in the hot table (archived).
+    """
+    con = db_conn()
+    try:
+        return con.execute(
+            """
+            SELECT r.status, r.status_utc, r.approved_amount, r.paid_amount, r.paid_flag,
+                   r.paid_utc, r.payment_method,
+                   (SELECT MAX(a.id) FROM activity_log a WHERE a.receipt_id=r.id)
+            FROM receipts r WHERE r.id=?
+            """,
+            (rid,),
+        ).fetchone()
+    finally:
+        con.close()
+
+
+# ---------------------- Receipt detail cache ---------------------------
+RECEIPT_WINDOWS_MAX = 8  # نوافذ تفاصيل مفتوحة معاً؛ الأقدم يُغلق
+RECEIPT_DETAIL_CACHE_SIZE = 64
+# كتابات الأجهزة الأخرى تُكتشف بـ receipt_version قبل كل استخدام؛ العمر المحدود يغطي
+# ما لا يغيّر الإصدار (تعديل اسم العميل/الجهاز من جهاز آخر)
+RECEIPT_DETAIL_TTL_SECONDS = 60
+
+
+class ReceiptDetailCache:
+    """
+    LRU لتفاصيل السند الكاملة (مع سجل النشاط) مفتاحها رقم السند الداخلي؛ آمن بين الخيوط.
+    Every write path calls invalidate(rid) after its commit; a load that started before
+    an invalidation is not stored. With version(rid) a hit is served only if the token
+    still matches the one read before the entry was loaded.
+    """
+
+    def __init__(self, size=RECEIPT_DETAIL_CACHE_SIZE, ttl=RECEIPT_DETAIL_TTL_SECONDS):
+        self.size, self.ttl = size, ttl
+        self._items = {}  # rid -> (loaded_at, detail, version), oldest first
+        self._lock = threading.Lock()
+        self._gen = 0
+        self._want = None
+        self._worker = None
+
+    def _fresh(self, rid):
+        item = self._items.get(rid)
+        return item is not None and time.monotonic() - item[0] < self.ttl
+
+    def __contains__(self, rid):
+        with self._lock:
+            return self._fresh(rid)
+
+    def get(self, rid: int, load, version=None):
+        with self._lock:
+            item = self._items.get(rid) if self._fresh(rid) else None
+            gen = self._gen
+        # الإصدار يُقرأ قبل التحميل: كتابة بينهما تجعل المخزن قديماً فيُعاد تحميله لاحقاً
+        ver = version(rid) if version else None
+        if item is not None and ver == item[2]:
+            with self._lock:
+                if self._items.get(rid) is item:
+                    self._items[rid] = self._items.pop(rid)
+            return dict(item[1])
+        detail = load(rid)
+        if detail:
+            with self._lock:
+                if gen == self._gen:
+                    self._items.pop(rid, None)
+                    self._items[rid] = (time.monotonic(), detail, ver)
+                    while len(self._items) > self.size:
+                        self._items.pop(next(iter(self._items)))
+            detail = dict(detail)
+        return detail
+
+    def invalidate(self, rid: int | None = None):
+        """Drop one receipt (or everything when rid is None)."""
+        with self._lock:
+            self._gen += 1
+            if rid is None:
+                self._items.clear()
+            else:
+                self._items.pop(rid, None)
+
+    def prefetch(self, rid: int, fetch):
+        """Warm rid off the UI thread; while one load runs only the latest request waits."""
+        with self._lock:
+            if self._fresh(rid):
+                return
+            self._want = (rid, fetch)
+            if self._worker is not None:
+                return
+            self._worker = threading.Thread(
+                target=self._prefetch_loop, name="receipt-prefetch", daemon=True
+            )
+            self._worker.start()
+
+    def _prefetch_loop(self):
+        while True:
+            with self._lock:
+                want, self._want = self._want, None
+                if want is None:
+                    self._worker = None
+                    return
+            try:
+                want[1](want[0])
+            except Exception as e:
+                logging.error(f"Receipt prefetch failed for #{want[0]}: {e}")
+
+
+RECEIPT_DETAIL_CACHE = ReceiptDetailCache()
+
+
+def find_receipt_id_by_no(receipt_no: str) -> int | None:
+    receipt_no = normalize_scan(receipt_no)
+    con = db_conn()
+    cur = con.cursor()
+    cur.execute("SELECT id FROM receipts WHERE receipt_no = ? LIMIT 1", (receipt_no,))
+    row = cur.fetchone()
+    if not row and ARCHIVE_DB_PATH.exists():
+        _attach_archive(con)
+        cur.execute(
+            "SELECT id FROM arc.receipts WHERE receipt_no = ? LIMIT 1",
+            (receipt_no,),
+        )
+        row = cur.fetchone()
+    con.close()
+    return int(row[0]) if row else None
+
+
+def authenticate_user(username: str, password: str):
+    """Returns (user, branch) dicts, or None when the credentials are wrong."""
+    con = db_conn()
+    cur = con.cursor()
+    cur.execute(
+        "SELECT id,branch_id,username,password,role FROM users WHERE username=?",
+        (username,),
+    )
+    row = cur.fetchone()
+    if not row or not password_matches(row[3], password):
+        con.close()
+        return None
+    cur.execute("SELECT id,name,code FROM branches WHERE id=?", (row[1],))
+    b = cur.fetchone()
+    con.close()
+    user = {"id": row[0], "branch_id": row[1], "username": row[2], "role": row[4]}
+    return user, {"id": b[0], "name": b[1], "code": b[2]}
+
+
+def branch_dashboard_stats(branch_id: int) -> dict:
+    """Status counts + today's receipts/payments for one branch (Riyadh day)."""
+    con = db_conn()
+    cur = con.cursor()
+
+    # عدد كل حالة
+    counts = {s: 0 for s in STATUS_ORDER}
+    cur.execute(
+        "SELECT status, COUNT(*) FROM receipts WHERE branch_id=? GROUP BY status",
+        (branch_id,),
+    )
+    for st, cnt in cur.fetchall():
+        counts[st] = cnt
+
+    # تحديد نطاق اليوم الحالي (حسب توقيت الرياض)
+    today_local = to_riyadh(datetime.datetime.now(datetime.UTC)).date()
+
+    start_utc = datetime.datetime(
+        today_local.year, today_local.month, today_local.day
+    ) - datetime.timedelta(hours=RIYADH_UTC_OFFSET_HOURS)
+    end_utc = start_utc + datetime.timedelta(days=1)
+    bounds = (
+        branch_id,
+        start_utc.isoformat().replace("T", " "),
+        end_utc.isoformat().replace("T", " "),
+    )
+
+    # ===== عدد السندات اليوم (بدون الملغاة) =====
+    cur.execute(
+        """
+        SELECT COUNT(*) FROM receipts
+        WHERE branch_id=? 
+          AND datetime(REPLACE(created_utc,'T',' ')) >= datetime(?)
+          AND datetime(REPLACE(created_utc,'T',' ')) < datetime(?)
+          AND status!='ملغي'
+    """,
+        bounds,
+    )
+    receipts_today = cur.fetchone()[0] or 0
+
+    # ===== عدد المدفوعات اليوم =====
+    cur.execute(
+        """
+        SELECT COUNT(*) FROM receipts
+        WHERE branch_id=?
+          AND paid_flag=1
+          AND datetime(REPLACE(paid_utc,'T',' ')) >= datetime(?)
+          AND datetime(REPLACE(paid_utc,'T',' ')) < datetime(?)
+    """,
+        bounds,
+    )
+    paid_today = cur.fetchone()[0] or 0
+
+    # ===== إجمالي المبالغ المدفوعة اليوم =====
+    cur.execute(
+        """
+        SELECT COALESCE(SUM(paid_amount),0) FROM receipts
+        WHERE branch_id=?
+          AND paid_flag=1
+          AND datetime(REPLACE(paid_utc,'T',' ')) >= datetime(?)
+          AND datetime(REPLACE(paid_utc,'T',' ')) < datetime(?)
+    """,
+        bounds,
+    )
+    total_paid_today = cur.fetchone()[0] or 0.0
+
+    con.close()
+    return {
+        "counts": counts,
+        "receipts_today": receipts_today,
+        "paid_today": paid_today,
+        "total_paid_today": total_paid_today,
+    }
+
+
+OWNER_DASH_TTL_SECONDS = 20
+_owner_dash_cache = {"key": None, "at": 0.0, "data": None}
+
+
+def riyadh_day_bounds_utc(day: datetime.date):
+    """[start, end) of a Riyadh calendar day as UTC ISO strings, comparable with *_utc columns."""
+    start = datetime.datetime(
+        day.year, day.month, day.day, tzinfo=datetime.UTC
+    ) - datetime.timedelta(hours=RIYADH_UTC_OFFSET_HOURS)
+    end = start + datetime.timedelta(days=1)
+    return start.isoformat(), end.isoformat()
+
+
+def _journal_seq(con) -> int:
+    """Monotonic change counter (survives journal pruning after sync)."""
+    row = con.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name='change_journal'"
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def owner_dashboard_stats(force: bool = False) -> dict:
+    """
+    لوحة المالك: لكل فرع عدد كل حالة + سندات اليوم + مدفوعات/إيراد اليوم في استعلام GROUP BY واحد.
+    Cached for OWNER_DASH_TTL_SECONDS; after that it is recomputed only if the change journal moved.
+    """
+    today_local = to_riyadh(datetime.datetime.now(datetime.UTC)).date()
+    now = time.monotonic()
+    cache = _owner_dash_cache
+    if (
+        not force
+        and cache["data"] is not None
+        and cache["key"][0] == today_local
+        and now - cache["at"] < OWNER_DASH_TTL_SECONDS
+    ):
+        return cache["data"]
+
+    con = db_conn()
+    try:
+        seq = _journal_seq(con)
+        key = (today_local, seq)
+        if not force and cache["data"] is not None and cache["key"] == key:
+            cache["at"] = now
+            return cache["data"]
+        s_utc, e_utc = riyadh_day_bounds_utc(today_local)
+        rows = con.execute(
+            """
+            SELECT b.id, b.name, b.code, r.status, COUNT(r.id),
+                   SUM(CASE WHEN r.created_utc >= ? AND r.created_utc < ? AND r.status != 'ملغي'
+                            THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN r.paid_flag = 1 AND r.paid_utc >= ? AND r.paid_utc < ?
+                            THEN 1 ELSE 0 END),
+                   SUM(CASE WHEN r.paid_flag = 1 AND r.paid_utc >= ? AND r.paid_utc < ?
+                            THEN r.paid_amount ELSE 0 END)
+            FROM branches b
+            LEFT JOIN receipts r ON r.branch_id = b.id
+            GROUP BY b.id, r.status
+            ORDER BY b.id
+        """,
+            (s_utc, e_utc, s_utc, e_utc, s_utc, e_utc),
+        ).fetchall()
+    finally:
+        con.close()
+
+    branches = {}
+    for bid, name, code, st, cnt, today_n, paid_n, revenue in rows:
+        b = branches.setdefault(
+            bid,
+            {
+                "id": bid,
+                "name": name,
+                "code": code,
+                "counts": {s: 0 for s in STATUS_ORDER},
+                "receipts_today": 0,
+                "paid_today": 0,
+                "total_paid_today": 0.0,
+            },
+        )
+        if st is not None:
+            b["counts"][st] = cnt
+        b["receipts_today"] += today_n or 0
+        b["paid_today"] += paid_n or 0
+        b["total_paid_today"] += revenue or 0.0
+    data = {"day": today_local.isoformat(), "branches": list(branches.values())}
+    cache.update(key=key, at=now, data=data)
+    return data
+
+
+def list_branches() -> list:
+    con = db_conn()
+    try:
+        rows = con.execute("SELECT id,name,code FROM branches ORDER BY id").fetchall()
+    finally:
+        con.close()
+    return [{"id": r[0], "name": r[1], "code": r[2]} for r in rows]
+
+
+# أيام الماضي نادراً ما تتغير: نخزن نتيجة كل يوم مغلق ونستعلم فقط عن الأيام الناقصة + اليوم الحالي.
+# أي دفع من أي جهاز يرفع paid_rev في القاعدة، واسترجاع نسخة يغيّر الملف → يُفرَّغ الكاش
+_revenue_day_cache = {}
+_revenue_cache_key = {"key": None}
+
+
+def _revenue_cache_check(con):
+    row = con.execute("SELECT v FROM sync_state WHERE k='paid_rev'").fetchone()
+    key = (row[0] if row else None, DB_PATH.stat().st_ino)
+    if key != _revenue_cache_key["key"]:
+        _revenue_day_cache.clear()
+        _revenue_cache_key["key"] = key
+
+
+def revenue_report(start_day, end_day, branch_id=None) -> list:
+    """
+    Paid totals per (Riyadh day, branch, payment method) for start_day..end_day inclusive:
+    rows of (day "YYYY-MM-DD", branch_id, method, count, total). Archived receipts are included.
+    Closed days come from cache; everything missing is fetched with a single aggregate query.
+    """
+    today_local = to_riyadh(datetime.datetime.now(datetime.UTC)).date()
+    con = db_conn()
+    try:
+        _revenue_cache_check(con)
+    finally:
+        con.close()
+    days = []
+    d = start_day
+    while d <= end_day:
+        days.append(d)
+        d += datetime.timedelta(days=1)
+    missing = [
+        d for d in days if d >= today_local or (branch_id, d) not in _revenue_day_cache
+    ]
+
+    fetched = {}
+    if missing:
+        s_utc, _ = riyadh_day_bounds_utc(min(missing))
+        _, e_utc = riyadh_day_bounds_utc(max(missing))
+        with_archive = ARCHIVE_DB_PATH.exists()
+        con = db_conn(archive=with_archive)
+        try:
+            sql = f"""
+                SELECT date(paid_utc, ?) AS day, branch_id,
+                       COALESCE(payment_method,''), COUNT(*), COALESCE(SUM(paid_amount),0)
+                FROM {"all_receipts" if with_archive else "receipts"}
+                WHERE paid_flag=1 AND paid_utc >= ? AND paid_utc < ?
+            """
+            params = [f"+{RIYADH_UTC_OFFSET_HOURS} hours", s_utc, e_utc]
+            if branch_id is not None:
+                sql += " AND branch_id=?"
+                params.append(branch_id)
+            sql += " GROUP BY day, branch_id, payment_method ORDER BY day, branch_id"
+            for row in con.execute(sql, params).fetchall():
+                fetched.setdefault(row[0], []).append(tuple(row))
+        finally:
+            con.close()
+        for d in missing:
+            rows = fetched.get(d.isoformat(), [])
+            if d < today_local:
+                _revenue_day_cache[(branch_id, d)] = rows
+
+    out = []
+    for d in days:
+        if d >= today_local or (branch_id, d) not in _revenue_day_cache:
+            out.extend(fetched.get(d.isoformat(), []))
+        else:
+            out.extend(_revenue_day_cache[(branch_id, d)])
+    return out
+
+
+# ---------------------- Data backend (local file / LAN server) ---------------------------
+# عند ضبط api_url في الإعدادات تتكلم الواجهة مع local_server.py بدل فتح ملف القاعدة
+class LocalBackend:
+    """Direct access to repairdesk.db — used by the single-PC app and by local_server.py."""
+
+    remote = False
+
+    def login(self, username, password):
+        return authenticate_user(username, password)
+
+    def dashboard_stats(self, branch_id):
+        return branch_dashboard_stats(branch_id)
+
+    def owner_dashboard(self):
+        return owner_dashboard_stats()
+
+    def revenue_report(self, start_day, end_day, branch_id=None):
+        return revenue_report(start_day, end_day, branch_id)
+
+    def branches(self):
+        return list_branches()
+
+    def customers(self):
+        return list_customers()
+
+    def receipt_numbers(self):
+        return list_receipt_numbers()
+
+    def palette_rows(self, since_seq=0):
+        return palette_receipt_rows(since_seq)
+
+    def device_stats(self):
+        return device_suggestion_rows()
+
+    def campaign_candidates(self, branch_id, min_days=0):
+        return campaign_candidates(branch_id, min_days)
+
+    def search_receipts(self, branch_id, **filters):
+        return search_receipts(branch_id, **filters)
+
+    def receipts_by_phone_suffix(self, branch_id, digits):
+        return open_receipts_by_phone_suffix(branch_id, digits)
+
+    def device_history(self, serial):
+        return device_history_by_serial(serial)
+
+    def customer_history(self, customer_id=None, phone=""):
+        return customer_history(customer_id, phone)
+
+    def receipt_detail(self, rid):
+        return RECEIPT_DETAIL_CACHE.get(rid, fetch_receipt_detail, receipt_version)
+
+    def receipt_version(self, rid):
+        return receipt_version(rid)
+
+    def receipt_id_by_no(self, receipt_no):
+        return find_receipt_id_by_no(receipt_no)
+
+    def create_receipt(self, branch, username, **fields):
+        return create_receipt(branch, username, **fields)
+
+    def set_status(self, rid, new_status, username):
+        return set_receipt_status(rid, new_status, username)
+
+    def save_payment(self, rid, approved, paid, method):
+        return save_receipt_payment(rid, approved, paid, method)
+
+    def unarchive(self, rid):
+        return unarchive_receipt(rid)
+
+    # --- WhatsApp outbox (per sending host) ---
+    def wa_enqueue(self, phone, body, receipt_id=0, kind="WA", username=""):
+        return wa_enqueue(phone, body, receipt_id, kind, username, WA_HOST)
+
+    def wa_enqueue_many(self, rows):
+        return wa_enqueue_many(rows)
+
+    def wa_claim(self, host):
+        return _wa_claim_next(host)
+
+    def wa_mark_attempted(self, oid):
+        return _wa_mark_attempted(oid)
+
+    def wa_finish(self, row, ok, error=""):
+        return _wa_finish(row, ok, error)
+
+    def wa_reset_sending(self, host):
+        return wa_reset_sending(host)
+
+    def wa_stats(self, host):
+        return wa_outbox_stats(host)
+
+    def wa_retry_failed(self, host):
+        return wa_retry_failed(host)
+
+    def campaign_recipients(self, kind, candidates, min_days=0):
+        return campaign_recipients(kind, candidates, min_days)
+
+    def campaign_progress(self, campaign):
+        return campaign_progress(campaign)
+
+
+class RemoteBackend:
+    """Same interface as LocalBackend, over the JSON API served by local_server.py."""
+
+    remote = True
+
+    def __init__(self, base_url: str, token: str = "", timeout: float = 10.0):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def _call(self, method: str, path: str, payload=None, params=None):
+        import urllib.request, urllib.error
+
+        url = f"{self.base_url}/api{path}"
+        if params:
+            url += "?" + ul.urlencode(params)
+        data = None
+        headers = {"Accept": "application/json"}
+        if payload is not None:
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        if self.token:
+            headers["X-Api-Token"] = self.token
+        req = urllib.request.Request(url, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                body = json.loads(resp.read().decode("utf-8") or "null")
+        except urllib.error.HTTPError as e:
+            try:
+                msg = json.loads(e.read().decode("utf-8")).get("msg", str(e))
+            except Exception:
+                msg = str(e)
+            if e.code == 404:
+                return None
+            raise RuntimeError(msg) from e
+        return body
+
+    def login(self, username, password):
+        res = self._call("POST", "/login", {"username": username, "password": password})
+        if not res:
+            return None
+        return res["user"], res["branch"]
+
+    def dashboard_stats(self, branch_id):
+        return self._call("GET", f"/branches/{branch_id}/dashboard")
+
+    def owner_dashboard(self):
+        return self._call("GET", "/owner/dashboard")
+
+    def revenue_report(self, start_day, end_day, branch_id=None):
+        params = {"start": start_day.isoformat(), "end": end_day.isoformat()}
+        if branch_id is not None:
+            params["branch_id"] = branch_id
+        return [tuple(r) for r in self._call("GET", "/reports/revenue", params=params)]
+
+    def branches(self):
+        return self._call("GET", "/branches")
+
+    def customers(self):
+        return [tuple(r) for r in self._call("GET", "/customers")]
+
+    def receipt_numbers(self):
+        return [tuple(r) for r in self._call("GET", "/receipts/numbers")]
+
+    def palette_rows(self, since_seq=0):
+        res = self._call("GET", "/palette/receipts", params={"since": since_seq})
+        res["rows"] = [tuple(r) for r in res["rows"]]
+        return res
+
+    def device_stats(self):
+        return [tuple(r) for r in self._call("GET", "/devices/stats")]
+
+    def campaign_candidates(self, branch_id, min_days=0):
+        return self._call(
+            "GET",
+            "/campaigns/candidates",
+            params={"branch_id": branch_id, "min_days": min_days},
+        )
+
+    def search_receipts(self, branch_id, **filters):
+        params = {"branch_id": branch_id}
+        params.update(
+            {k: int(v) if isinstance(v, bool) else v for k, v in filters.items()}
+        )
+        return [tuple(r) for r in self._call("GET", "/receipts", params=params)]
+
+    def device_history(self, serial):
+        return self._call("GET", "/devices/history", params={"serial": serial}) or []
+
+    def customer_history(self, customer_id=None, phone=""):
+        params = {"id": customer_id} if customer_id is not None else {"phone": phone}
+        return self._call("GET", "/customers/history", params=params)
+
+    def receipts_by_phone_suffix(self, branch_id, digits):
+        rows = self._call(
+            "GET",
+            "/receipts/by-phone-suffix",
+            params={"branch_id": branch_id, "digits": digits},
+        )
+        return [tuple(r) for r in rows or []]
+
+    def receipt_detail(self, rid):
+        def fetch(rid):
+            detail = self._call("GET", f"/receipts/{rid}")
+            if detail:
+                detail["log"] = [tuple(x) for x in detail.get("log", [])]
+            return detail
+
+        return RECEIPT_DETAIL_CACHE.get(rid, fetch, self.receipt_version)
+
+    def receipt_version(self, rid):
+        res = self._call("GET", f"/receipts/{rid}/version")
+        return tuple(res["version"]) if res and res["version"] else None
+
+    def receipt_id_by_no(self, receipt_no):
+        res = self._call(
+            "GET", f"/receipts/by-no/{ul.quote(receipt_no.strip(), safe='')}"
+        )
+        return res["id"] if res else None
+
+    def create_receipt(self, branch, username, **fields):
+        res = self._call(
+            "POST", "/receipts", {"branch": branch, "username": username, **fields}
+        )
+        # قد يتغير اسم العميل في سنداته السابقة
+        RECEIPT_DETAIL_CACHE.invalidate()
+        return res
+
+    def set_status(self, rid, new_status, username):
+        RECEIPT_DETAIL_CACHE.invalidate(rid)
+        try:
+            res = self._call(
+                "POST",
+                f"/receipts/{rid}/status",
+                {"status": new_status, "username": username},
+            )
+        finally:
+            # تحميل مسبق أثناء الطلب قد يخزن النسخة السابقة
+            RECEIPT_DETAIL_CACHE.invalidate(rid)
+        return res.get("previous") if res else None
+
+    def save_payment(self, rid, approved, paid, method):
+        RECEIPT_DETAIL_CACHE.invalidate(rid)
+        try:
+            res = self._call(
+                "POST",
+                f"/receipts/{rid}/payment",
+                {"approved": approved, "paid": paid, "method": method},
+            )
+        finally:
+            RECEIPT_DETAIL_CACHE.invalidate(rid)
+        return res.get("paid_flag", 0) if res else 0
+
+    def unarchive(self, rid):
+        res = self._call("POST", f"/receipts/{rid}/unarchive", {})
+        RECEIPT_DETAIL_CACHE.invalidate(rid)
+        return bool(res and res.get("ok"))
+
+    # --- WhatsApp outbox: الطابور على الخادم، الإرسال من واتساب هذا الجهاز ---
+    def wa_enqueue(self, phone, body, receipt_id=0, kind="WA", username=""):
+        res = self._call(
+            "POST",
+            "/wa/outbox",
+            {
+                "phone": phone,
+                "body": body,
+                "receipt_id": receipt_id,
+                "kind": kind,
+                "username": username,
+                "host": WA_HOST,
+            },
+        )
+        _wa_wake.set()
+        return res["id"]
+
+    def wa_enqueue_many(self, rows):
+        res = self._call("POST", "/wa/outbox/batch", {"rows": [list(r) for r in rows]})
+        _wa_wake.set()
+        return res["queued"]
+
+    def wa_claim(self, host):
+        return self._call("POST", "/wa/outbox/claim", {"host": host})
+
+    def wa_mark_attempted(self, oid):
+        self._call("POST", "/wa/outbox/attempted", {"id": int(oid)})
+
+    def wa_finish(self, row, ok, error=""):
+        self._call(
+            "POST", "/wa/outbox/finish", {"row": list(row), "ok": ok, "error": error}
+        )
+        RECEIPT_DETAIL_CACHE.invalidate(row[1])
+
+    def wa_reset_sending(self, host):
+        return self._call("POST", "/wa/outbox/reset", {"host": host})["reset"]
+
+    def wa_stats(self, host):
+        return self._call("GET", "/wa/outbox/stats", params={"host": host}) or {}
+
+    def wa_retry_failed(self, host):
+        return self._call("POST", "/wa/outbox/retry", {"host": host})["retried"]
+
+    def campaign_recipients(self, kind, candidates, min_days=0):
+        return self._call(
+            "POST",
+            "/campaigns/recipients",
+            {"kind": kind, "candidates": candidates, "min_days": min_days},
+        )
+
+    def campaign_progress(self, campaign):
+        return self._call("GET", "/campaigns/progress", params={"campaign": campaign})
+
+
+def get_backend():
+    url = (SETTINGS.get("api_url") or "").strip()
+    if url:
+        return RemoteBackend(url, SETTINGS.get("api_token", ""))
+    return LocalBackend()
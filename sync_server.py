@@ -0,0 +1,198 @@
+# خادم المكتب الرئيسي (بديل محلي للتجربة): يستقبل دفعات change_journal من الفروع
+# تشغيل:  python sync_server.py  ثم لكل فرع: python sync_server.py --add-shop <رمز الفرع>
+# وضبط sync_url و sync_token (من الملف الناتج) في config.json للفرع
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import zlib
+from pathlib import Path
+
+from flask import Flask, jsonify, request
+
+app = Flask(__name__)
+
+HQ_DB_PATH = os.environ.get("REPAIRDESK_HQ_DB", "headoffice.db")
+_write_lock = threading.Lock()
+
+HQ_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows(
+  shop_id TEXT NOT NULL,
+  tbl TEXT NOT NULL,
+  row_id INTEGER NOT NULL,
+  op TEXT NOT NULL,
+  at_utc TEXT NOT NULL,
+  payload TEXT NOT NULL,
+  PRIMARY KEY(shop_id, tbl, row_id)
+);
+CREATE TABLE IF NOT EXISTS shops(
+  shop_id TEXT PRIMARY KEY,
+  last_ack INTEGER NOT NULL DEFAULT 0,
+  last_sync_utc TEXT
+);
+-- رمز لكل فرع: الفرع يُعرف من رمزه لا من shop_id داخل الدفعة (نخزن البصمة فقط)
+CREATE TABLE IF NOT EXISTS shop_tokens(
+  token_sha TEXT PRIMARY KEY,
+  shop_id TEXT NOT NULL UNIQUE
+);
+"""
+
+
+def hq_conn(path=None):
+    con = sqlite3.connect(path or HQ_DB_PATH, timeout=5)
+    con.executescript(HQ_SCHEMA)
+    return con
+
+
+def _token_sha(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def issue_shop_token(con, shop_id: str) -> str:
+    """New sync token for shop_id (replaces its previous one)."""
+    token = secrets.token_urlsafe(24)
+    con.execute("DELETE FROM shop_tokens WHERE shop_id=?", (shop_id,))
+    con.execute(
+        "INSERT INTO shop_tokens(token_sha, shop_id) VALUES(?,?)",
+        (_token_sha(token), shop_id),
+    )
+    con.commit()
+    return token
+
+
+def shop_for_token(con, token: str) -> str | None:
+    if not token:
+        return None
+    row = con.execute(
+        "SELECT shop_id FROM shop_tokens WHERE token_sha=?", (_token_sha(token),)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def apply_sync_batch(con, doc: dict, shop_id: str) -> int:
+    """
+    Upsert one batch of shop_id (the authenticated shop) into the consolidated store
+    and return the id to acknowledge; doc["shop_id"] is ignored.
+    """
+    entries = doc.get("entries", [])
+    if not entries:
+        return 0
+    con.executemany(
+        """
+        INSERT INTO rows(shop_id,tbl,row_id,op,at_utc,payload) VALUES(?,?,?,?,?,?)
+        ON CONFLICT(shop_id,tbl,row_id) DO UPDATE SET
+          op=excluded.op, at_utc=excluded.at_utc, payload=excluded.payload
+        WHERE excluded.at_utc >= rows.at_utc
+        """,
+        [
+            (
+                shop_id,
+                e["tbl"],
+                e["row_id"],
+                e["op"],
+                e["at_utc"],
+                json.dumps(e["row"], ensure_ascii=False),
+            )
+            for e in entries
+        ],
+    )
+    ack = max(e["id"] for e in entries)
+    con.execute(
+        """
+        INSERT INTO shops(shop_id,last_ack,last_sync_utc) VALUES(?,?,?)
+        ON CONFLICT(shop_id) DO UPDATE SET
+          last_ack=MAX(last_ack, excluded.last_ack), last_sync_utc=excluded.last_sync_utc
+        """,
+        (shop_id, ack, datetime.datetime.now(datetime.UTC).isoformat()),
+    )
+    con.commit()
+    return ack
+
+
+def local_sender(path=None):
+    """In-process stand-in for the HTTP transport: repairdesk_data.sync_push(send=local_sender(path))."""
+
+    def send(body: bytes, shop_id: str) -> dict:
+        doc = json.loads(zlib.decompress(body).decode("utf-8"))
+        con = hq_conn(path)
+        try:
+            return {"ack": apply_sync_batch(con, doc, shop_id)}
+        finally:
+            con.close()
+
+    return send
+
+
+@app.route("/")
+def home():
+    return jsonify({"status": "running", "message": "Head-office sync active ✅"})
+
+
+@app.route("/sync/push", methods=["POST"])
+def push():
+    con = hq_conn()
+    try:
+        shop_id = shop_for_token(con, request.headers.get("X-Sync-Token", ""))
+        if not shop_id:
+            return jsonify({"ok": False, "msg": "⛔ رمز المزامنة غير صحيح"}), 401
+        raw = request.get_data()
+        if request.headers.get("Content-Encoding") == "deflate":
+            raw = zlib.decompress(raw)
+        doc = json.loads(raw.decode("utf-8"))
+        with _write_lock:
+            ack = apply_sync_batch(con, doc, shop_id)
+    finally:
+        con.close()
+    return jsonify({"ok": True, "ack": ack})
+
+
+@app.route("/sync/status")
+def status():
+    con = hq_conn()
+    try:
+        shops = con.execute(
+            "SELECT shop_id,last_ack,last_sync_utc FROM shops ORDER BY shop_id"
+        ).fetchall()
+        counts = con.execute(
+            "SELECT shop_id,tbl,COUNT(*) FROM rows GROUP BY shop_id,tbl"
+        ).fetchall()
+    finally:
+        con.close()
+    return jsonify({"shops": shops, "rows": counts})
+
+
+def _write_private(path: Path, text: str):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text + "\n")
+    os.chmod(path, 0o600)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "--add-shop",
+        metavar="SHOP_ID",
+        help="issue a sync token for a branch (written to SHOP_ID.sync_token)",
+    )
+    args = ap.parse_args()
+    if args.add_shop:
+        con = hq_conn()
+        try:
+            token = issue_shop_token(con, args.add_shop)
+        finally:
+            con.close()
+        path = Path(HQ_DB_PATH).with_name(f"{args.add_shop}.sync_token")
+        _write_private(path, token)
+        print(
+            f"Sync token for {args.add_shop} saved to {path} (sync_token في config.json للفرع)"
+        )
+        raise SystemExit(0)
+    app.run(
+        host=os.environ.get("REPAIRDESK_HQ_HOST", "0.0.0.0"),
+        port=int(os.environ.get("REPAIRDESK_HQ_PORT", "8800")),
+    )
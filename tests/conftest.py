@@ -0,0 +1,38 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# repairdesk_data ينشئ مجلد البيانات ويقرأ الإعدادات عند الاستيراد: نوجهه لمجلد مؤقت
+_HOME = tempfile.mkdtemp(prefix="repairdesk_tests_")
+os.environ["HOME"] = _HOME
+os.environ["USERPROFILE"] = _HOME
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import repairdesk_data
+
+
+@pytest.fixture
+def app_db(tmp_path, monkeypatch):
+    """A fresh shop DB (and archive path) under tmp_path; returns the data module."""
+    data = repairdesk_data
+    monkeypatch.setattr(data, "DB_PATH", tmp_path / "repairdesk.db")
+    monkeypatch.setattr(data, "ARCHIVE_DB_PATH", tmp_path / "archive.db")
+    data.RECEIPT_DETAIL_CACHE.invalidate()
+    data.db_init()
+    yield data
+    data.RECEIPT_DETAIL_CACHE.invalidate()
+
+
+@pytest.fixture
+def branch(app_db):
+    con = app_db.db_conn()
+    try:
+        bid, code = con.execute(
+            "SELECT id, code FROM branches ORDER BY id LIMIT 1"
+        ).fetchone()
+    finally:
+        con.close()
+    return {"id": bid, "code": code}
@@ -0,0 +1,48 @@
+"""حملات واتساب: إشعار الجاهزية من نافذة السند لا يتكرر في حملة "ready"."""
+
+import pytest
+
+
+@pytest.fixture
+def receipt(app_db, branch):
+    return app_db.create_receipt(
+        branch,
+        "check",
+        name="Campaign check",
+        phone="0500000001",
+        dev_type="Phone",
+        brand="Test",
+        model="X",
+    )
+
+
+def _ready_recipients(main, branch, rid):
+    candidates = [c for c in main.campaign_candidates(branch["id"]) if c["id"] == rid]
+    assert candidates, "receipt should be a ready candidate"
+    return main.campaign_recipients("ready", candidates)
+
+
+def test_send_ready_then_campaign_does_not_repeat(app_db, branch, receipt):
+    backend = app_db.LocalBackend()
+    backend.set_status(receipt["id"], "قيد الفحص", "check")
+    app_db.notify_ready(backend, receipt["id"], "0500000001", "ready", "check")
+
+    assert _ready_recipients(app_db, branch, receipt["id"]) == []
+
+
+def test_notice_queued_just_before_ready_still_counts(app_db, branch, receipt):
+    backend = app_db.LocalBackend()
+    backend.set_status(receipt["id"], "قيد الفحص", "check")
+    backend.wa_enqueue("0500000001", "ready", receipt["id"], "WA_READY", "check")
+    backend.set_status(receipt["id"], app_db.READY_STATUS, "check")
+
+    assert _ready_recipients(app_db, branch, receipt["id"]) == []
+
+
+def test_notice_from_an_earlier_ready_round_is_not_enough(app_db, branch, receipt):
+    backend = app_db.LocalBackend()
+    app_db.notify_ready(backend, receipt["id"], "0500000001", "ready", "check")
+    backend.set_status(receipt["id"], "قيد الفحص", "check")
+    backend.set_status(receipt["id"], app_db.READY_STATUS, "check")
+
+    assert len(_ready_recipients(app_db, branch, receipt["id"])) == 1
@@ -0,0 +1,108 @@
+"""مخرجات ZPL / ESC-POS بايت ببايت لعينات ثابتة (تغيير المُولّد يجب أن يحدّث هذه البايتات عمداً)."""
+
+import pytest
+
+import main
+
+SAMPLE = ("RD-A-000123", "+966 50 123 4567", "ATTA Repair")
+ARABIC_COMPANY = "ركن الذاكرة"
+# صورة نقطية ثابتة 16×2 بدل رسم الخط (الخطوط وPillow تختلف من جهاز لآخر)
+FAKE_BITMAP = (2, 2, b"\xff\x00\x0f\xf0")
+
+
+@pytest.fixture
+def golden_zpl():
+    return (
+        b"^XA^CI28^PW320^LL176^LH0,0\n"
+        b"^FO12,8^A0N,34,34^FH_^FDRD-A-000123^FS\n"
+        b"^FO12,46^A0N,26,26^FH_^FD966501234567^FS\n"
+        b"^FO12,76^A0N,20,20^FH_^FDATTA Repair^FS\n"
+        b"^FO232,8^BQN,2,3^FH_^FDMA,RD-A-000123^FS\n"
+        b"^FO12,104^BY2^BCN,56,N,N,N^FH_^FDRD-A-000123^FS\n"
+        b"^XZ"
+    )
+
+
+@pytest.fixture
+def golden_escpos():
+    return (
+        b"\x1b@\x1ba\x01\x1d!\x11RD-A-000123\n\x1d!\x00966501234567\nATTA Repair\n"
+        b"\x1dh8\x1dw\x02\x1dH\x00\x1dkI\r{BRD-A-000123"
+        b"\x1d(k\x04\x001A2\x00\x1d(k\x03\x001C\x04\x1d(k\x03\x001E0"
+        b"\x1d(k\x0e\x001P0RD-A-000123\x1d(k\x03\x001Q0\n\x1dVB\x00"
+    )
+
+
+@pytest.fixture
+def golden_zpl_graphic():
+    return (
+        b"^XA^CI28^PW320^LL176^LH0,0\n"
+        b"^FO12,8^A0N,34,34^FH_^FDA7^FS\n"
+        b"^FO12,46^A0N,26,26^FH_^FD0501^FS\n"
+        b"^FO12,76^GFA,4,4,2,FF000FF0^FS\n"
+        b"^FO12,104^BY2^BCN,56,N,N,N^FH_^FDA7^FS\n"
+        b"^XZ"
+    )
+
+
+@pytest.fixture
+def golden_escpos_graphic():
+    return (
+        b"\x1b@\x1ba\x01\x1d!\x11A7\n\x1d!\x000501\n"
+        b"\x1dv0\x00\x02\x00\x02\x00\xff\x00\x0f\xf0\n\x1dVB\x00"
+    )
+
+
+@pytest.fixture
+def no_bitmap(monkeypatch):
+    monkeypatch.setattr(main, "_label_text_bitmap", lambda text: None)
+
+
+@pytest.fixture
+def fake_bitmap(monkeypatch):
+    monkeypatch.setattr(main, "_label_text_bitmap", lambda text: FAKE_BITMAP)
+
+
+def test_zpl_golden(golden_zpl):
+    assert main.render_label_zpl(*SAMPLE, qr=SAMPLE[0]) == golden_zpl
+
+
+def test_escpos_golden(golden_escpos):
+    assert main.render_label_escpos(*SAMPLE, qr=SAMPLE[0]) == golden_escpos
+
+
+def test_arabic_company_as_graphic(
+    fake_bitmap, golden_zpl_graphic, golden_escpos_graphic
+):
+    assert main.render_label_zpl("A7", "0501", ARABIC_COMPANY) == golden_zpl_graphic
+    assert (
+        main.render_label_escpos("A7", "0501", ARABIC_COMPANY, barcode=False)
+        == golden_escpos_graphic
+    )
+
+
+@pytest.mark.parametrize("fmt", sorted(main.LABEL_RENDERERS))
+def test_arabic_company_falls_back_to_latin(no_bitmap, monkeypatch, fmt):
+    monkeypatch.setitem(main.SETTINGS, "company_latin", "Rukn Memory")
+    out = main.LABEL_RENDERERS[fmt]("A7", "0501", ARABIC_COMPANY)
+    assert b"Rukn Memory" in out
+    assert b"?" not in out
+
+
+@pytest.mark.parametrize("fmt", sorted(main.LABEL_RENDERERS))
+def test_arabic_company_line_dropped_without_fallback(no_bitmap, monkeypatch, fmt):
+    monkeypatch.setitem(main.SETTINGS, "company_latin", "")
+    out = main.LABEL_RENDERERS[fmt]("A7", "0501", ARABIC_COMPANY)
+    assert b"?" not in out
+    assert out == main.LABEL_RENDERERS[fmt]("A7", "0501", "")
+
+
+def test_batch_carries_receipt_qr(monkeypatch):
+    monkeypatch.setitem(main.SETTINGS, "company", SAMPLE[2])
+    monkeypatch.setitem(main.SETTINGS, "label_qr", True)
+    out = main.render_label_batch([("A7", "0501"), ("A8", "0502")], "escpos")
+    assert out == main.render_label_escpos(
+        "A7", "0501", SAMPLE[2], qr="A7"
+    ) + main.render_label_escpos("A8", "0502", SAMPLE[2], qr="A8")
+    monkeypatch.setitem(main.SETTINGS, "label_qr", False)
+    assert b"(k" not in main.render_label_batch([("A7", "0501")], "escpos")
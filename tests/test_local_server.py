@@ -0,0 +1,56 @@
+"""خادم المحل: كل المسارات خلف الرمز، والرمز لا يخرج إلا لملف خاص بحساب المحل."""
+
+import os
+import stat
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("flask")
+
+import local_server
+
+
+@pytest.fixture
+def server(app_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(local_server, "API_TOKEN", "")
+    monkeypatch.setattr(local_server, "API_TOKEN_PATH", tmp_path / "api_token.txt")
+    monkeypatch.setattr(local_server, "backend", app_db.LocalBackend())
+    monkeypatch.setattr(app_db, "save_settings", lambda s: None)
+    monkeypatch.setitem(app_db.SETTINGS, "api_token", "")
+    return local_server
+
+
+def test_server_does_not_import_the_gui(tmp_path):
+    code = "import sys, local_server; sys.exit('tkinter' in sys.modules)"
+    env = dict(os.environ, HOME=str(tmp_path), USERPROFILE=str(tmp_path))
+    root = Path(local_server.__file__).parent
+    subprocess.run([sys.executable, "-c", code], cwd=root, env=env, check=True)
+
+
+def test_no_token_rejects_every_caller(server):
+    client = server.app.test_client()
+    assert client.get("/api/branches").status_code == 401
+    assert client.get("/api/branches", headers={"X-Api-Token": ""}).status_code == 401
+
+
+def test_token_written_to_private_file_not_stdout(server, capsys):
+    token = server.ensure_api_token()
+    assert token
+    assert server.API_TOKEN_PATH.read_text(encoding="utf-8").strip() == token
+    assert stat.S_IMODE(server.API_TOKEN_PATH.stat().st_mode) == 0o600
+    assert token not in capsys.readouterr().out
+
+    client = server.app.test_client()
+    assert client.get("/api/branches", headers={"X-Api-Token": "x"}).status_code == 401
+    assert (
+        client.get("/api/branches", headers={"X-Api-Token": token}).status_code == 200
+    )
+
+
+def test_health_does_not_leak_paths(server):
+    res = server.app.test_client().get("/api/health")
+    assert res.status_code == 200
+    assert res.json == {"status": "running"}
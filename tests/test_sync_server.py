@@ -0,0 +1,79 @@
+"""مزامنة المكتب الرئيسي: الفرع يُعرف من رمزه، وأي رمز مفقود أو خاطئ يُرفض."""
+
+import json
+import zlib
+
+import pytest
+
+pytest.importorskip("flask")
+
+import sync_server
+
+
+@pytest.fixture
+def hq(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync_server, "HQ_DB_PATH", str(tmp_path / "headoffice.db"))
+    return sync_server
+
+
+def _batch(shop_id="claimed-shop"):
+    entry = {
+        "id": 7,
+        "tbl": "receipts",
+        "row_id": 1,
+        "op": "I",
+        "at_utc": "2026-01-01T00:00:00+00:00",
+        "row": {"id": 1},
+    }
+    doc = {"shop_id": shop_id, "entries": [entry]}
+    return zlib.compress(json.dumps(doc).encode("utf-8"))
+
+
+def _push(hq, token=None):
+    headers = {"Content-Encoding": "deflate"}
+    if token is not None:
+        headers["X-Sync-Token"] = token
+    return hq.app.test_client().post("/sync/push", data=_batch(), headers=headers)
+
+
+def _stored_shops(hq):
+    con = hq.hq_conn()
+    try:
+        return [r[0] for r in con.execute("SELECT DISTINCT shop_id FROM rows")]
+    finally:
+        con.close()
+
+
+def test_push_without_valid_token_is_rejected(hq):
+    con = hq.hq_conn()
+    try:
+        hq.issue_shop_token(con, "branch-a")
+    finally:
+        con.close()
+    assert _push(hq).status_code == 401
+    assert _push(hq, "").status_code == 401
+    assert _push(hq, "not-a-token").status_code == 401
+    assert _stored_shops(hq) == []
+
+
+def test_shop_id_comes_from_token_not_payload(hq):
+    con = hq.hq_conn()
+    try:
+        token = hq.issue_shop_token(con, "branch-a")
+    finally:
+        con.close()
+    res = _push(hq, token)
+    assert res.status_code == 200
+    assert res.json["ack"] == 7
+    assert _stored_shops(hq) == ["branch-a"]
+
+
+def test_reissued_token_revokes_the_old_one(hq):
+    con = hq.hq_conn()
+    try:
+        old = hq.issue_shop_token(con, "branch-a")
+        new = hq.issue_shop_token(con, "branch-a")
+    finally:
+        con.close()
+    assert _push(hq, old).status_code == 401
+    assert _push(hq, new).status_code == 200